@@ -21,4 +21,15 @@ TASK_STATUSES_CANCELLED = [
 
 ]
 
+# statuses a task is not changed from
+TASK_STATUSES_CLOSED = [
+    'COMPLETED',
+    'REJECTED'
+] + TASK_STATUSES_CANCELLED
+
+# statuses of the tasks left out of the profit of the worker and customer
+TASK_STATUSES_NOT_PAID = [
+    'REJECTED'
+] + TASK_STATUSES_CANCELLED
+
 TASK_STATUSES = TASK_STATUSES_PROCESS + TASK_STATUSES_FINAL + TASK_STATUSES_CANCELLED
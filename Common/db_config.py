@@ -5,15 +5,32 @@ storage_bucket='mineral-anchor-249706'
 
 
 
-import firebase_admin
-from firebase_admin import credentials
-
 import os
-from firebase_admin import db
-
-cred = credentials.Certificate(os.path.abspath(__file__+ "/../") + '/service.json')
-firebase_admin.initialize_app(cred, {
-    'databaseURL': 'https://mineral-anchor-249706.firebaseio.com/'
-})
-worker_info = db.reference().child('worker_info')
-worker_task = db.reference().child('worker_task')
\ No newline at end of file
+
+
+def connect():
+    """
+    firebase app initialized on the first use of the database
+    :return: root reference
+    """
+    import firebase_admin
+    from firebase_admin import credentials
+    from firebase_admin import db
+
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        cred = credentials.Certificate(os.path.abspath(__file__+ "/../") + '/service.json')
+        firebase_admin.initialize_app(cred, {
+            'databaseURL': 'https://mineral-anchor-249706.firebaseio.com/'
+        })
+    return db.reference()
+
+
+def reference(name):
+    """
+    :param name: worker_info, worker_task or worker_locations
+    :return: reference of the tree from the firebase provider
+    """
+    from Common.providers import providers
+    return providers.get('firebase').child(name)
@@ -0,0 +1,155 @@
+import copy
+import threading
+
+
+def split_path(path):
+    return tuple(item for item in str(path).split('/') if item)
+
+
+class MemoryEvent:
+    """
+    same fields as firebase_admin.db.Event
+    """
+
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class MemoryRegistration:
+
+    def __init__(self, database, listener):
+        self.database = database
+        self.listener = listener
+
+    def close(self):
+        self.database.unlisten(self.listener)
+
+
+class MemoryDatabase:
+    """
+    in-process stand-in of the firebase realtime database for the
+    simulations and tests. listeners are called synchronously by the
+    thread that writes
+    """
+
+    def __init__(self):
+        self.tree = {}
+        self.listeners = []
+        self.lock = threading.RLock()
+
+    def reference(self, path=''):
+        return MemoryReference(self, split_path(path))
+
+    def child(self, path):
+        return self.reference(path)
+
+    def get(self, path):
+        with self.lock:
+            node = self.tree
+            for key in path:
+                if not isinstance(node, dict) or key not in node:
+                    return None
+                node = node[key]
+            return copy.deepcopy(node)
+
+    def set(self, path, value):
+        with self.lock:
+            if not path:
+                self.tree = copy.deepcopy(value) or {}
+            elif value is None:
+                self._delete(path)
+            else:
+                node = self.tree
+                for key in path[:-1]:
+                    if not isinstance(node.get(key), dict):
+                        node[key] = {}
+                    node = node[key]
+                node[path[-1]] = copy.deepcopy(value)
+            self._notify(path, value)
+
+    def _delete(self, path):
+        parents = []
+        node = self.tree
+        for key in path[:-1]:
+            if not isinstance(node.get(key), dict):
+                return
+            parents.append((node, key))
+            node = node[key]
+        node.pop(path[-1], None)
+        # empty nodes do not exist in firebase
+        for parent, key in reversed(parents):
+            if parent[key]:
+                break
+            del parent[key]
+
+    def update(self, path, value):
+        """
+        multi-path update, the keys can be paths relative to the reference
+        """
+        with self.lock:
+            for key, item in value.items():
+                self.set(path + split_path(key), item)
+
+    def transaction(self, path, transaction_update):
+        with self.lock:
+            value = transaction_update(self.get(path))
+            self.set(path, value)
+            return value
+
+    def listen(self, path, callback):
+        listener = (path, callback)
+        with self.lock:
+            self.listeners.append(listener)
+            callback(MemoryEvent('put', '/', self.get(path)))
+        return MemoryRegistration(self, listener)
+
+    def unlisten(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def _notify(self, path, value):
+        for listen_path, callback in list(self.listeners):
+            if path[:len(listen_path)] == listen_path:
+                event_path = '/' + '/'.join(path[len(listen_path):])
+                callback(MemoryEvent('put', event_path, copy.deepcopy(value)))
+            elif listen_path[:len(path)] == path:
+                # a parent of the listened node was written
+                callback(MemoryEvent('put', '/', self.get(listen_path)))
+
+
+class MemoryReference:
+    """
+    subset of firebase_admin.db.Reference used by the project
+    """
+
+    def __init__(self, database, path=()):
+        self.database = database
+        self.path = path
+
+    @property
+    def key(self):
+        return self.path[-1] if self.path else None
+
+    def child(self, path):
+        return MemoryReference(self.database, self.path + split_path(path))
+
+    def get(self):
+        return self.database.get(self.path)
+
+    def set(self, value):
+        self.database.set(self.path, value)
+
+    def update(self, value):
+        self.database.update(self.path, value)
+
+    def delete(self):
+        self.database.set(self.path, None)
+
+    def transaction(self, transaction_update):
+        return self.database.transaction(self.path, transaction_update)
+
+    def listen(self, callback):
+        return self.database.listen(self.path, callback)
@@ -0,0 +1,48 @@
+import time
+import itertools
+import threading
+
+
+class MemoryPushService:
+    """
+    in-process stand-in of pyfcm FCMNotification, the messages are kept
+    in `sent` instead of being delivered
+    :param latency: seconds of a simulated request to FCM
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.sent = []
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def notify_single_device(self, registration_id=None, message_title=None,
+                             message_body=None, data_message=None, **kwargs):
+        return self.notify_multiple_devices([registration_id], message_title,
+                                            message_body, data_message)
+
+    def notify_multiple_devices(self, registration_ids=None,
+                                message_title=None, message_body=None,
+                                data_message=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            multicast_id = next(self._ids)
+            for registration_id in registration_ids:
+                self.sent.append({
+                    'registration_id': registration_id,
+                    'message_title': message_title,
+                    'message_body': message_body,
+                    'data_message': data_message,
+                })
+        return {
+            'multicast_ids': [multicast_id],
+            'success': len(registration_ids),
+            'failure': 0,
+            'canonical_ids': 0,
+            'results': [{'message_id': f"memory:{multicast_id}:{position}"}
+                        for position in range(len(registration_ids))],
+            'topic_message_id': None,
+        }
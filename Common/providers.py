@@ -0,0 +1,100 @@
+import os
+import tempfile
+import threading
+
+from django.utils.module_loading import import_string
+
+# factories of the clients by backend, 'memory' is the local stand-in
+BACKENDS = {
+    'live': {
+        'firebase': 'Common.db_config.connect',
+        'fcm': 'Common.providers.fcm_client',
+        'storage': 'Common.providers.cloud_storage',
+    },
+    'memory': {
+        'firebase': 'Common.providers.memory_database',
+        'fcm': 'Common.memory_fcm.MemoryPushService',
+        'storage': 'Common.providers.local_storage',
+    },
+}
+
+
+def fcm_client():
+    from pyfcm import FCMNotification
+    import nowwapi.settings as settings
+    return FCMNotification(
+        api_key=settings.PUSH_NOTIFICATIONS_SETTINGS['FCM_API_KEY'])
+
+
+def cloud_storage():
+    from django.core.files.storage import default_storage
+    return default_storage
+
+
+def memory_database():
+    from Common.memory_db import MemoryDatabase
+    return MemoryDatabase().reference()
+
+
+def local_storage():
+    from django.core.files.storage import FileSystemStorage
+    return FileSystemStorage(
+        location=os.path.join(tempfile.gettempdir(), 'noww_storage'))
+
+
+class ProviderRegistry:
+    """
+    clients of the external services created on the first use.
+    the backend comes from settings.EXTERNAL_SERVICES_BACKEND,
+    a single client can be replaced with `override`
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        """
+        :param factory: callable or dotted path to one
+        """
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = self._instances[name] = self._factory(name)()
+        return instance
+
+    def _factory(self, name):
+        factory = self._factories.get(name)
+        if factory is None:
+            backend = self.backend
+            if backend is None:
+                import nowwapi.settings as settings
+                backend = settings.EXTERNAL_SERVICES_BACKEND
+            factory = BACKENDS[backend][name]
+        return import_string(factory) if isinstance(factory, str) else factory
+
+    def override(self, name, instance):
+        with self._lock:
+            self._instances[name] = instance
+
+    def reset(self, name=None):
+        """
+        drops the created client(s), the next get creates a new one
+        """
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name, None)
+
+
+providers = ProviderRegistry()
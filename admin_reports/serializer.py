@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from noww.models import (
-    Review, User, CustomerReview, Customer, Place, Worker, Task, TaskItem
+    Review, User, CustomerReview, Customer, Place, Worker, Task, TaskItem,
+    DispatchAttempt
 )
 from noww.serializers import (
     TaskSerializer, ServiceSerializer, PlaceSerializer, ProductSerializer
@@ -83,6 +84,15 @@ class ReportTaskSerializer(TaskSerializer):
         # fields = ("task_address", )
 
 
+class ReportDispatchAttemptSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = DispatchAttempt
+        fields = (
+            "worker", "attempt", "status", "offered_at", "answered_at"
+        )
+
+
 class ReportTaskReviewSerializer(ReportTaskSerializer):
     service = ServiceSerializer()
     customer = ReportCustomerSerializer()
@@ -91,6 +101,9 @@ class ReportTaskReviewSerializer(ReportTaskSerializer):
     items = ReportTaskItemSerializer(
         source='tasks', many=True, read_only=True
     )
+    dispatch_attempts = ReportDispatchAttemptSerializer(
+        many=True, read_only=True
+    )
 
     class Meta:
         model = Task
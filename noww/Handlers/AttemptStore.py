@@ -0,0 +1,101 @@
+from django.db.models import Count
+from django.utils import timezone
+
+import noww.models
+
+ATTEMPT_OFFERED = 'OFFERED'
+ATTEMPT_REJECTED = 'REJECTED'
+ATTEMPT_ACCEPTED = 'ACCEPTED'
+ATTEMPT_WITHDRAWN = 'WITHDRAWN'
+ATTEMPT_EXPIRED = 'EXPIRED'
+
+
+class AttemptStore:
+    """
+    server side history of the task offers, one DispatchAttempt row per
+    (task, worker) pair. replaces the `w_rejs` string sent through the
+    push payload and back by the worker application
+    """
+
+    @staticmethod
+    def offered_workers(task_id):
+        """
+        workers offered the task, answered or not
+        :return: set of str worker ids
+        """
+        return AttemptStore.offered_workers_bulk([task_id]) \
+            .get(task_id, set())
+
+    @staticmethod
+    def offered_workers_bulk(task_ids):
+        """
+        offered workers of many tasks in one query
+        :return: dict task_id -> set of str worker ids
+        """
+        offered = {}
+        for task_id, worker_id in noww.models.DispatchAttempt.objects \
+                .filter(task_id__in=task_ids) \
+                .values_list('task_id', 'worker_id'):
+            offered.setdefault(task_id, set()).add(str(worker_id))
+        return offered
+
+    @staticmethod
+    def offer(task_id, worker_id, status=ATTEMPT_OFFERED, answered_at=None):
+        attempt = noww.models.DispatchAttempt.objects \
+            .filter(task_id=task_id).count() + 1
+        offer, _ = noww.models.DispatchAttempt.objects.get_or_create(
+            task_id=task_id, worker_id=worker_id,
+            defaults={'attempt': attempt, 'status': status,
+                      'answered_at': answered_at}
+        )
+        return offer
+
+    @staticmethod
+    def answer(task_id, worker_id, status):
+        """
+        stores the answer of the worker, an answer without the offer
+        (sent by an old application) is stored as well
+        """
+        now = timezone.now()
+        updated = noww.models.DispatchAttempt.objects \
+            .filter(task_id=task_id, worker_id=worker_id) \
+            .update(status=status, answered_at=now)
+        if not updated:
+            AttemptStore.offer(task_id, worker_id, status, now)
+
+    @staticmethod
+    def has_pending(task_id):
+        """
+        offers of the task still waiting for an answer
+        """
+        return noww.models.DispatchAttempt.objects \
+            .filter(task_id=task_id, status=ATTEMPT_OFFERED).exists()
+
+    @staticmethod
+    def withdraw_pending(task_id):
+        """
+        withdraws the unanswered offers of the task
+        :return: list of the worker ids
+        """
+        pending = noww.models.DispatchAttempt.objects \
+            .filter(task_id=task_id, status=ATTEMPT_OFFERED)
+        worker_ids = list(pending.values_list('worker_id', flat=True))
+        pending.filter(worker_id__in=worker_ids) \
+            .update(status=ATTEMPT_WITHDRAWN, answered_at=timezone.now())
+        return worker_ids
+
+    @staticmethod
+    def count(task_id):
+        return noww.models.DispatchAttempt.objects \
+            .filter(task_id=task_id).count()
+
+    @staticmethod
+    def summary(task_id):
+        """
+        count of the attempts by status
+        """
+        return {
+            item['status']: item['count'] for item in
+            noww.models.DispatchAttempt.objects.filter(task_id=task_id)
+            .values('status').annotate(count=Count('id'))
+        }
@@ -0,0 +1,88 @@
+import logging
+
+import noww.models
+import nowwapi.settings as settings
+from noww.Handlers.AttemptStore import AttemptStore
+from noww.Handlers.Metrics import metrics
+from noww.Handlers.ReadinessCache import get_readiness
+from noww.Handlers.WorkerHandler import WorkerHandlerClass
+
+logger = logging.getLogger()
+
+
+class BatchDispatcher:
+    """
+    dispatch of a burst of tasks at once: the nearest ready workers of all
+    tasks are collected and the task -> worker assignment is solved for
+    the whole batch, so a worker is offered one task of the batch only
+    """
+
+    @staticmethod
+    def assign(candidates):
+        """
+        greedy min-distance matching: the (task, worker) pairs of all
+        tasks are taken by increasing distance, each task and each worker
+        is matched once
+        :param candidates: dict task_id -> list of dicts with id, loc and
+                           distance keys
+        :return: dict task_id -> candidate dict
+        """
+        pairs = sorted(
+            (candidate['distance'], task_id, candidate['id'], position)
+            for task_id, task_candidates in candidates.items()
+            for position, candidate in enumerate(task_candidates)
+        )
+        assigned = {}
+        used = set()
+        for _, task_id, worker_id, position in pairs:
+            if task_id in assigned or worker_id in used:
+                continue
+            assigned[task_id] = candidates[task_id][position]
+            used.add(worker_id)
+        return assigned
+
+    @staticmethod
+    def dispatch(task_ids):
+        """
+        :param task_ids: list of task ids
+        :return: dict task_id -> worker dict (worker_id, loc, distance),
+                 tasks without a ready worker are absent
+        """
+        readiness = get_readiness()
+        readiness.refresh_if_stale()
+        per_task = settings.DISPATCH_SETTINGS['BATCH_CANDIDATES']
+
+        tasks = noww.models.Task.objects.select_related('task_address') \
+            .filter(pk__in=task_ids)
+        offered = AttemptStore.offered_workers_bulk(task_ids)
+        locations = {}
+        candidates = {}
+        for task in tasks:
+            locations[task.pk] = (float(task.task_address.latitude),
+                                  float(task.task_address.longitude))
+            candidates[task.pk] = WorkerHandlerClass.search_workers(
+                *locations[task.pk], per_task,
+                exclude=offered.get(task.pk, ()),
+                **readiness.search_filter())
+
+        assigned = BatchDispatcher.assign(candidates)
+
+        # tasks whose candidates all went to the others search further
+        used = {candidate['id'] for candidate in assigned.values()}
+        for task_id in candidates:
+            if task_id in assigned:
+                continue
+            found = WorkerHandlerClass.search_workers(
+                *locations[task_id], 1,
+                exclude=used | offered.get(task_id, set()),
+                **readiness.search_filter())
+            if found:
+                assigned[task_id] = found[0]
+                used.add(found[0]['id'])
+
+        metrics.observe('dispatch.batch_size', len(candidates))
+        return {
+            task_id: {"worker_id": candidate['id'], "loc": candidate['loc'],
+                      "distance": candidate['distance']}
+            for task_id, candidate in assigned.items()
+        }
@@ -0,0 +1,81 @@
+import json
+import time
+import hashlib
+import threading
+
+from django.db.models.signals import post_delete, post_save
+
+import noww.models
+import nowwapi.settings as settings
+
+FIELDS = ('id', 'name', 'type', 'value', 'sequence')
+
+
+class DictionaryCache:
+    """
+    in-process copy of the Dictionary table indexed by name and by type.
+    it is reloaded after a save/delete of a row in this process and
+    every ttl seconds for the changes made by the other processes.
+    the version is a hash of the content, the same in all processes
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        rows = list(noww.models.Dictionary.objects
+                    .order_by('type', 'sequence', 'pk').values(*FIELDS))
+        names = {}
+        types = {}
+        for row in rows:
+            # names are not unique in the table, the first one is taken
+            names.setdefault(row['name'], row)
+            types.setdefault(row['type'], []).append(row)
+        return {
+            'version': hashlib.sha1(
+                json.dumps(rows, sort_keys=True).encode()).hexdigest()[:16],
+            'rows': rows,
+            'names': names,
+            'types': types,
+            'loaded_at': time.time(),
+        }
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None or time.time() - snapshot['loaded_at'] > self.ttl:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or \
+                        time.time() - snapshot['loaded_at'] > self.ttl:
+                    snapshot = self._snapshot = self.load()
+        return snapshot
+
+    @property
+    def version(self):
+        return self.snapshot()['version']
+
+    def get(self, name):
+        """
+        :return: dict of the row or None
+        """
+        return self.snapshot()['names'].get(name)
+
+    def by_type(self, type_):
+        return self.snapshot()['types'].get(type_, [])
+
+    def all(self):
+        return self.snapshot()['rows']
+
+    def invalidate(self, **kwargs):
+        self._snapshot = None
+
+    def connect(self):
+        post_save.connect(self.invalidate, sender=noww.models.Dictionary,
+                          dispatch_uid='dictionary_cache_save')
+        post_delete.connect(self.invalidate, sender=noww.models.Dictionary,
+                            dispatch_uid='dictionary_cache_delete')
+
+
+dictionary_cache = DictionaryCache(settings.DICTIONARY_CACHE_TTL)
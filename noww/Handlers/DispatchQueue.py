@@ -0,0 +1,260 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+import noww.models
+import nowwapi.settings as settings
+from noww.Handlers.Metrics import metrics
+from noww.Handlers.MetricsSnapshots import MetricsSnapshots
+from noww.Handlers.PushOutbox import PushOutbox
+from noww.Handlers.GeoQueryCache import geo_query_cache
+
+logger = logging.getLogger()
+
+JOB_PENDING = 'PENDING'
+JOB_RUNNING = 'RUNNING'
+JOB_DONE = 'DONE'
+JOB_FAILED = 'FAILED'
+
+
+class NoWorkerFound(LookupError):
+    """
+    no ready worker for the task yet, the job is run again later
+    """
+
+
+class DispatchQueue:
+    """
+    durable queue of the task dispatches. jobs are rows of DispatchJob
+    written with the task, `manage.py run_dispatch` claims and runs them.
+    with DISPATCH_SETTINGS['QUEUE'] = 'inline' the job is run right away
+    in the calling process (local stand-in for tests and scripts).
+    a failed job is retried with a backoff up to QUEUE_MAX_ATTEMPTS times,
+    a job without a ready worker is rescheduled without counting it
+    """
+
+    @staticmethod
+    def enqueue(task_id):
+        job = noww.models.DispatchJob.objects.create(task_id=task_id)
+        if settings.DISPATCH_SETTINGS['QUEUE'] == 'inline':
+            transaction.on_commit(lambda: DispatchQueue.run_inline(job.pk))
+        return job
+
+    @staticmethod
+    def run_inline(job_id):
+        updated = noww.models.DispatchJob.objects \
+            .filter(pk=job_id, status=JOB_PENDING) \
+            .update(status=JOB_RUNNING, started_at=timezone.now(),
+                    attempts=F('attempts') + 1)
+        if updated:
+            DispatchQueue.run(noww.models.DispatchJob.objects.get(pk=job_id))
+
+    @staticmethod
+    def claim(batch_size=10):
+        """
+        takes the oldest pending jobs, concurrent workers skip locked rows
+        :return: list of DispatchJob
+        """
+        with transaction.atomic():
+            jobs = list(
+                noww.models.DispatchJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(status=JOB_PENDING, next_run_at__lte=timezone.now())
+                .order_by('created_at')[:batch_size]
+            )
+            if jobs:
+                now = timezone.now()
+                noww.models.DispatchJob.objects \
+                    .filter(pk__in=[job.pk for job in jobs]) \
+                    .update(status=JOB_RUNNING, started_at=now,
+                            attempts=F('attempts') + 1)
+                for job in jobs:
+                    job.status = JOB_RUNNING
+                    job.started_at = now
+                    job.attempts += 1
+        return jobs
+
+    @staticmethod
+    def waiting(task_ids):
+        """
+        :return: set of the ids of the tasks still waiting for a worker
+        """
+        return set(noww.models.Task.objects.filter(
+            pk__in=task_ids, status='CREATED', worker__isnull=True
+        ).values_list('pk', flat=True))
+
+    @staticmethod
+    def run(job):
+        from noww.Handlers.TokenHandler import OrderRequest
+
+        try:
+            task = noww.models.Task.objects.select_related('task_address') \
+                .get(pk=job.task_id)
+            if task.status != 'CREATED' or task.worker_id is not None:
+                # taken or closed since the job was queued
+                return DispatchQueue.finish(job)
+            OrderRequest(lat=task.task_address.latitude,
+                         lon=task.task_address.longitude, task_id=task.pk)
+            return DispatchQueue.finish(job)
+        except NoWorkerFound as e:
+            return DispatchQueue.reschedule(job, e)
+        except Exception as e:
+            logger.error("error with dispatch job %s: %s", job.pk, e)
+            return DispatchQueue.finish(job, e)
+
+    @staticmethod
+    def run_batch(jobs):
+        """
+        assignment of all the tasks of the jobs at once, see BatchDispatcher.
+        the matching makes one offer per task, with FANOUT > 1 the jobs are
+        run one by one
+        """
+        from noww.Handlers.TokenHandler import OrderRequest
+        from noww.Handlers.BatchDispatcher import BatchDispatcher
+
+        if settings.DISPATCH_SETTINGS['FANOUT'] > 1:
+            return [DispatchQueue.run(job) for job in jobs]
+
+        # one offer per task, the repeated jobs of a task and the jobs of
+        # the tasks taken or closed since are done
+        claimed, unique = jobs, {}
+        waiting = DispatchQueue.waiting([job.task_id for job in jobs])
+        for job in claimed:
+            if job.task_id in unique or job.task_id not in waiting:
+                DispatchQueue.finish(job)
+            else:
+                unique[job.task_id] = job
+        jobs = list(unique.values())
+
+        try:
+            with metrics.span('dispatch.batch_search'):
+                assigned = BatchDispatcher.dispatch(
+                    [job.task_id for job in jobs])
+        except Exception as e:
+            logger.error("error with dispatch batch: %s", e)
+            return [DispatchQueue.run(job) for job in jobs]
+
+        for job in jobs:
+            try:
+                worker = assigned.get(job.task_id)
+                with metrics.trace('dispatch', task_id=job.task_id,
+                                   batch=len(jobs)):
+                    OrderRequest.send_notify([worker] if worker else [],
+                                             job.task_id)
+                DispatchQueue.finish(job)
+            except NoWorkerFound as e:
+                DispatchQueue.reschedule(job, e)
+            except Exception as e:
+                logger.error("error with dispatch job %s: %s", job.pk, e)
+                DispatchQueue.finish(job, e)
+        return claimed
+
+    @staticmethod
+    def backoff(attempts):
+        """
+        seconds before the next try of a job failed `attempts` times
+        """
+        return min(settings.DISPATCH_SETTINGS['QUEUE_RETRY_BACKOFF'] *
+                   2 ** (attempts - 1),
+                   settings.DISPATCH_SETTINGS['QUEUE_RETRY_BACKOFF_MAX'])
+
+    @staticmethod
+    def finish(job, error=None):
+        job.finished_at = timezone.now()
+        if error is None:
+            job.status = JOB_DONE
+            job.error = ""
+        else:
+            job.error = str(error)
+            if job.attempts < settings.DISPATCH_SETTINGS['QUEUE_MAX_ATTEMPTS']:
+                job.status = JOB_PENDING
+                job.next_run_at = job.finished_at + timedelta(
+                    seconds=DispatchQueue.backoff(job.attempts))
+            else:
+                job.status = JOB_FAILED
+        job.save(update_fields=['status', 'error', 'finished_at',
+                                'next_run_at'])
+        return job
+
+    @staticmethod
+    def reschedule(job, reason):
+        """
+        runs the job again later, the run is not counted as an attempt.
+        the wait is the age of the job within the backoff bounds, so it
+        doubles with every run
+        """
+        queue_settings = settings.DISPATCH_SETTINGS
+        now = timezone.now()
+        age = (now - job.created_at).total_seconds()
+        delay = min(max(age, queue_settings['QUEUE_RETRY_BACKOFF']),
+                    queue_settings['QUEUE_RETRY_BACKOFF_MAX'])
+        job.status = JOB_PENDING
+        job.error = str(reason)
+        job.attempts -= 1
+        job.finished_at = now
+        job.next_run_at = now + timedelta(seconds=delay)
+        job.save(update_fields=['status', 'error', 'attempts', 'finished_at',
+                                'next_run_at'])
+        return job
+
+    @staticmethod
+    def requeue_stale(timeout=None):
+        """
+        returns to the queue jobs left running by a stopped worker
+        :return: count of the jobs
+        """
+        timeout = timeout or settings.DISPATCH_SETTINGS['QUEUE_JOB_TIMEOUT']
+        deadline = timezone.now() - timedelta(seconds=timeout)
+        return noww.models.DispatchJob.objects \
+            .filter(status=JOB_RUNNING, started_at__lt=deadline) \
+            .update(status=JOB_PENDING)
+
+    @staticmethod
+    def stats(last=500):
+        """
+        queue depth by status, latency (created -> finished) of the
+        last finished jobs in ms, the push outbox counts and the dispatch
+        histograms of the process
+        """
+        depth = {status: 0 for status in
+                 (JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED)}
+        depth.update({
+            item['status']: item['count'] for item in
+            noww.models.DispatchJob.objects.values('status')
+            .annotate(count=Count('id'))
+        })
+        finished = noww.models.DispatchJob.objects \
+            .filter(status=JOB_DONE) \
+            .order_by('-finished_at') \
+            .values_list('created_at', 'finished_at')[:last]
+        latencies = sorted(
+            (finished_at - created_at).total_seconds() * 1000
+            for created_at, finished_at in finished
+        )
+        latency = None
+        if latencies:
+            latency = {
+                'avg': round(sum(latencies) / len(latencies), 2),
+                'p50': round(latencies[int(len(latencies) * .5)], 2),
+                'p95': round(latencies[int(len(latencies) * .95)], 2),
+                'max': round(latencies[-1], 2),
+                'count': len(latencies),
+            }
+        oldest = noww.models.DispatchJob.objects \
+            .filter(status=JOB_PENDING).order_by('created_at') \
+            .values_list('created_at', flat=True).first()
+        # the dispatch runs in the run_dispatch processes
+        registry = MetricsSnapshots.collect()
+        return {
+            'metrics': registry.snapshot(),
+            'depth': depth,
+            'oldest_pending_age': round(
+                (timezone.now() - oldest).total_seconds(), 2
+            ) if oldest else None,
+            'latency': latency,
+            'push_outbox': PushOutbox.stats(),
+            'geo_cache': geo_query_cache.stats(registry),
+        }
@@ -0,0 +1,67 @@
+import logging
+
+logger = logging.getLogger()
+
+
+class FirebaseTreeLoader:
+    """
+    keeps a local structure in sync with a firebase tree of {id: value}
+    children: one full read on start and a listener for the changes.
+    subclasses define the reference and how a child is applied
+    """
+    reference_name = None
+
+    def __init__(self, reference=None):
+        self.reference = reference
+        self.registration = None
+
+    def _get_reference(self):
+        if self.reference is None:
+            from Common import db_config
+            self.reference = db_config.reference(self.reference_name)
+        return self.reference
+
+    def apply(self, target, key, value):
+        raise NotImplementedError
+
+    def clear(self, target):
+        target.clear()
+
+    def load(self, target):
+        snapshot = self._get_reference().get() or {}
+        for key, value in snapshot.items():
+            self._safe_apply(target, key, value)
+
+    def start(self, target):
+        """
+        full load and subscription to the changes of the tree
+        """
+        self.load(target)
+        self.registration = self._get_reference().listen(
+            lambda event: self.on_event(target, event))
+
+    def stop(self):
+        if self.registration is not None:
+            self.registration.close()
+            self.registration = None
+
+    def on_event(self, target, event):
+        path = [item for item in event.path.split('/') if item]
+        if not path:
+            # full tree put/patch
+            if event.event_type == 'put':
+                self.clear(target)
+            for key, value in (event.data or {}).items():
+                self._safe_apply(target, key, value)
+        elif len(path) == 1:
+            self._safe_apply(target, path[0], event.data)
+        else:
+            # partial update of a child as {id}/field - reread the child
+            value = self._get_reference().child(path[0]).get()
+            self._safe_apply(target, path[0], value)
+
+    def _safe_apply(self, target, key, value):
+        try:
+            self.apply(target, key, value)
+        except Exception as e:
+            logger.error("error with %s %s: %s", self.reference_name, key, e)
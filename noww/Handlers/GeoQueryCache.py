@@ -0,0 +1,151 @@
+import time
+import threading
+
+import nowwapi.settings as settings
+from noww.Handlers.Metrics import metrics
+from noww.Handlers.WorkerIndex import haversine
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_cell(lat, lon, precision):
+    """
+    :return: (geohash, (lat_min, lat_max, lon_min, lon_max)) of the cell
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            middle = (lon_range[0] + lon_range[1]) / 2
+            if lon >= middle:
+                value = value * 2 + 1
+                lon_range[0] = middle
+            else:
+                value *= 2
+                lon_range[1] = middle
+        else:
+            middle = (lat_range[0] + lat_range[1]) / 2
+            if lat >= middle:
+                value = value * 2 + 1
+                lat_range[0] = middle
+            else:
+                value *= 2
+                lat_range[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars), (*lat_range, *lon_range)
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GeoQueryCache:
+    """
+    results of the nearby workers query by geohash cell and radius for ttl
+    seconds. the query is made around the cell center with the radius
+    widened by the half diagonal of the cell, so the result holds the
+    workers around any point of the cell and the caller filters them by the
+    distance to its own point. concurrent misses of a cell share one query
+    """
+
+    def __init__(self, ttl=3, precision=6):
+        self.ttl = ttl
+        self.precision = precision
+        self._entries = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, lat, lon, radius, query):
+        """
+        :param query: callable(lat, lon, radius) of the remote lookup
+        :return: result of the query for the cell of the point
+        """
+        cell, (lat_min, lat_max, lon_min, lon_max) = geohash_cell(
+            lat, lon, self.precision)
+        key = (cell, radius)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                metrics.increment('geo_cache.hit')
+                return entry[1]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            metrics.increment('geo_cache.shared')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        metrics.increment('geo_cache.miss')
+        center_lat = (lat_min + lat_max) / 2
+        center_lon = (lon_min + lon_max) / 2
+        reach = haversine(center_lat, center_lon, lat_max, lon_max)
+        try:
+            flight.result = query(center_lat, center_lon, radius + reach)
+            with self._lock:
+                self._expire()
+                self._entries[key] = (time.monotonic() + self.ttl,
+                                      flight.result)
+                metrics.gauge('geo_cache.size', len(self._entries))
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items()
+                    if entry[0] <= now]:
+            del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            metrics.gauge('geo_cache.size', 0)
+
+    @staticmethod
+    def stats(registry=metrics):
+        """
+        :param registry: MetricsRegistry, the merged one of all the
+        processes to count the caches of the dispatch workers
+        """
+        counters = registry.counters()
+        hits = counters.get('geo_cache.hit', 0) + \
+            counters.get('geo_cache.shared', 0)
+        misses = counters.get('geo_cache.miss', 0)
+        return {
+            'size': registry.gauges().get('geo_cache.size', 0),
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3)
+            if hits + misses else None,
+        }
+
+
+geo_query_cache = GeoQueryCache(
+    settings.DISPATCH_SETTINGS['GEO_CACHE_TTL'],
+    settings.DISPATCH_SETTINGS['GEO_CACHE_PRECISION'])
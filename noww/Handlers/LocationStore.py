@@ -0,0 +1,297 @@
+import time
+import logging
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy
+from django.db import close_old_connections, connection
+from django.db.models import Max
+
+import noww.models
+from noww.Handlers.Metrics import metrics
+
+logger = logging.getLogger()
+
+HISTORY_TABLE = 'noww_workerlocation'
+
+
+class LocationStore:
+    """
+    latest position of each worker kept in numpy arrays, a slot per worker.
+    a point older than the stored one is ignored, so the pings can arrive
+    out of order and the same rows can be read twice
+    """
+
+    def __init__(self, capacity=1024):
+        self._slots = {}
+        self._ids = []
+        self.lats = numpy.zeros(capacity)
+        self.lons = numpy.zeros(capacity)
+        self.times = numpy.zeros(capacity)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _grow(self, size):
+        capacity = len(self.times)
+        while capacity < size:
+            capacity *= 2
+        if capacity != len(self.times):
+            for name in ('lats', 'lons', 'times'):
+                array = numpy.zeros(capacity)
+                array[:len(self._ids)] = getattr(self, name)[:len(self._ids)]
+                setattr(self, name, array)
+
+    def update_many(self, worker_ids, lats, lons, times):
+        """
+        :param worker_ids: sequence of worker ids
+        :param lats: sequence of latitudes
+        :param lons: sequence of longitudes
+        :param times: sequence of unix times of the points
+        :return: list of (worker_id, lat, lon) which moved a worker
+        """
+        with self._lock:
+            slots = []
+            for worker_id in worker_ids:
+                worker_id = str(worker_id)
+                slot = self._slots.get(worker_id)
+                if slot is None:
+                    slot = self._slots[worker_id] = len(self._ids)
+                    self._ids.append(worker_id)
+                slots.append(slot)
+            self._grow(len(self._ids))
+
+            slots = numpy.asarray(slots, dtype=numpy.int64)
+            lats = numpy.asarray(lats, dtype=numpy.float64)
+            lons = numpy.asarray(lons, dtype=numpy.float64)
+            times = numpy.asarray(times, dtype=numpy.float64)
+            # the newest point of a worker in the batch goes last
+            order = numpy.lexsort((times, slots))
+            slots, lats, lons, times = \
+                slots[order], lats[order], lons[order], times[order]
+            last = numpy.append(slots[1:] != slots[:-1], True)
+            newer = last & (times > self.times[slots])
+
+            slots = slots[newer]
+            self.lats[slots] = lats[newer]
+            self.lons[slots] = lons[newer]
+            self.times[slots] = times[newer]
+            return [(self._ids[slot], self.lats[slot], self.lons[slot])
+                    for slot in slots]
+
+    def get(self, worker_id):
+        """
+        :return: (lat, lon, unix time) or None
+        """
+        slot = self._slots.get(str(worker_id))
+        if slot is None:
+            return None
+        return self.lats[slot], self.lons[slot], self.times[slot]
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+            self._ids = []
+            self.times[:] = 0
+
+
+class LocationHistory:
+    """
+    appends the points to WorkerLocation, one insert per batch.
+    partitions by month are created on the first write of the month,
+    dropping the old ones is the retention
+    """
+
+    def __init__(self):
+        self._partitions = set()
+        # not retried, the rows of the month go to the default partition
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def month_start(moment):
+        return moment.replace(day=1, hour=0, minute=0, second=0,
+                              microsecond=0)
+
+    @staticmethod
+    def partition_name(month):
+        return f"{HISTORY_TABLE}_{month.year}{month.month:02d}"
+
+    def ensure_partition(self, moment):
+        month = self.month_start(moment)
+        name = self.partition_name(month)
+        if name in self._partitions:
+            return name
+        if name in self._failed:
+            return None
+        with self._lock:
+            if name in self._failed:
+                return None
+            if name not in self._partitions:
+                following = self.month_start(month + timedelta(days=32))
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            f"CREATE TABLE IF NOT EXISTS {name} "
+                            f"PARTITION OF {HISTORY_TABLE} "
+                            f"FOR VALUES FROM (%s) TO (%s)",
+                            [month, following])
+                except Exception as e:
+                    # the rows go to the default partition meanwhile
+                    logger.error("error with partition %s: %s", name, e)
+                    self._failed.add(name)
+                    return None
+                self._partitions.add(name)
+        return name
+
+    def append(self, worker_id, points):
+        """
+        :param points: list of (lat, lon, datetime)
+        :return: count of the stored points
+        """
+        for month in {self.month_start(point[2]) for point in points}:
+            self.ensure_partition(month)
+        noww.models.WorkerLocation.objects.bulk_create([
+            noww.models.WorkerLocation(worker_id=worker_id, latitude=lat,
+                                       longitude=lon, recorded_at=moment)
+            for lat, lon, moment in points
+        ])
+        return len(points)
+
+    def drop_before(self, moment):
+        """
+        drops the monthly partitions ending before the moment
+        :return: names of the dropped partitions
+        """
+        limit = self.partition_name(self.month_start(moment))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE parent.relname = %s", [HISTORY_TABLE])
+            names = sorted(
+                name for name, in cursor.fetchall()
+                if name != f"{HISTORY_TABLE}_default" and name < limit)
+            for name in names:
+                cursor.execute(f"DROP TABLE {name}")
+        with self._lock:
+            self._partitions.difference_update(names)
+        return names
+
+
+class DatabaseLocationLoader:
+    """
+    keeps the worker index in sync with WorkerLocation: the latest points
+    of the last max_age seconds on start, then the new rows are polled
+    by id. rows committed out of the id order are caught by the overlap,
+    the store skips the ones seen before
+    """
+    overlap = 1000
+
+    def __init__(self, poll_interval=1, max_age=600):
+        self.poll_interval = poll_interval
+        self.max_age = max_age
+        self.store = LocationStore()
+        self.last_id = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def rows(self):
+        since = datetime.now(dt_timezone.utc) - \
+            timedelta(seconds=self.max_age)
+        return noww.models.WorkerLocation.objects \
+            .filter(recorded_at__gte=since) \
+            .values_list('id', 'worker_id', 'latitude', 'longitude',
+                         'recorded_at')
+
+    def apply(self, index, rows):
+        if not rows:
+            return
+        self.last_id = max(self.last_id, max(row[0] for row in rows))
+        changed = self.store.update_many(
+            [row[1] for row in rows], [row[2] for row in rows],
+            [row[3] for row in rows], [row[4].timestamp() for row in rows])
+        for worker_id, lat, lon in changed:
+            index.update(worker_id, lat, lon)
+
+    def load(self, index):
+        rows = list(self.rows().order_by('worker_id', '-recorded_at')
+                    .distinct('worker_id'))
+        self.apply(index, rows)
+        self.last_id = max(
+            self.last_id,
+            noww.models.WorkerLocation.objects.aggregate(Max('id'))
+            ['id__max'] or 0)
+
+    def poll(self, index):
+        rows = list(self.rows().filter(id__gt=self.last_id - self.overlap)
+                    .order_by('id'))
+        self.apply(index, rows)
+        return len(rows)
+
+    def start(self, index):
+        self.load(index)
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.poll_interval):
+                try:
+                    self.poll(index)
+                except Exception as e:
+                    logger.error("error with location poll: %s", e)
+                finally:
+                    close_old_connections()
+
+        self._thread = threading.Thread(target=run, name='location-loader',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+
+_store = None
+_store_lock = threading.Lock()
+location_history = LocationHistory()
+
+
+def get_location_store():
+    """
+    latest positions received by this process
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = LocationStore()
+    return _store
+
+
+def ingest(worker_id, points):
+    """
+    stores a batch of pings of the worker: history, latest position and
+    the worker index of this process when it is running
+    :param points: list of (lat, lon, unix time)
+    :return: count of the points which moved the worker
+    """
+    from noww.Handlers.WorkerIndex import current_worker_index
+
+    started = time.perf_counter()
+    location_history.append(worker_id, [
+        (lat, lon, datetime.fromtimestamp(moment, dt_timezone.utc))
+        for lat, lon, moment in points
+    ])
+    changed = get_location_store().update_many(
+        [worker_id] * len(points), [point[0] for point in points],
+        [point[1] for point in points], [point[2] for point in points])
+    index = current_worker_index()
+    if index is not None:
+        for changed_id, lat, lon in changed:
+            index.update(changed_id, lat, lon)
+    metrics.observe('locations.batch_size', len(points))
+    metrics.observe('locations.ingest_ms',
+                    (time.perf_counter() - started) * 1000)
+    return len(changed)
@@ -0,0 +1,275 @@
+import re
+import json
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import nowwapi.settings as settings
+
+logger = logging.getLogger()
+# info lines of the dispatch, routed by settings.LOGGING
+dispatch_logger = logging.getLogger('noww.dispatch')
+
+# trace of the operation running in the current thread / task
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+DEFAULT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                   10000)
+
+
+class Histogram:
+    """
+    cumulative histogram with fixed upper bounds of the buckets
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[position] += 1
+            self.count += 1
+            self.sum += value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        """
+        upper bound of the bucket holding the q-quantile
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for position, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if position < len(self.buckets):
+                    return self.buckets[position]
+                return self.max
+        return self.max
+
+    def dump(self):
+        """
+        raw state for the merge in another process
+        """
+        with self._lock:
+            return {'buckets': list(self.buckets), 'counts': list(self.counts),
+                    'count': self.count, 'sum': self.sum, 'max': self.max}
+
+    def merge(self, dumped):
+        """
+        adds the observations of a dump with the same buckets
+        """
+        if tuple(dumped['buckets']) != self.buckets:
+            logger.warning("histogram buckets differ: %s", dumped['buckets'])
+            return
+        with self._lock:
+            self.counts = [mine + theirs for mine, theirs
+                           in zip(self.counts, dumped['counts'])]
+            self.count += dumped['count']
+            self.sum += dumped['sum']
+            if dumped['max'] is not None and \
+                    (self.max is None or dumped['max'] > self.max):
+                self.max = dumped['max']
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 3),
+            'avg': round(self.sum / self.count, 3) if self.count else None,
+            'p50': self.quantile(.5),
+            'p95': self.quantile(.95),
+            'p99': self.quantile(.99),
+            'max': self.max,
+            'buckets': dict(zip(
+                [str(bound) for bound in self.buckets] + ['+Inf'],
+                self.counts
+            )),
+        }
+
+
+class Trace:
+    """
+    timings of the stages of one operation, e.g. the dispatch of a task
+    """
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    def add(self, name, elapsed):
+        # the stages repeated by the ring search or the fan-out are summed
+        self.stages[name] = self.stages.get(name, 0) + elapsed
+
+    def record(self):
+        return {
+            'event': self.name,
+            **self.fields,
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'stages': {name: round(elapsed, 3)
+                       for name, elapsed in self.stages.items()},
+        }
+
+
+class MetricsRegistry:
+    """
+    process wide named histograms, counters and gauges. the registries of
+    the other processes are merged from their dumps, see MetricsSnapshots
+    """
+
+    def __init__(self, enabled=True, log_traces=True):
+        self.enabled = enabled
+        self.log_traces = log_traces
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, buckets=DEFAULT_BUCKETS):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(
+                    name, Histogram(buckets))
+        return histogram
+
+    def observe(self, name, value):
+        self.histogram(name).observe(value)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def counters(self):
+        return dict(sorted(self._counters.items()))
+
+    def gauge(self, name, value):
+        """
+        current value, e.g. the size of a cache, summed over the processes
+        """
+        with self._lock:
+            self._gauges[name] = value
+
+    def gauges(self):
+        return dict(sorted(self._gauges.items()))
+
+    @contextmanager
+    def span(self, name):
+        """
+        times the block into the `<name>_ms` histogram and the stages of
+        the current trace
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.observe(f"{name}_ms", elapsed)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.add(name, elapsed)
+
+    @contextmanager
+    def trace(self, name, **fields):
+        """
+        collects the spans of the block, at exit the total goes to the
+        `<name>.total_ms` histogram and the trace is logged as a json line.
+        inside another trace the block is a span of it
+        :param fields: ids logged with the trace, e.g. task_id
+        """
+        if not self.enabled:
+            yield None
+            return
+        current = _current_trace.get()
+        if current is not None:
+            with self.span(name):
+                yield current
+            return
+        trace = Trace(name, **fields)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            record = trace.record()
+            self.observe(f"{name}.total_ms", record['total_ms'])
+            if self.log_traces:
+                dispatch_logger.info("trace %s",
+                                     json.dumps(record, default=str))
+
+    def snapshot(self):
+        return {name: histogram.snapshot()
+                for name, histogram in sorted(self._histograms.items())}
+
+    def dump(self):
+        """
+        :return: json serializable state of the registry
+        """
+        return {
+            'histograms': {name: histogram.dump() for name, histogram
+                           in list(self._histograms.items())},
+            'counters': self.counters(),
+            'gauges': self.gauges(),
+        }
+
+    def merge(self, dumped):
+        """
+        adds a dump of another registry to this one
+        """
+        for name, histogram in dumped.get('histograms', {}).items():
+            self.histogram(name, histogram['buckets']).merge(histogram)
+        with self._lock:
+            for name, value in dumped.get('counters', {}).items():
+                self._counters[name] = self._counters.get(name, 0) + value
+            for name, value in dumped.get('gauges', {}).items():
+                self._gauges[name] = self._gauges.get(name, 0) + value
+
+    def prometheus(self, prefix='noww'):
+        """
+        counters, gauges and histograms in the prometheus text format
+        """
+        lines = []
+        for name, value in self.counters().items():
+            name = re.sub(r'[^a-zA-Z0-9_]', '_', f"{prefix}_{name}_total")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+        for name, value in self.gauges().items():
+            name = re.sub(r'[^a-zA-Z0-9_]', '_', f"{prefix}_{name}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        for name, histogram in sorted(self._histograms.items()):
+            name = re.sub(r'[^a-zA-Z0-9_]', '_', f"{prefix}_{name}")
+            lines.append(f"# TYPE {name} histogram")
+            seen = 0
+            bounds = [str(bound) for bound in histogram.buckets] + ['+Inf']
+            for bound, count in zip(bounds, histogram.counts):
+                seen += count
+                lines.append(f'{name}_bucket{{le="{bound}"}} {seen}')
+            lines.append(f"{name}_sum {histogram.sum}")
+            lines.append(f"{name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+
+metrics = MetricsRegistry(settings.METRICS_SETTINGS['ENABLED'],
+                          settings.METRICS_SETTINGS['LOG_TRACES'])
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from datetime import timedelta
+
+from django.db import DatabaseError
+from django.utils import timezone
+
+import noww.models
+import nowwapi.settings as settings
+from noww.Handlers.Metrics import MetricsRegistry, metrics
+
+logger = logging.getLogger()
+
+
+def process_name():
+    # the pid changes in the forked web workers
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class MetricsSnapshots:
+    """
+    the metrics registry is per process: run_dispatch and the web workers
+    write a dump of theirs to a MetricsSnapshot row every SNAPSHOT_INTERVAL
+    seconds, the stats views merge the rows updated within SNAPSHOT_MAX_AGE
+    with the live registry of their own process
+    """
+    _published = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def publish():
+        """
+        writes the dump of this process and drops the rows of the
+        processes gone for SNAPSHOT_MAX_AGE
+        """
+        now = timezone.now()
+        noww.models.MetricsSnapshot.objects.update_or_create(
+            process=process_name(),
+            defaults={'data': json.dumps(metrics.dump()), 'updated_at': now})
+        max_age = settings.METRICS_SETTINGS['SNAPSHOT_MAX_AGE']
+        noww.models.MetricsSnapshot.objects \
+            .filter(updated_at__lt=now - timedelta(seconds=max_age)).delete()
+
+    @staticmethod
+    def publish_due():
+        """
+        publish at most once by SNAPSHOT_INTERVAL, errors are logged
+        """
+        interval = settings.METRICS_SETTINGS['SNAPSHOT_INTERVAL']
+        if not interval or not metrics.enabled:
+            return
+        with MetricsSnapshots._lock:
+            now = time.monotonic()
+            if MetricsSnapshots._published is not None and \
+                    now - MetricsSnapshots._published < interval:
+                return
+            MetricsSnapshots._published = now
+        try:
+            MetricsSnapshots.publish()
+        except DatabaseError as e:
+            logger.error("error with metrics snapshot: %s", e)
+
+    @staticmethod
+    def on_request_finished(sender, **kwargs):
+        MetricsSnapshots.publish_due()
+
+    @staticmethod
+    def connect():
+        from django.core.signals import request_finished
+        request_finished.connect(MetricsSnapshots.on_request_finished,
+                                 dispatch_uid='metrics_snapshots')
+
+    @staticmethod
+    def collect():
+        """
+        :return: MetricsRegistry of all the processes
+        """
+        registry = MetricsRegistry(log_traces=False)
+        max_age = settings.METRICS_SETTINGS['SNAPSHOT_MAX_AGE']
+        rows = noww.models.MetricsSnapshot.objects \
+            .filter(updated_at__gte=timezone.now() -
+                    timedelta(seconds=max_age)) \
+            .exclude(process=process_name()) \
+            .values_list('process', 'data')
+        for process, data in rows:
+            try:
+                registry.merge(json.loads(data))
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error("error with metrics snapshot of %s: %s",
+                             process, e)
+        # this process is live, not its last row
+        registry.merge(metrics.dump())
+        return registry
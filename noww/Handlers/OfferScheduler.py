@@ -0,0 +1,138 @@
+import time
+import heapq
+import logging
+import threading
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+import noww.models
+import nowwapi.settings as settings
+from noww.Handlers.AttemptStore import (
+    AttemptStore, ATTEMPT_OFFERED, ATTEMPT_EXPIRED
+)
+from noww.Handlers.DispatchQueue import DispatchQueue
+from noww.Handlers.WorkerHandler import WorkerHandlerClass
+
+logger = logging.getLogger()
+
+
+class OfferScheduler:
+    """
+    timers of the outstanding offers kept in a heap of
+    (deadline, attempt_id, task_id, worker_id).
+    offers are loaded incrementally from DispatchAttempt, so the offers
+    made by any process and the ones left before a restart are tracked.
+    an expired offer is claimed with a row lock and marked EXPIRED, the
+    task goes back to the dispatch queue when no other offer is pending
+    """
+
+    # offers committed out of order are caught by the reload overlap
+    reload_overlap = 5
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._heap = []
+        self._scheduled = set()
+        self._since = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, attempt_id, task_id, worker_id, offered_at):
+        """
+        :param offered_at: unix time of the offer
+        """
+        with self._lock:
+            if attempt_id in self._scheduled:
+                return
+            self._scheduled.add(attempt_id)
+            heapq.heappush(self._heap, (offered_at + self.timeout,
+                                        attempt_id, task_id, worker_id))
+
+    def reload(self):
+        """
+        picks up the offers made since the last call, all the outstanding
+        offers on the first call
+        :return: count of the new timers
+        """
+        offers = noww.models.DispatchAttempt.objects \
+            .filter(status=ATTEMPT_OFFERED)
+        if self._since is not None:
+            offers = offers.filter(offered_at__gte=self._since)
+        self._since = timezone.now() - timedelta(seconds=self.reload_overlap)
+
+        count = len(self._scheduled)
+        for attempt_id, task_id, worker_id, offered_at in offers.values_list(
+                'pk', 'task_id', 'worker_id', 'offered_at').iterator():
+            self.schedule(attempt_id, task_id, worker_id,
+                          offered_at.timestamp())
+        return len(self._scheduled) - count
+
+    def next_deadline(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                item = heapq.heappop(self._heap)
+                self._scheduled.discard(item[1])
+                due.append(item)
+        return due
+
+    def expire_due(self, now=None):
+        """
+        expires the offers past the deadline and re-dispatches the tasks
+        :return: count of the expired offers
+        """
+        due = self.pop_due(now)
+        if not due:
+            return 0
+        # the rows are claimed: a concurrent scheduler skips the locked ones
+        # and does not see them as OFFERED after the commit
+        with transaction.atomic():
+            expired = list(
+                noww.models.DispatchAttempt.objects
+                .select_for_update(skip_locked=True)
+                .filter(pk__in=[item[1] for item in due],
+                        status=ATTEMPT_OFFERED)
+                .values_list('pk', 'task_id', 'worker_id')
+            )
+            noww.models.DispatchAttempt.objects \
+                .filter(pk__in=[item[0] for item in expired]) \
+                .update(status=ATTEMPT_EXPIRED)
+
+        tasks = set()
+        for _, task_id, worker_id in expired:
+            try:
+                WorkerHandlerClass.clear_workertask(worker_id, task_id)
+            except Exception as e:
+                logger.error("error with worker_task %s: %s", worker_id, e)
+            tasks.add(task_id)
+
+        for task_id in tasks:
+            waiting = noww.models.Task.objects.filter(
+                pk=task_id, status='CREATED', worker__isnull=True
+            ).exists()
+            if waiting and not AttemptStore.has_pending(task_id):
+                DispatchQueue.enqueue(task_id)
+        return len(expired)
+
+    def tick(self):
+        self.reload()
+        return self.expire_due()
+
+
+_scheduler = None
+
+
+def get_offer_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = OfferScheduler(
+            settings.DISPATCH_SETTINGS['OFFER_TIMEOUT'])
+    return _scheduler
@@ -0,0 +1,109 @@
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_save
+)
+
+import noww.models
+
+
+class PlaceKinds:
+    """
+    Place.kind_ids / sub_kind_ids: the kinds of the products of the place
+    kept on the place row. refreshed when the kinds of a product or its
+    place change, resolve() turns the ids of a page of places into Types
+    with one query
+    """
+    columns = (('kind_ids', 'kinds'), ('sub_kind_ids', 'sub_kinds'))
+
+    @staticmethod
+    def refresh(place_ids):
+        """
+        recomputes the columns of the places from their products
+        """
+        place_ids = {place_id for place_id in place_ids
+                     if place_id is not None}
+        if not place_ids:
+            return
+        values = {place_id: {column: set() for column, _ in
+                             PlaceKinds.columns}
+                  for place_id in place_ids}
+        for column, field in PlaceKinds.columns:
+            through = getattr(noww.models.Product, field).through
+            rows = through.objects \
+                .filter(product__places__in=place_ids) \
+                .values_list('product__places', 'types_id').distinct()
+            for place_id, type_id in rows:
+                values[place_id][column].add(type_id)
+        for place_id, columns in values.items():
+            noww.models.Place.objects.filter(pk=place_id).update(**{
+                column: sorted(ids) for column, ids in columns.items()
+            })
+
+    @staticmethod
+    def resolve(places):
+        """
+        sets the kinds and sub kinds of the places with one query
+        """
+        places = list(places)
+        ids = {type_id for place in places for column, _ in
+               PlaceKinds.columns for type_id in getattr(place, column)}
+        types = noww.models.Types.objects.select_related('parent') \
+            .in_bulk(ids) if ids else {}
+        for place in places:
+            for column, field in PlaceKinds.columns:
+                setattr(place, f"_{field}", [
+                    types[type_id] for type_id in getattr(place, column)
+                    if type_id in types
+                ])
+        return places
+
+    @staticmethod
+    def kinds_changed(sender, instance, action, reverse, pk_set, **kwargs):
+        if action == 'pre_clear' and reverse:
+            # post_clear of a type has no pk_set, its places are kept here
+            instance._cleared_place_ids = list(
+                sender.objects.filter(types=instance)
+                .values_list('product__places', flat=True))
+            return
+        if not action.startswith('post_'):
+            return
+        if action == 'post_clear' and reverse:
+            PlaceKinds.refresh(getattr(instance, '_cleared_place_ids', ()))
+            instance._cleared_place_ids = ()
+        elif reverse:
+            # the products of a type changed
+            place_ids = noww.models.Product.objects \
+                .filter(pk__in=pk_set or ()) \
+                .values_list('places', flat=True)
+            PlaceKinds.refresh(place_ids)
+        else:
+            PlaceKinds.refresh([instance.places_id])
+
+    @staticmethod
+    def product_saving(instance, **kwargs):
+        instance._old_place_id = noww.models.Product.objects \
+            .filter(pk=instance.pk).values_list('places', flat=True).first() \
+            if instance.pk else None
+
+    @staticmethod
+    def product_saved(instance, created, **kwargs):
+        old_place_id = getattr(instance, '_old_place_id', None)
+        if not created and old_place_id != instance.places_id:
+            PlaceKinds.refresh([old_place_id, instance.places_id])
+
+    @staticmethod
+    def product_deleted(instance, **kwargs):
+        PlaceKinds.refresh([instance.places_id])
+
+    @staticmethod
+    def connect():
+        product = noww.models.Product
+        for _, field in PlaceKinds.columns:
+            m2m_changed.connect(PlaceKinds.kinds_changed,
+                                sender=getattr(product, field).through,
+                                dispatch_uid=f'place_kinds_{field}')
+        pre_save.connect(PlaceKinds.product_saving, sender=product,
+                         dispatch_uid='place_kinds_product_saving')
+        post_save.connect(PlaceKinds.product_saved, sender=product,
+                          dispatch_uid='place_kinds_product_saved')
+        post_delete.connect(PlaceKinds.product_deleted, sender=product,
+                            dispatch_uid='place_kinds_product_deleted')
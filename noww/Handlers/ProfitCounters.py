@@ -0,0 +1,188 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save
+)
+
+import noww.models
+from Common.configs import TASK_STATUSES_NOT_PAID
+
+# what a task adds to the counters
+TaskShare = namedtuple('TaskShare', 'worker_id customer_id currency amount '
+                                    'status')
+
+SHARE_FIELDS = ('worker_id', 'customer_id', 'delivery_cost_currency',
+                'delivery_cost', 'status')
+
+
+class ProfitCounters:
+    """
+    WorkerProfit and CustomerProfit: delivery cost of the tasks by currency,
+    changed by the delta of every save/delete of a task and of the
+    conditional updates of TaskHandler. the tasks in TASK_STATUSES_NOT_PAID
+    are left out. check() derives the totals from the tasks in bulk
+    """
+    owners = (
+        ('worker_id', 'WorkerProfit'),
+        ('customer_id', 'CustomerProfit'),
+    )
+
+    @staticmethod
+    def share(task):
+        """
+        :param task: Task or a dict of SHARE_FIELDS
+        """
+        if isinstance(task, dict):
+            return TaskShare(*(task[field] for field in SHARE_FIELDS))
+        amount = task.delivery_cost.amount \
+            if task.delivery_cost is not None else None
+        currency = str(task.delivery_cost.currency) \
+            if task.delivery_cost is not None else None
+        return TaskShare(task.worker_id, task.customer_id, currency, amount,
+                         task.status)
+
+    @staticmethod
+    def stored(task_id):
+        row = noww.models.Task.objects.filter(pk=task_id) \
+            .values(*SHARE_FIELDS).first()
+        return ProfitCounters.share(row) if row else None
+
+    @staticmethod
+    def paid(share):
+        return share is not None and share.amount is not None and \
+            share.status not in TASK_STATUSES_NOT_PAID
+
+    @staticmethod
+    def apply(share, sign):
+        if not ProfitCounters.paid(share):
+            return
+        amount = sign * Decimal(str(share.amount))
+        for field, model_name in ProfitCounters.owners:
+            owner_id = getattr(share, field)
+            if owner_id is None:
+                continue
+            model = getattr(noww.models, model_name)
+            if sign < 0:
+                # the counter is there if the task was counted, it is gone
+                # when the owner is deleted along with the tasks
+                model.objects.filter(**{field: owner_id},
+                                     currency=share.currency) \
+                    .update(amount=F('amount') + amount, tasks=F('tasks') - 1)
+                continue
+            table = model._meta.db_table
+            # one statement, concurrent first tasks of an owner do not race
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} ({field}, currency, amount, tasks) "
+                    f"VALUES (%s, %s, %s, 1) "
+                    f"ON CONFLICT ({field}, currency) DO UPDATE SET "
+                    f"amount = {table}.amount + EXCLUDED.amount, "
+                    f"tasks = {table}.tasks + 1",
+                    [owner_id, share.currency, amount])
+
+    @staticmethod
+    def change(before, after):
+        # what the task adds, False if it is not counted
+        if (ProfitCounters.paid(before) and before[:4]) == \
+                (ProfitCounters.paid(after) and after[:4]):
+            return
+        with transaction.atomic():
+            ProfitCounters.apply(before, -1)
+            ProfitCounters.apply(after, 1)
+
+    @staticmethod
+    def updated(task_id, **before):
+        """
+        applies a queryset update of the task, call it in the transaction
+        of the update
+        :param before: values of SHARE_FIELDS changed by the update
+        """
+        after = ProfitCounters.stored(task_id)
+        if after is not None:
+            ProfitCounters.change(after._replace(**before), after)
+
+    @staticmethod
+    def task_saving(instance, **kwargs):
+        instance._profit_share = ProfitCounters.stored(instance.pk) \
+            if instance.pk else None
+
+    @staticmethod
+    def task_saved(instance, **kwargs):
+        ProfitCounters.change(getattr(instance, '_profit_share', None),
+                              ProfitCounters.share(instance))
+
+    @staticmethod
+    def task_deleting(instance, **kwargs):
+        instance._profit_share = ProfitCounters.share(instance)
+
+    @staticmethod
+    def task_deleted(instance, **kwargs):
+        ProfitCounters.apply(getattr(instance, '_profit_share', None), -1)
+
+    @staticmethod
+    def derive():
+        """
+        totals from the tasks
+        :return: dict model name -> {(owner_id, currency): (amount, tasks)}
+        """
+        tasks = noww.models.Task.objects \
+            .filter(delivery_cost__isnull=False) \
+            .exclude(status__in=TASK_STATUSES_NOT_PAID)
+        derived = {}
+        for field, model_name in ProfitCounters.owners:
+            rows = tasks.filter(**{f"{field}__isnull": False}) \
+                .values_list(field, 'delivery_cost_currency') \
+                .annotate(amount=Sum('delivery_cost'), tasks=Count('pk'))
+            derived[model_name] = {
+                (owner_id, currency): (amount, count)
+                for owner_id, currency, amount, count in rows
+            }
+        return derived
+
+    @staticmethod
+    def check(fix=False):
+        """
+        compares the counters with the totals derived from the tasks
+        :param fix: rewrite the counters of the mismatches
+        :return: list of (model name, owner_id, currency, stored, derived)
+        """
+        mismatches = []
+        with transaction.atomic():
+            for model_name, derived in ProfitCounters.derive().items():
+                model = getattr(noww.models, model_name)
+                field = dict((name, field) for field, name
+                             in ProfitCounters.owners)[model_name]
+                counters = model.objects.select_for_update() \
+                    if fix else model.objects
+                stored = {
+                    (owner_id, currency): (amount, count)
+                    for owner_id, currency, amount, count in counters
+                    .values_list(field, 'currency', 'amount', 'tasks')
+                }
+                for key in stored.keys() | derived.keys():
+                    expected = derived.get(key, (Decimal(0), 0))
+                    actual = stored.get(key, (Decimal(0), 0))
+                    if expected != actual:
+                        mismatches.append((model_name, *key, actual,
+                                           expected))
+                        if fix:
+                            model.objects.update_or_create(
+                                **{field: key[0]}, currency=key[1],
+                                defaults={'amount': expected[0],
+                                          'tasks': expected[1]})
+        return mismatches
+
+    @staticmethod
+    def connect():
+        sender = noww.models.Task
+        pre_save.connect(ProfitCounters.task_saving, sender=sender,
+                         dispatch_uid='profit_counters_task_saving')
+        post_save.connect(ProfitCounters.task_saved, sender=sender,
+                          dispatch_uid='profit_counters_task_saved')
+        pre_delete.connect(ProfitCounters.task_deleting, sender=sender,
+                           dispatch_uid='profit_counters_task_deleting')
+        post_delete.connect(ProfitCounters.task_deleted, sender=sender,
+                            dispatch_uid='profit_counters_task_deleted')
@@ -0,0 +1,163 @@
+import json
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef
+from django.utils import timezone
+
+import noww.models
+import nowwapi.settings as settings
+from noww.Handlers.AttemptStore import ATTEMPT_OFFERED
+from noww.Handlers.PushSender import PushMessage, get_push_sender
+
+logger = logging.getLogger()
+
+OUTBOX_PENDING = 'PENDING'
+OUTBOX_SENT = 'SENT'
+OUTBOX_FAILED = 'FAILED'
+# the offer was answered, withdrawn or expired before the push went out
+OUTBOX_CANCELLED = 'CANCELLED'
+
+# FCM errors not worth a retry
+PERMANENT_ERRORS = ('InvalidRegistration', 'MissingRegistration',
+                    'NotRegistered', 'MismatchSenderId')
+
+
+class PushOutbox:
+    """
+    durable pushes: a PushOutboxMessage row is written in the transaction
+    of the offer, one per (task, worker, attempt). after the commit the
+    message is handed to the push sender, the messages left unsent are
+    retried by `drain` with exponential backoff while the offer is open
+    """
+
+    @staticmethod
+    def add(task_id, worker_id, attempt, registration_id, title, body,
+            data=None):
+        """
+        :return: PushOutboxMessage, the existing one for a repeated offer
+        """
+        lease = settings.PUSH_NOTIFICATIONS_SETTINGS['OUTBOX_LEASE']
+        message, created = noww.models.PushOutboxMessage.objects.get_or_create(
+            task_id=task_id, worker_id=worker_id, attempt=attempt,
+            defaults={
+                'registration_id': registration_id,
+                'title': title,
+                'body': body,
+                'data': json.dumps(data, default=str),
+                # the drainer picks it up if the sender does not report back
+                'next_attempt_at': timezone.now() + timedelta(seconds=lease),
+            }
+        )
+        if created:
+            transaction.on_commit(lambda: PushOutbox.send([message]))
+        return message
+
+    @staticmethod
+    def to_push(message):
+        return PushMessage(
+            message.registration_id, message.title, message.body,
+            json.loads(message.data) if message.data else None,
+            on_result=lambda error: PushOutbox.mark(message.pk, error))
+
+    @staticmethod
+    def send(messages):
+        sender = get_push_sender()
+        for message in messages:
+            sender.put(PushOutbox.to_push(message))
+
+    @staticmethod
+    def backoff(tries):
+        push_settings = settings.PUSH_NOTIFICATIONS_SETTINGS
+        return min(push_settings['OUTBOX_BACKOFF'] * 2 ** (tries - 1),
+                   push_settings['OUTBOX_BACKOFF_MAX'])
+
+    @staticmethod
+    def mark(message_id, error=None):
+        """
+        stores the result of the send, a failed message is scheduled
+        for the next try or marked FAILED
+        """
+        now = timezone.now()
+        pending = noww.models.PushOutboxMessage.objects \
+            .filter(pk=message_id, status=OUTBOX_PENDING)
+        if error is None:
+            pending.update(status=OUTBOX_SENT, sent_at=now, error="",
+                           tries=F('tries') + 1)
+            return
+
+        tries = pending.values_list('tries', flat=True).first()
+        if tries is None:
+            return
+        tries += 1
+        max_tries = settings.PUSH_NOTIFICATIONS_SETTINGS['OUTBOX_MAX_TRIES']
+        if tries >= max_tries or error in PERMANENT_ERRORS:
+            pending.update(status=OUTBOX_FAILED, tries=tries, error=error)
+            logger.error("push %s failed: %s", message_id, error)
+        else:
+            pending.update(tries=tries, error=error,
+                           next_attempt_at=now + timedelta(
+                               seconds=PushOutbox.backoff(tries)))
+
+    @staticmethod
+    def drain(batch_size=100):
+        """
+        sends the pending messages due for a try, concurrent drainers skip
+        locked rows. the messages of the offers no longer open are cancelled
+        :return: count of the sent messages
+        """
+        lease = settings.PUSH_NOTIFICATIONS_SETTINGS['OUTBOX_LEASE']
+        now = timezone.now()
+        offered = noww.models.DispatchAttempt.objects.filter(
+            task_id=OuterRef('task_id'), worker_id=OuterRef('worker_id'),
+            status=ATTEMPT_OFFERED)
+        with transaction.atomic():
+            messages = list(
+                noww.models.PushOutboxMessage.objects
+                .select_for_update(skip_locked=True)
+                .filter(status=OUTBOX_PENDING, next_attempt_at__lte=now)
+                .annotate(offered=Exists(offered))
+                .order_by('next_attempt_at')[:batch_size]
+            )
+            closed = [message.pk for message in messages
+                      if not message.offered]
+            if closed:
+                noww.models.PushOutboxMessage.objects \
+                    .filter(pk__in=closed) \
+                    .update(status=OUTBOX_CANCELLED)
+            messages = [message for message in messages if message.offered]
+            if messages:
+                noww.models.PushOutboxMessage.objects \
+                    .filter(pk__in=[message.pk for message in messages]) \
+                    .update(next_attempt_at=now + timedelta(seconds=lease))
+        if messages:
+            get_push_sender().send_batch(
+                [PushOutbox.to_push(message) for message in messages])
+        return len(messages)
+
+    @staticmethod
+    def stats():
+        """
+        counts by status and the age of the oldest pending message
+        """
+        counts = {status: 0 for status in
+                  (OUTBOX_PENDING, OUTBOX_SENT, OUTBOX_FAILED,
+                   OUTBOX_CANCELLED)}
+        counts.update({
+            item['status']: item['count'] for item in
+            noww.models.PushOutboxMessage.objects.values('status')
+            .annotate(count=Count('id'))
+        })
+        oldest = noww.models.PushOutboxMessage.objects \
+            .filter(status=OUTBOX_PENDING).order_by('created_at') \
+            .values_list('created_at', flat=True).first()
+        return {
+            'pending': counts[OUTBOX_PENDING],
+            'sent': counts[OUTBOX_SENT],
+            'failed': counts[OUTBOX_FAILED],
+            'cancelled': counts[OUTBOX_CANCELLED],
+            'oldest_pending_age': round(
+                (timezone.now() - oldest).total_seconds(), 2
+            ) if oldest else None,
+        }
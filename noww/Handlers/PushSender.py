@@ -0,0 +1,228 @@
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+
+from django.db import close_old_connections
+
+import nowwapi.settings as settings
+from Common.providers import providers
+from noww.Handlers.Metrics import metrics, dispatch_logger
+
+logger = logging.getLogger()
+
+# registration ids per FCM multicast request
+FCM_MULTICAST_LIMIT = 1000
+
+
+class PushMessage:
+
+    def __init__(self, registration_id, message_title, message_body,
+                 data_message=None, on_result=None):
+        """
+        :param on_result: optional callable(error) called after the send,
+                          error is None for a delivered message
+        """
+        self.registration_id = registration_id
+        self.message_title = message_title
+        self.message_body = message_body
+        self.data_message = data_message
+        self.on_result = on_result
+
+    def group_key(self):
+        """
+        messages with the same content go in one multicast request
+        """
+        return (self.message_title, self.message_body,
+                json.dumps(self.data_message, sort_keys=True, default=str))
+
+
+class PushSender:
+    """
+    queue of the push notifications sent by a background thread in batches:
+    the messages with the same content are sent as one multicast request,
+    all requests go through the pooled session of one FCM client.
+    with PUSH_NOTIFICATIONS_SETTINGS['ASYNC'] = False the messages are
+    sent right away in the calling thread
+    """
+
+    def __init__(self, service, batch_size=500, flush_interval=.05,
+                 asynchronous=True):
+        self.service = service
+        self.batch_size = min(batch_size, FCM_MULTICAST_LIMIT)
+        self.flush_interval = flush_interval
+        self.asynchronous = asynchronous
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, registration_id, message_title, message_body,
+               data_message=None, on_result=None):
+        return self.put(PushMessage(registration_id, message_title,
+                                    message_body, data_message, on_result))
+
+    def put(self, message):
+        if not self.asynchronous:
+            return self.send_batch([message])
+        self._start()
+        self._queue.put(message)
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='push-sender', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        running = True
+        while running:
+            batch = []
+            timeout = None
+            while len(batch) < self.batch_size:
+                try:
+                    message = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if message is None:
+                    # stop() sentinel
+                    self._queue.task_done()
+                    running = False
+                    break
+                if not batch:
+                    # the batch is collected for flush_interval
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(message)
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            if not batch:
+                continue
+            try:
+                self.send_batch(batch)
+            except Exception as e:
+                logger.error("error with push batch: %s", e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                # the result callbacks use the database connection
+                close_old_connections()
+
+    def send_batch(self, messages):
+        """
+        :return: list of the errors in the order of the messages,
+                 None for a delivered message
+        """
+        started = time.perf_counter()
+        groups = {}
+        for message in messages:
+            groups.setdefault(message.group_key(), []).append(message)
+
+        errors = {}
+        for group in groups.values():
+            first = group[0]
+            try:
+                with metrics.span('push.fcm_request'):
+                    if len(group) == 1:
+                        result = self.service.notify_single_device(
+                            registration_id=first.registration_id,
+                            message_title=first.message_title,
+                            message_body=first.message_body,
+                            data_message=first.data_message,
+                            low_priority=False,
+                            content_available=True)
+                    else:
+                        result = self.service.notify_multiple_devices(
+                            registration_ids=[message.registration_id
+                                              for message in group],
+                            message_title=first.message_title,
+                            message_body=first.message_body,
+                            data_message=first.data_message,
+                            low_priority=False,
+                            content_available=True)
+            except Exception as e:
+                logger.error("error with notification: %s", e)
+                for message in group:
+                    errors[id(message)] = str(e) or type(e).__name__
+                continue
+            if result.get('failure'):
+                logger.error("push failures %s: %s", result.get('failure'),
+                             result.get('results'))
+            results = result.get('results') or []
+            for position, message in enumerate(group):
+                item = results[position] if position < len(results) else {}
+                errors[id(message)] = item.get('error')
+
+        elapsed = (time.perf_counter() - started) * 1000
+        metrics.observe('push.batch_latency_ms', elapsed)
+        metrics.observe('push.batch_size', len(messages))
+        metrics.observe('push.batch_requests', len(groups))
+        dispatch_logger.info("push batch: %s messages, %s requests, "
+                             "%.1f ms", len(messages), len(groups), elapsed)
+
+        for message in messages:
+            if message.on_result is not None:
+                try:
+                    message.on_result(errors[id(message)])
+                except Exception as e:
+                    logger.error("error with push result: %s", e)
+        return [errors[id(message)] for message in messages]
+
+    def flush(self):
+        """
+        waits until the queued messages are sent
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self):
+        """
+        sends the queued messages and stops the background thread
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_push_sender(service=None):
+    """
+    process wide sender
+    :param service: object with pyfcm notify_* methods, the `fcm` provider
+                    by default
+    :return: PushSender
+    """
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                if service is None:
+                    service = providers.get('fcm')
+                push_settings = settings.PUSH_NOTIFICATIONS_SETTINGS
+                sender = PushSender(
+                    service,
+                    batch_size=push_settings['BATCH_SIZE'],
+                    flush_interval=push_settings['FLUSH_INTERVAL'],
+                    asynchronous=push_settings['ASYNC'])
+                atexit.register(sender.flush)
+                _sender = sender
+    return _sender
+
+
+def reset_push_sender():
+    """
+    stops the sender, the next get_push_sender call builds a new one
+    """
+    global _sender
+    with _sender_lock:
+        if _sender is not None:
+            _sender.stop()
+        _sender = None
@@ -0,0 +1,192 @@
+import time
+import threading
+
+import noww.models
+import nowwapi.settings as settings
+from noww.Handlers.FirebaseSync import FirebaseTreeLoader
+
+
+class ReadinessCache:
+    """
+    local snapshot of worker_id -> (is_ready, last_seen).
+    an entry is taken as ready only while its heartbeat is younger than ttl
+    """
+
+    def __init__(self, ttl=120):
+        self.ttl = ttl
+        self.loader = None
+        self.loaded_at = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self, worker_id, is_ready, last_seen=None):
+        """
+        :param worker_id:
+        :param is_ready:
+        :param last_seen: unix time of the worker heartbeat, now if None
+        :return:
+        """
+        last_seen = time.time() if last_seen is None else last_seen
+        with self._lock:
+            self._entries[str(worker_id)] = (bool(is_ready), last_seen)
+
+    def remove(self, worker_id):
+        with self._lock:
+            self._entries.pop(str(worker_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def is_ready(self, worker_id, now=None):
+        entry = self._entries.get(str(worker_id))
+        if entry is None:
+            return False
+        now = time.time() if now is None else now
+        return entry[0] and now - entry[1] <= self.ttl
+
+    def filter_ready(self, worker_ids):
+        """
+        ready workers from the list keeping its order
+        """
+        now = time.time()
+        return [worker_id for worker_id in worker_ids
+                if self.is_ready(worker_id, now)]
+
+    def search_filter(self):
+        """
+        :return: kwargs of WorkerHandlerClass.search_workers
+        """
+        return {'predicate': self.is_ready}
+
+    def refresh(self):
+        """
+        one bulk read of the whole tree through the loader, keeps alive the
+        ready workers whose application does not send a heartbeat
+        """
+        self.loaded_at = time.time()
+        if self.loader is not None:
+            self.loader.load(self)
+        self.expire()
+
+    def refresh_if_stale(self):
+        if time.time() - self.loaded_at > self.ttl / 2:
+            self.refresh()
+
+    def expire(self):
+        """
+        drop the entries without a heartbeat within ttl
+        :return: count of the removed entries
+        """
+        deadline = time.time() - self.ttl
+        with self._lock:
+            stale = [worker_id for worker_id, entry in self._entries.items()
+                     if entry[1] < deadline]
+            for worker_id in stale:
+                del self._entries[worker_id]
+        return len(stale)
+
+
+class FirebaseReadinessLoader(FirebaseTreeLoader):
+    """
+    keeps the cache in sync with the firebase `worker_info` tree.
+    `timestamp` of the child (ms) is used as the heartbeat when present
+    """
+    reference_name = 'worker_info'
+
+    def apply(self, cache, worker_id, value):
+        if not value:
+            cache.remove(worker_id)
+            return
+        last_seen = value.get('timestamp')
+        if last_seen is not None:
+            last_seen = last_seen / 1000
+        cache.update(worker_id, value.get('is_ready', False), last_seen)
+
+
+class DatabaseReadiness:
+    """
+    readiness from Worker.is_ready. the geo candidates of a search ring are
+    filtered by one query on the partial index of the ready and verified
+    workers instead of a lookup per worker
+    """
+
+    @staticmethod
+    def set_ready(worker_id, is_ready):
+        """
+        :return: True if the worker exists
+        """
+        return noww.models.Worker.objects.filter(pk=worker_id) \
+            .update(is_ready=bool(is_ready)) == 1
+
+    @staticmethod
+    def filter_ready(worker_ids):
+        """
+        ready workers from the list keeping its order
+        """
+        # ids of the firebase trees are strings
+        pks = [int(worker_id) for worker_id in worker_ids
+               if str(worker_id).isdigit()]
+        if not pks:
+            return []
+        ready = {str(pk) for pk in noww.models.Worker.objects.filter(
+            pk__in=pks, is_ready=True, is_verified=True)
+            .values_list('pk', flat=True)}
+        return [worker_id for worker_id in worker_ids
+                if str(worker_id) in ready]
+
+    def search_filter(self):
+        return {'ready_filter': self.filter_ready}
+
+    def refresh_if_stale(self):
+        pass
+
+
+database_readiness = DatabaseReadiness()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_readiness_cache(loader=None):
+    """
+    process wide readiness cache, the loader is started on the first call
+    :param loader: object with start(cache) method, firebase by default
+    :return: ReadinessCache
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                cache = ReadinessCache(
+                    settings.DISPATCH_SETTINGS['READINESS_TTL'])
+                cache.loader = loader or FirebaseReadinessLoader()
+                cache.loaded_at = time.time()
+                cache.loader.start(cache)
+                _cache = cache
+    return _cache
+
+
+def reset_readiness_cache():
+    """
+    stops the loader and drops the cache, the next get_readiness_cache call
+    builds a new one
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is not None and _cache.loader is not None:
+            _cache.loader.stop()
+        _cache = None
+
+
+def get_readiness():
+    """
+    source of the worker readiness of DISPATCH_SETTINGS['READINESS_SOURCE']
+    :return: ReadinessCache or DatabaseReadiness
+    """
+    if settings.DISPATCH_SETTINGS['READINESS_SOURCE'] == 'db':
+        return database_readiness
+    return get_readiness_cache()
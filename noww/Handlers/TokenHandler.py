@@ -5,15 +5,27 @@ from rest_framework.response import Response
 import noww.models
 
 from noww.Handlers.WorkerHandler import WorkerHandlerClass
+from noww.Handlers.DispatchQueue import DispatchQueue, NoWorkerFound
+from noww.Handlers.DictionaryCache import dictionary_cache
+from noww.Handlers.Metrics import metrics
+from noww.Handlers.PushOutbox import PushOutbox
+from noww.Handlers.ProfitCounters import ProfitCounters
+from noww.Handlers.AttemptStore import (
+    AttemptStore, ATTEMPT_ACCEPTED, ATTEMPT_REJECTED
+)
 
-from pyfcm import FCMNotification
 import nowwapi.settings as settings
 
+from django.db import connection, transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 
-from Common.configs import TASK_STATUSES_FINAL
+from Common.configs import TASK_STATUSES_FINAL, TASK_STATUSES_CLOSED
+import asyncio
 import logging
+import contextvars
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger()
 
@@ -22,14 +34,12 @@ handler.setLevel(logging.ERROR)
 logger.addHandler(handler)
 
 message_title = "API Create task"
-push_service = FCMNotification(api_key=settings.PUSH_NOTIFICATIONS_SETTINGS['FCM_API_KEY'])
 
 
-def push_builder(task, rejected, token):
+def push_builder(task, token):
     """
     def function for the default fcm format
     :param task:
-    :param rejected:
     :param token:
     :return:
     """
@@ -44,7 +54,7 @@ def push_builder(task, rejected, token):
             "data": {
                 "task": task.pk,
                 "service": task.service.name,
-                "w_rejs": rejected
+                "w_rejs": ""
             },
             "apns": {
                 "headers": {
@@ -77,106 +87,206 @@ class TaskHandler(APIView):
         :return:
         """
         pk = request.data.get('pk')  # TODO pk from the parameters
-        task = noww.models.Task.objects.get(pk=pk)
-        if task:
-            status = request.data['status']
-            if status in TASK_STATUSES_FINAL:
-                task.status = status
-            else:
-                status_code = get_object_or_404(noww.models.Dictionary, name=status)
-                if status_code.type == 'WORKER_DECLINES':
-                    task.status = "CANCELLEDBYWORKER"
-                elif status_code.type == 'CUSTOMER_DECLINES':
-                    task.status = "CANCELLEDBYCUSTOMER"
-                task.reject_code = status_code.name
-            task.save()
-            return Response(status=ResponseStatus.HTTP_200_OK)
+        status = request.data['status']
+        if status in TASK_STATUSES_FINAL:
+            changes = {'status': status}
         else:
-            return Response(status=ResponseStatus.HTTP_404_NOT_FOUND)
+            status_code = dictionary_cache.get(status)
+            if status_code is None:
+                raise Http404
+            changes = {'reject_code': status_code['name']}
+            if status_code['type'] == 'WORKER_DECLINES':
+                changes['status'] = "CANCELLEDBYWORKER"
+            elif status_code['type'] == 'CUSTOMER_DECLINES':
+                changes['status'] = "CANCELLEDBYCUSTOMER"
+
+        if TaskHandler.transition(pk, **changes):
+            return Response(status=ResponseStatus.HTTP_200_OK)
+        if noww.models.Task.objects.filter(pk=pk).exists():
+            return Response(status=ResponseStatus.HTTP_409_CONFLICT)
+        return Response(status=ResponseStatus.HTTP_404_NOT_FOUND)
 
     @staticmethod
     def post(request):
         """
         method for processing order request - processing with workers
-        :param request: worker_id, token, w_rejs
+        :param request: worker_id, token
         :return:
         """
+        pk = request.data.get("worker_id")
+        worker = get_object_or_404(noww.models.Worker, pk=pk)
         try:
-            pk = request.data.get("worker_id")
-            worker = get_object_or_404(noww.models.Worker, pk=pk)
-
             token_answer = request.data.get('token')
             task_id, status = token_answer.split("_")
-        except Exception as e:
-            logger.error("problem with post requst", e)
-
-        task = get_object_or_404(noww.models.Task, pk=task_id)
-        if task and status == "ACCEPTED":
-            task.worker = worker
-            task.status = 'IN_PROGRESS'
-            task.save()
-            return Response(status=ResponseStatus.HTTP_200_OK)
-        elif task and status != "ACCEPTED":
-            if 'w_rejs' in request.data:
-                if request.data['w_rejs'] != "":
-                    worker_rejected = str(request.data['w_rejs'])
-                    worker_rejected += f',{request.data["worker_id"]}'
-                else:
-                    worker_rejected = str(request.data["worker_id"])
-            else:
-                worker_rejected = request.data["worker_id"]
-            OrderRequest(lat=task.task_address.latitude,
-                         lon=task.task_address.longitude, task_id=task_id,
-                         rejected=worker_rejected)
+            # the worker_task node and the offers hold int ids
+            task_id = int(task_id)
+        except (AttributeError, ValueError) as e:
+            logger.error("problem with post request: %s", e)
+            return Response(status=ResponseStatus.HTTP_400_BAD_REQUEST)
 
-            # TODO exclude rejeted ids from worker list
+        if status == "ACCEPTED":
+            if TaskHandler.accept(task_id, worker.pk):
+                return Response(status=ResponseStatus.HTTP_200_OK)
+            if noww.models.Task.objects.filter(pk=task_id).exists():
+                return Response(status=ResponseStatus.HTTP_409_CONFLICT)
+            return Response(status=ResponseStatus.HTTP_404_NOT_FOUND)
+        else:
+            get_object_or_404(noww.models.Task.objects.only('pk'), pk=task_id)
+            TaskHandler.reject(task_id, worker.pk)
             return Response("ok", status=ResponseStatus.HTTP_200_OK)
 
+    @staticmethod
+    def transition(task_id, **changes):
+        """
+        status change as one conditional update, a closed task is not changed
+        :param changes: fields of the task, status and reject_code
+        :return: True if this call changed the task
+        """
+        with transaction.atomic():
+            changed = noww.models.Task.objects.filter(pk=task_id) \
+                .exclude(status__in=TASK_STATUSES_CLOSED) \
+                .update(**changes)
+            if changed and 'status' in changes:
+                # the status before was an open one, any of them is paid
+                ProfitCounters.updated(task_id, status=None)
+        return bool(changed)
+
+    @staticmethod
+    def accept(task_id, worker_id):
+        """
+        the first worker to accept wins, the other offers are withdrawn
+        :return: False if the task is already taken
+        """
+        task_id = int(task_id)
+        with transaction.atomic():
+            accepted = noww.models.Task.objects \
+                .filter(pk=task_id, status='CREATED', worker__isnull=True) \
+                .update(worker_id=worker_id, status='IN_PROGRESS')
+            if accepted:
+                ProfitCounters.updated(task_id, worker_id=None,
+                                       status='CREATED')
+        if not accepted:
+            return False
+        AttemptStore.answer(task_id, worker_id, ATTEMPT_ACCEPTED)
+        for offered_id in AttemptStore.withdraw_pending(task_id):
+            # the accept is done, a lost withdrawal only leaves a stale offer
+            try:
+                WorkerHandlerClass.clear_workertask(offered_id, task_id)
+            except Exception as e:
+                logger.error("error with worker_task %s: %s", offered_id, e)
+        metrics.observe('dispatch.offers_per_assignment',
+                        AttemptStore.count(task_id))
+        return True
+
+    @staticmethod
+    def reject(task_id, worker_id):
+        """
+        rejected workers are kept by AttemptStore, w_rejs is ignored.
+        the task is dispatched again once no offer is pending, a late
+        answer to a task already taken or closed is only stored
+        """
+        task_id = int(task_id)
+        AttemptStore.answer(task_id, worker_id, ATTEMPT_REJECTED)
+        if DispatchQueue.waiting([task_id]) and \
+                not AttemptStore.has_pending(task_id):
+            DispatchQueue.enqueue(task_id)
+
 
 class OrderRequest():
 
-    def __init__(self, lat, lon, task_id, rejected=""):
+    def __init__(self, lat, lon, task_id):
         self.active_worker = 0
         self.lat = float(lat)
         self.lon = float(lon)
-        self.worker = self.get_worker(self.lat, self.lon, rejected)
         self.task = task_id
-        self.send_notify(self.worker, self.task, rejected)
+        fanout = settings.DISPATCH_SETTINGS['FANOUT']
+        with metrics.trace('dispatch', task_id=task_id, fanout=fanout):
+            with metrics.span('dispatch.search'):
+                self.worker = self.get_worker(
+                    self.lat, self.lon,
+                    AttemptStore.offered_workers(task_id), fanout)
+            if fanout > 1:
+                self.send_offers(self.worker, self.task)
+            else:
+                self.send_notify(self.worker, self.task)
 
     @staticmethod
-    def get_worker(lat, lon, rejected):
-        current_worker = WorkerHandlerClass.get_worker(lat, lon, rejected)
+    def get_worker(lat, lon, exclude=(), count=1):
+        current_worker = WorkerHandlerClass.get_worker(lat, lon, exclude,
+                                                       count)
         return current_worker
 
     @staticmethod
-    def send_notify(worker, task: str, rejected=""):
+    def send_offers(workers, task):
+        """
+        offers the task to all the workers at once
+        """
+        if not workers:
+            raise NoWorkerFound(f"no ready worker for task {task}")
+
+        def send(worker):
+            try:
+                OrderRequest.send_notify([worker], task)
+            finally:
+                connection.close()
+
+        async def fan_out(executor):
+            loop = asyncio.get_event_loop()
+            # a copy of the context per thread keeps the spans in the trace
+            await asyncio.gather(*[
+                loop.run_in_executor(executor,
+                                     contextvars.copy_context().run,
+                                     send, worker)
+                for worker in workers
+            ])
+
+        with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+            asyncio.run(fan_out(executor))
+
+    @staticmethod
+    def send_notify(worker, task: str):
+        """
+        offers the task to the first worker of the list. the errors go to
+        the caller, the dispatch job is retried with them
+        :raise NoWorkerFound: the list is empty
+        """
+        if not worker:
+            raise NoWorkerFound(f"no ready worker for task {task}")
+        worker_id = None
         try:
             task_id = int(task)
-            task = noww.models.Task.objects.get(pk=task_id)
-
             worker_id = int(worker[0]['worker_id'])
-            worker = get_object_or_404(noww.models.Worker, pk=worker_id)
+            pickup_distance = worker[0].get('distance')
+            with metrics.span('dispatch.load'):
+                task = noww.models.Task.objects.select_related('service') \
+                    .get(pk=task_id)
+                worker = get_object_or_404(noww.models.Worker, pk=worker_id)
 
             token = worker.device
-            # payload = push_builder(task, rejected, token)  # TODO tests for fcm push
-            WorkerHandlerClass.set_workertask(worker_id, task_id)
-
+            # payload = push_builder(task, token)  # TODO tests for fcm push
             # extra = {"task": task_id, "service": task.service.name,
-            #          "description": task.description, "w_rejs": rejected}
+            #          "description": task.description}
             message_body = f"New task: {task.description}"
+            # w_rejs is kept empty for the old applications
             payload = {"task": task_id, "service": task.service.name,
-                       "description": task.description, "w_rejs": rejected}
+                       "description": task.description, "w_rejs": ""}
 
             # TODO android/ios switch
-            result = push_service.notify_single_device(registration_id=token,
-                                                       message_title=message_title,
-                                                       message_body=message_body,
-                                                       data_message=payload,
-                                                       low_priority=False,
-                                                       content_available=True)
-            print(worker_id, payload, result)
+            with metrics.span('dispatch.worker_task_write'):
+                WorkerHandlerClass.set_workertask(worker_id, task_id)
+            # the push is sent after the commit, a lost one is retried
+            with metrics.span('dispatch.offer'):
+                with transaction.atomic():
+                    offer = AttemptStore.offer(task_id, worker_id)
+                    PushOutbox.add(task_id, worker_id, offer.attempt, token,
+                                   message_title, message_body, payload)
+            if pickup_distance is not None:
+                metrics.observe('dispatch.pickup_distance_km',
+                                pickup_distance)
         except Exception as e:
-            logger.error("error with notification", e, " worker_id", worker_id)
+            logger.error("error with notification of task %s to worker %s: "
+                         "%s", task, worker_id, e)
+            raise
 
 
 if __name__ == "__main__":
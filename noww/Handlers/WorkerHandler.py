@@ -1,8 +1,17 @@
-from GeoFire.geofire import GeoFire
 from Common import db_config
+from noww.Handlers.WorkerIndex import get_worker_index, haversine_array
+from noww.Handlers.ReadinessCache import get_readiness
+from noww.Handlers.Metrics import metrics, dispatch_logger
+from noww.Handlers.WorkerTaskWriter import get_worker_task_writer
+from noww.Handlers.GeoQueryCache import geo_query_cache
+import nowwapi.settings as settings
 
 from geopy import distance
+import numpy
 import datetime
+import logging
+
+logger = logging.getLogger()
 
 
 class WorkerHandlerClass:
@@ -20,50 +29,191 @@ class WorkerHandlerClass:
 
     @staticmethod
     def set_workertask(worker_id,task_id):
-        db_config.worker_task.child(str(worker_id)).set({
+        get_worker_task_writer().set(worker_id, {
             "id": task_id,
             "status": 1,
             "timestamp": int(datetime.datetime.utcnow().timestamp() * 1000)
         })
 
+    @staticmethod
+    def clear_workertask(worker_id, task_id):
+        """
+        withdraws the offer if the worker still has this task
+        """
+        get_worker_task_writer().clear(worker_id, task_id)
 
     @staticmethod
-    def get_worker(lat, lon, rejected=""):
+    def nearby_workers(lat, lon, radius, exclude=(), predicate=None,
+                       limit=None, min_radius=0, stats=None):
+        """
+        workers around the point ordered by distance
+        :param exclude: worker ids to skip
+        :param predicate: optional callable(worker_id) -> bool
+        :param limit: max count, DISPATCH_SETTINGS['CANDIDATES_LIMIT'] if None
+        :param min_radius: km, closer workers are skipped
+        :param stats: optional dict to count the scanned workers
+        :return: list of dicts with id, loc and distance keys
+        """
+        if limit is None:
+            limit = settings.DISPATCH_SETTINGS['CANDIDATES_LIMIT']
+        if settings.DISPATCH_SETTINGS['WORKER_INDEX']:
+            return get_worker_index().nearest(
+                lat, lon, radius, limit=limit, exclude=exclude,
+                predicate=predicate, min_radius=min_radius, stats=stats)
+
+        if geo_query_cache.ttl:
+            result = geo_query_cache.get(lat, lon, radius, geofire_query)
+        else:
+            result = geofire_query(lat, lon, radius)
+        if stats is not None:
+            stats['scanned'] = stats.get('scanned', 0) + len(result)
+
+        exclude = {str(item) for item in exclude}
+        candidates = [item for item in result if item not in exclude and
+                      (predicate is None or predicate(item))]
+        distances = orderby_distance((lat, lon), [{'id': item, 'loc': result[item]['l']} for item in candidates])
+        distances = [item for item in distances if item['distance'] <= radius and
+                     (not min_radius or item['distance'] > min_radius)][:limit]
+        for item in distances:
+            item['loc'] = result[item['id']]['l']
+        return distances
 
-        rejs = []
-        if rejected != "":
-            rejs = list(map(int, rejected.split(",")))
+    @staticmethod
+    def search_workers(lat, lon, count, exclude=(), predicate=None,
+                       ready_filter=None):
+        """
+        expanding ring search: starts at the smallest radius of
+        DISPATCH_SETTINGS['SEARCH_RINGS'] and widens until `count` workers
+        are found. each ring only takes the workers beyond the previous one
+        :param ready_filter: optional callable(list of ids) -> list of ids,
+            applied at once to the candidates of a ring
+        :return: list of dicts with id, loc and distance keys
+        """
+        rings = settings.DISPATCH_SETTINGS['SEARCH_RINGS']
+        if not settings.DISPATCH_SETTINGS['WORKER_INDEX']:
+            # one remote query of the widest ring
+            rings = rings[-1:]
+
+        stats = {'scanned': 0}
+        found = []
+        inner = 0
+        for radius in rings:
+            if ready_filter is None:
+                with metrics.span('dispatch.geo_query'):
+                    found += WorkerHandlerClass.nearby_workers(
+                        lat, lon, radius, exclude=exclude,
+                        predicate=predicate, limit=count - len(found),
+                        min_radius=inner, stats=stats)
+            else:
+                found += WorkerHandlerClass.ready_in_ring(
+                    lat, lon, radius, inner, count - len(found), exclude,
+                    predicate, ready_filter, stats)
+            inner = radius
+            if len(found) >= count:
+                break
+
+        metrics.observe('dispatch.candidates_scanned', stats['scanned'])
+        metrics.observe('dispatch.search_radius_km', inner)
+        dispatch_logger.info("worker search scanned=%s radius=%s found=%s",
+                             stats['scanned'], inner, len(found))
+        return found
 
-        geofire = GeoFire(lat=lat,
-                          lon=lon,
-                          radius=10,
-                          unit='km').config_firebase(
-            api_key=db_config.api_key,
-            auth_domain=db_config.auth_domain,
-            database_URL=db_config.database_URL,
-            storage_bucket=db_config.storage_bucket)
+    @staticmethod
+    def ready_in_ring(lat, lon, radius, inner, count, exclude, predicate,
+                      ready_filter, stats):
+        """
+        nearest ready workers between inner and radius km. the ring is read
+        by pages of CANDIDATES_LIMIT until `count` of them are ready or the
+        ring is exhausted
+        """
+        page_size = settings.DISPATCH_SETTINGS['CANDIDATES_LIMIT']
+        seen = {str(item) for item in exclude}
+        found = []
+        while len(found) < count:
+            with metrics.span('dispatch.geo_query'):
+                page = WorkerHandlerClass.nearby_workers(
+                    lat, lon, radius, exclude=seen, predicate=predicate,
+                    limit=page_size, min_radius=inner, stats=stats)
+            with metrics.span('dispatch.readiness_filter'):
+                ready = set(ready_filter([item['id'] for item in page]))
+            found += [item for item in page
+                      if item['id'] in ready][:count - len(found)]
+            if len(page) < page_size:
+                break
+            seen.update(item['id'] for item in page)
+        return found
 
-        result = geofire.query_nearby_objects(query_ref='worker_locations', geohash_ref='g')
+    @staticmethod
+    def get_worker(lat, lon, exclude=(), count=1):
+        """
+        nearest ready workers
+        :param exclude: ids of the workers already offered the task
+        :param count: max count of the workers
+        :return: list of the workers ordered by distance
+        """
+        readiness = get_readiness()
+        with metrics.span('dispatch.readiness_refresh'):
+            readiness.refresh_if_stale()
 
         res = []
-        distances = orderby_distance((lat, lon), [{'id': item, 'loc': result[item]['l']} for item in result])
+        distances = WorkerHandlerClass.search_workers(
+            lat, lon, count, exclude=exclude, **readiness.search_filter())
         for item in distances:
-            if int(item['id']) not in rejs:
-                try:
-                    w_info = db_config.worker_info.child(item['id']).get()
-                    if w_info['is_ready']:
-                        res.append({
-                            "worker_id": item['id'],
-                            "loc": result[item['id']]['l']
-                        })
-                        break
-                except Exception as e:
-                    print("error with worker_info:", item['id'], e)
+            res.append({
+                "worker_id": item['id'],
+                "loc": item['loc'],
+                "distance": item['distance']
+            })
 
         return res
 
 
-def orderby_distance(center_point: tuple, workers: list):
+def geofire_query(lat, lon, radius):
+    """
+    workers of the firebase `worker_locations` tree within radius km
+    :return: dict id -> {g, l}
+    """
+    from GeoFire.geofire import GeoFire
+
+    geofire = GeoFire(lat=lat,
+                      lon=lon,
+                      radius=radius,
+                      unit='km').config_firebase(
+        api_key=db_config.api_key,
+        auth_domain=db_config.auth_domain,
+        database_URL=db_config.database_URL,
+        storage_bucket=db_config.storage_bucket)
+
+    return geofire.query_nearby_objects(query_ref='worker_locations',
+                                        geohash_ref='g')
+
+
+def orderby_distance(center_point: tuple, workers: list, limit=None):
+    """
+    ranking of the workers by the distance to the point. distances of all
+    candidates are computed at once, with the limit only the top-k are sorted
+    :param center_point: (lat, lon)
+    :param workers: list of dicts with id and loc keys
+    :param limit: count of the nearest workers, all of them if None
+    :return: list of dicts with id and distance (km) keys
+    """
+    if not workers:
+        return []
+    locs = numpy.asarray([worker['loc'] for worker in workers],
+                         dtype=numpy.float64)
+    distances = haversine_array(float(center_point[0]), float(center_point[1]),
+                                locs[:, 0], locs[:, 1])
+
+    if limit is not None and limit < len(distances):
+        order = numpy.argpartition(distances, limit)[:limit]
+        order = order[numpy.argsort(distances[order], kind='stable')]
+    else:
+        order = numpy.argsort(distances, kind='stable')
+    return [{'id': workers[i]['id'], 'distance': float(distances[i])}
+            for i in order]
+
+
+def orderby_geodesic_distance(center_point: tuple, workers: list):
     result = []
     for worker in workers:
         point_distance = distance.distance(center_point, worker['loc'])
@@ -0,0 +1,220 @@
+import math
+import heapq
+import threading
+
+import numpy
+import nowwapi.settings as settings
+from noww.Handlers.FirebaseSync import FirebaseTreeLoader
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    great-circle distance between two points
+    :return: distance in km
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def haversine_array(lat, lon, lats, lons):
+    """
+    great-circle distances from the point to arrays of points
+    :param lat:
+    :param lon:
+    :param lats: numpy array
+    :param lons: numpy array
+    :return: numpy array of distances in km
+    """
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = numpy.radians(lats), numpy.radians(lons)
+    a = numpy.sin((lats - lat) / 2) ** 2 + \
+        math.cos(lat) * numpy.cos(lats) * numpy.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(a))
+
+
+class WorkerIndex:
+    """
+    resident grid index of the worker positions.
+    workers are bucketed into square cells of `cell_size` degrees, a radius
+    query only visits the cells of the bounding box around the point
+    """
+
+    def __init__(self, cell_size=0.05):
+        self.cell_size = float(cell_size)
+        self.loader = None
+        self._positions = {}
+        self._cells = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, worker_id):
+        return str(worker_id) in self._positions
+
+    def _cell(self, lat, lon):
+        return (int(math.floor(lat / self.cell_size)),
+                int(math.floor(lon / self.cell_size)))
+
+    def update(self, worker_id, lat, lon):
+        """
+        insert or move the worker
+        :param worker_id:
+        :param lat:
+        :param lon:
+        :return:
+        """
+        worker_id = str(worker_id)
+        lat, lon = float(lat), float(lon)
+        cell = self._cell(lat, lon)
+        with self._lock:
+            previous = self._positions.get(worker_id)
+            if previous and previous[2] != cell:
+                self._discard(worker_id, previous[2])
+            self._positions[worker_id] = (lat, lon, cell)
+            self._cells.setdefault(cell, set()).add(worker_id)
+
+    def remove(self, worker_id):
+        worker_id = str(worker_id)
+        with self._lock:
+            previous = self._positions.pop(worker_id, None)
+            if previous:
+                self._discard(worker_id, previous[2])
+
+    def _discard(self, worker_id, cell):
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.discard(worker_id)
+            if not bucket:
+                del self._cells[cell]
+
+    def clear(self):
+        with self._lock:
+            self._positions.clear()
+            self._cells.clear()
+
+    def get(self, worker_id):
+        position = self._positions.get(str(worker_id))
+        return [position[0], position[1]] if position else None
+
+    def nearest(self, lat, lon, radius, limit=None, exclude=(),
+                predicate=None, min_radius=0, stats=None):
+        """
+        nearest workers within the radius ordered by distance
+        :param lat:
+        :param lon:
+        :param radius: km
+        :param limit: max count of the workers, all of them if None
+        :param exclude: worker ids to skip
+        :param predicate: optional callable(worker_id) -> bool
+        :param min_radius: km, workers closer than it are skipped (ring)
+        :param stats: optional dict, `scanned` is increased by the count
+                      of the workers whose distance was computed
+        :return: list of dicts with id, loc and distance (km) keys
+        """
+        lat, lon = float(lat), float(lon)
+        lat_span = radius / KM_PER_DEGREE
+        lon_span = radius / (KM_PER_DEGREE *
+                             max(math.cos(math.radians(lat)), 1e-6))
+        min_cell = self._cell(lat - lat_span, lon - lon_span)
+        max_cell = self._cell(lat + lat_span, lon + lon_span)
+        exclude = {str(item) for item in exclude}
+
+        found = []
+        scanned = 0
+        with self._lock:
+            for cell_lat in range(min_cell[0], max_cell[0] + 1):
+                for cell_lon in range(min_cell[1], max_cell[1] + 1):
+                    for worker_id in self._cells.get((cell_lat, cell_lon), ()):
+                        if worker_id in exclude:
+                            continue
+                        w_lat, w_lon, _ = self._positions[worker_id]
+                        point_distance = haversine(lat, lon, w_lat, w_lon)
+                        scanned += 1
+                        if point_distance <= radius and \
+                                (not min_radius or point_distance > min_radius):
+                            found.append((point_distance, worker_id,
+                                          w_lat, w_lon))
+
+        if stats is not None:
+            stats['scanned'] = stats.get('scanned', 0) + scanned
+        if predicate is not None:
+            found = [item for item in found if predicate(item[1])]
+        if limit is not None:
+            found = heapq.nsmallest(limit, found)
+        else:
+            found.sort()
+        return [{'id': worker_id, 'loc': [w_lat, w_lon],
+                 'distance': point_distance}
+                for point_distance, worker_id, w_lat, w_lon in found]
+
+
+class FirebaseLocationLoader(FirebaseTreeLoader):
+    """
+    keeps the index in sync with the firebase `worker_locations` tree
+    written by the worker application through GeoFire ({id: {g, l}})
+    """
+    reference_name = 'worker_locations'
+
+    def apply(self, index, worker_id, value):
+        if not value:
+            index.remove(worker_id)
+        else:
+            lat, lon = value['l']
+            index.update(worker_id, lat, lon)
+
+
+def default_loader():
+    if settings.DISPATCH_SETTINGS['LOCATION_SOURCE'] == 'backend':
+        from noww.Handlers.LocationStore import DatabaseLocationLoader
+        return DatabaseLocationLoader(
+            settings.DISPATCH_SETTINGS['LOCATION_POLL_INTERVAL'],
+            settings.DISPATCH_SETTINGS['LOCATION_MAX_AGE'])
+    return FirebaseLocationLoader()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_worker_index(loader=None):
+    """
+    process wide index, the loader is started on the first call
+    :param loader: object with start(index) method, by default the one
+        of DISPATCH_SETTINGS['LOCATION_SOURCE']
+    :return: WorkerIndex
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = WorkerIndex(
+                    settings.DISPATCH_SETTINGS['WORKER_INDEX_CELL_SIZE'])
+                index.loader = loader or default_loader()
+                index.loader.start(index)
+                _index = index
+    return _index
+
+
+def current_worker_index():
+    """
+    :return: the index of this process if it is built, else None
+    """
+    return _index
+
+
+def reset_worker_index():
+    """
+    stops the loader and drops the index, the next get_worker_index call
+    builds a new one
+    """
+    global _index
+    with _index_lock:
+        if _index is not None and _index.loader is not None:
+            _index.loader.stop()
+        _index = None
@@ -0,0 +1,150 @@
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save
+)
+
+import noww.models
+
+STARS = range(1, 6)
+
+
+def star_field(star):
+    """
+    column of the star histogram, None for a star out of 1..5
+    """
+    return f"rating_{star}" if star in STARS else None
+
+
+class WorkerRating:
+    """
+    rating columns of Worker (sum, count and count by star) kept in step
+    with the CustomerReview rows: every save/delete of a review applies its
+    delta in the transaction of the change. `manage.py rebuild_ratings`
+    recomputes them from the reviews
+    """
+
+    @staticmethod
+    def apply(worker_id, star, sign):
+        """
+        :param sign: 1 - the review is added, -1 - removed
+        """
+        if worker_id is None or star is None:
+            return
+        changes = {'rating_sum': F('rating_sum') + sign * star,
+                   'rating_count': F('rating_count') + sign}
+        field = star_field(star)
+        if field is not None:
+            changes[field] = F(field) + sign
+        noww.models.Worker.objects.filter(pk=worker_id).update(**changes)
+
+    @staticmethod
+    def add(worker_ids, star):
+        """
+        one review of the star for each worker, with one update
+        """
+        changes = {'rating_sum': F('rating_sum') + star,
+                   'rating_count': F('rating_count') + 1}
+        field = star_field(star)
+        if field is not None:
+            changes[field] = F(field) + 1
+        return noww.models.Worker.objects.filter(pk__in=worker_ids) \
+            .update(**changes)
+
+    @staticmethod
+    def rated(customer_review):
+        """
+        :return: (worker_id, star) counted for the stored review
+        """
+        if customer_review.review_id is None:
+            return None, None
+        return customer_review.worker_id, noww.models.Review.objects \
+            .filter(pk=customer_review.review_id) \
+            .values_list('star', flat=True).first()
+
+    @staticmethod
+    def rebuild(worker_ids=None):
+        """
+        recomputes the columns from the reviews with one aggregate query
+        :param worker_ids: workers to rebuild, all if None
+        :return: count of the workers with reviews
+        """
+        workers = noww.models.Worker.objects.all()
+        reviews = noww.models.CustomerReview.objects \
+            .filter(review__isnull=False)
+        if worker_ids is not None:
+            workers = workers.filter(pk__in=worker_ids)
+            reviews = reviews.filter(worker__in=worker_ids)
+        aggregates = {
+            'rating_sum': Sum('review__star'),
+            'rating_count': Count('review__star'),
+            **{star_field(star): Count('pk', filter=Q(review__star=star))
+               for star in STARS},
+        }
+        rows = reviews.values('worker').annotate(**aggregates)
+
+        with transaction.atomic():
+            workers.update(**{field: 0 for field in aggregates})
+            for row in rows:
+                worker_id = row.pop('worker')
+                noww.models.Worker.objects.filter(pk=worker_id) \
+                    .update(**row)
+        return len(rows)
+
+    @staticmethod
+    def review_saving(instance, **kwargs):
+        instance._rated = WorkerRating.rated(instance) \
+            if instance.pk else (None, None)
+
+    @staticmethod
+    def review_saved(instance, **kwargs):
+        old = getattr(instance, '_rated', (None, None))
+        new = WorkerRating.rated(instance)
+        if old != new:
+            with transaction.atomic():
+                WorkerRating.apply(*old, -1)
+                WorkerRating.apply(*new, 1)
+        instance._rated = new
+
+    @staticmethod
+    def review_deleting(instance, **kwargs):
+        # the Review row can be deleted along with this one
+        instance._rated = WorkerRating.rated(instance)
+
+    @staticmethod
+    def review_deleted(instance, **kwargs):
+        WorkerRating.apply(*getattr(instance, '_rated', (None, None)), -1)
+
+    @staticmethod
+    def star_saving(instance, **kwargs):
+        instance._old_star = noww.models.Review.objects \
+            .filter(pk=instance.pk).values_list('star', flat=True).first() \
+            if instance.pk else None
+
+    @staticmethod
+    def star_saved(instance, created, **kwargs):
+        old = getattr(instance, '_old_star', None)
+        if created or old is None or old == instance.star:
+            return
+        worker_ids = noww.models.CustomerReview.objects \
+            .filter(review=instance).values_list('worker_id', flat=True)
+        with transaction.atomic():
+            for worker_id in worker_ids:
+                WorkerRating.apply(worker_id, old, -1)
+                WorkerRating.apply(worker_id, instance.star, 1)
+
+    @staticmethod
+    def connect():
+        sender = noww.models.CustomerReview
+        pre_save.connect(WorkerRating.review_saving, sender=sender,
+                         dispatch_uid='worker_rating_review_saving')
+        post_save.connect(WorkerRating.review_saved, sender=sender,
+                          dispatch_uid='worker_rating_review_saved')
+        pre_delete.connect(WorkerRating.review_deleting, sender=sender,
+                           dispatch_uid='worker_rating_review_deleting')
+        post_delete.connect(WorkerRating.review_deleted, sender=sender,
+                            dispatch_uid='worker_rating_review_deleted')
+        pre_save.connect(WorkerRating.star_saving, sender=noww.models.Review,
+                         dispatch_uid='worker_rating_star_saving')
+        post_save.connect(WorkerRating.star_saved, sender=noww.models.Review,
+                          dispatch_uid='worker_rating_star_saved')
@@ -0,0 +1,154 @@
+import time
+import atexit
+import logging
+import threading
+
+import nowwapi.settings as settings
+from Common import db_config
+from noww.Handlers.Metrics import metrics
+
+logger = logging.getLogger()
+
+
+class WorkerTaskWriter:
+    """
+    write-behind buffer of the firebase `worker_task` tree: the writes are
+    merged by worker (the last one wins) and sent as one multi-path update
+    when the buffer reaches max_size or flush_interval after the first write.
+    with max_size = 0 every write goes to firebase right away.
+    a failed update is kept in the buffer and retried with a backoff
+    """
+    retry_max = 5  # seconds between the retries of a failed update
+
+    def __init__(self, max_size=100, flush_interval=.05):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._timer = None
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def set(self, worker_id, value):
+        """
+        :param value: dict of the worker_task node, None removes the node
+        """
+        with self._lock:
+            self._pending[str(worker_id)] = value
+            full = len(self._pending) >= self.max_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def clear(self, worker_id, task_id):
+        """
+        removes the node if it still holds the task, a buffered write of
+        the worker is resolved locally
+        """
+        worker_id = str(worker_id)
+        if self._clear_pending(worker_id, task_id):
+            return
+
+        def withdraw(current):
+            if current and current.get('id') == task_id:
+                return None
+            return current
+
+        # after the flush in progress, which can hold the task or give it
+        # back to the buffer when it fails
+        with self._flush_lock:
+            if self._clear_pending(worker_id, task_id):
+                return
+            db_config.reference('worker_task').child(worker_id) \
+                .transaction(withdraw)
+
+    def _clear_pending(self, worker_id, task_id):
+        """
+        :return: True if the worker has a buffered write
+        """
+        with self._lock:
+            if worker_id not in self._pending:
+                return False
+            current = self._pending[worker_id]
+            if current and current.get('id') == task_id:
+                self._pending[worker_id] = None
+            return True
+
+    def flush(self):
+        """
+        sends the buffered writes, synchronously
+        :return: count of the written nodes
+        """
+        # flushes go one by one to keep the order of the writes of a worker
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            started = time.perf_counter()
+            try:
+                db_config.reference('worker_task').update(pending)
+            except Exception as e:
+                logger.error("error with worker_task update of %s: %s",
+                             list(pending), e)
+                self._retry(pending)
+                return 0
+            self._failures = 0
+            metrics.observe('firebase.worker_task_batch', len(pending))
+            metrics.observe('firebase.worker_task_flush_ms',
+                            (time.perf_counter() - started) * 1000)
+            return len(pending)
+
+    def _retry(self, pending):
+        """
+        puts the failed writes back under the newer ones of the same
+        workers and flushes them again with a backoff
+        """
+        with self._lock:
+            pending.update(self._pending)
+            self._pending = pending
+            self._failures += 1
+            delay = min(max(self.flush_interval, .1) * 2 ** self._failures,
+                        self.retry_max)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_worker_task_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                writer = WorkerTaskWriter(
+                    settings.DISPATCH_SETTINGS['WORKER_TASK_BUFFER'],
+                    settings.DISPATCH_SETTINGS['WORKER_TASK_FLUSH_INTERVAL'])
+                atexit.register(writer.flush)
+                _writer = writer
+    return _writer
+
+
+def reset_worker_task_writer():
+    """
+    flushes and drops the writer
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.flush()
+        _writer = None
@@ -337,10 +337,15 @@ class WorkerAccessPolicy(AccessPolicy):
             "effect": "allow"
         },
         {
-            "action": ["delete", "approve"],
+            "action": ["delete", "approve", "verify"],
             "principal": ["group:Administrator", "group:Manager"],
             "effect": "allow"
         },
+        {
+            "action": ["locations", "ready"],
+            "principal": ["group:Worker"],
+            "effect": "allow"
+        },
     ]
 
     def user_worker_owner(self, request, view, action):
@@ -348,3 +353,37 @@ class WorkerAccessPolicy(AccessPolicy):
         if request.user.groups.filter(name='Worker').exists():
             return worker.user == request.user
         return True
+
+
+class DispatchAccessPolicy(AccessPolicy):
+    statements = [
+        {
+            "action": ["DispatchQueueStats"],
+            "principal": [
+                "group:Administrator", "group:Manager", "group:Support"
+            ],
+            "effect": "allow"
+        },
+    ]
+
+
+class MetricsAccessPolicy(AccessPolicy):
+    statements = [
+        {
+            "action": ["MetricsView"],
+            "principal": [
+                "group:Administrator", "group:Manager", "group:Support"
+            ],
+            "effect": "allow"
+        },
+    ]
+
+
+class DictionaryAccessPolicy(AccessPolicy):
+    statements = [
+        {
+            "action": ["DictionaryView"],
+            "principal": "*",
+            "effect": "allow"
+        },
+    ]
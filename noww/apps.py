@@ -3,3 +3,15 @@ from django.apps import AppConfig
 
 class NowwConfig(AppConfig):
     name = 'noww'
+
+    def ready(self):
+        from noww.Handlers.DictionaryCache import dictionary_cache
+        dictionary_cache.connect()
+        from noww.Handlers.WorkerRating import WorkerRating
+        WorkerRating.connect()
+        from noww.Handlers.ProfitCounters import ProfitCounters
+        ProfitCounters.connect()
+        from noww.Handlers.PlaceKinds import PlaceKinds
+        PlaceKinds.connect()
+        from noww.Handlers.MetricsSnapshots import MetricsSnapshots
+        MetricsSnapshots.connect()
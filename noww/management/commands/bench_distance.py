@@ -0,0 +1,51 @@
+import time
+import random
+
+from django.core.management.base import BaseCommand
+
+from noww.Handlers.WorkerHandler import (
+    orderby_distance, orderby_geodesic_distance
+)
+
+
+class Command(BaseCommand):
+    help = "Benchmark of the dispatch candidates ranking: geopy loop " \
+           "against the batched haversine ranking"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,10000,100000',
+                            help="comma separated counts of candidates")
+        parser.add_argument('--top', type=int, default=50,
+                            help="k for the partial sort")
+        parser.add_argument('--repeat', type=int, default=3)
+
+    @staticmethod
+    def timeit(func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000
+
+    def handle(self, *args, **options):
+        center = (50.4501, 30.5234)
+        self.stdout.write(f"{'candidates':>10} {'geopy, ms':>12} "
+                          f"{'numpy, ms':>12} {'numpy top-k, ms':>16}")
+        for size in map(int, options['sizes'].split(',')):
+            workers = [
+                {'id': str(i), 'loc': [center[0] + random.uniform(-.09, .09),
+                                       center[1] + random.uniform(-.14, .14)]}
+                for i in range(size)
+            ]
+            geopy_ms = self.timeit(
+                lambda: orderby_geodesic_distance(center, workers),
+                options['repeat'])
+            numpy_ms = self.timeit(
+                lambda: orderby_distance(center, workers), options['repeat'])
+            top_ms = self.timeit(
+                lambda: orderby_distance(center, workers, options['top']),
+                options['repeat'])
+            self.stdout.write(f"{size:>10} {geopy_ms:>12.2f} "
+                              f"{numpy_ms:>12.2f} {top_ms:>16.2f}")
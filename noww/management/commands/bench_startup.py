@@ -0,0 +1,78 @@
+import sys
+import statistics
+import subprocess
+
+from django.core.management.base import BaseCommand
+
+import nowwapi.settings as settings
+
+SETUP = """
+import os, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nowwapi.settings')
+start = time.perf_counter()
+import django
+django.setup()
+import nowwapi.urls
+{eager}
+print(time.perf_counter() - start)
+"""
+
+# the clients created at import time before the provider registry
+EAGER = """
+from Common.providers import providers
+providers.get('firebase')
+providers.get('fcm')
+"""
+
+EXTERNAL_MODULES = ('firebase_admin', 'pyfcm', 'google.cloud', 'GeoFire')
+
+
+class Command(BaseCommand):
+    help = "Startup time of a process: django.setup() and the url conf " \
+           "with the lazy external clients against the eager ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--top', type=int, default=15,
+                            help="slowest imports to list")
+
+    @staticmethod
+    def run(code, *args):
+        return subprocess.run(
+            [sys.executable, *args, '-c', code], cwd=settings.BASE_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True)
+
+    def measure(self, eager, repeat):
+        code = SETUP.format(eager=EAGER if eager else '')
+        return [float(self.run(code).stdout.strip().splitlines()[-1]) * 1000
+                for _ in range(repeat)]
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'clients':>8} {'min, ms':>10} {'median, ms':>12}")
+        for name, eager in (('lazy', False), ('eager', True)):
+            try:
+                timings = self.measure(eager, options['repeat'])
+            except subprocess.CalledProcessError as e:
+                self.stderr.write(f"{name}: {e.stderr.strip()}")
+                continue
+            self.stdout.write(f"{name:>8} {min(timings):>10.1f} "
+                              f"{statistics.median(timings):>12.1f}")
+
+        # -X importtime lines: "import time: self | cumulative | package"
+        imports = []
+        for line in self.run(SETUP.format(eager=''),
+                             '-X', 'importtime').stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, module = line[len('import time:'):].split('|')
+            imports.append((int(cumulative), module.rstrip()))
+        loaded = {module.strip() for _, module in imports}
+
+        self.stdout.write("\nslowest imports of the lazy startup, us:")
+        for cumulative, module in sorted(imports, reverse=True)[
+                :options['top']]:
+            self.stdout.write(f"{cumulative:>10} {module}")
+        self.stdout.write("\nexternal clients imported at startup: " + (
+            ", ".join(module for module in EXTERNAL_MODULES
+                      if module in loaded) or "none"))
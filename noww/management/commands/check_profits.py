@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from noww.Handlers.ProfitCounters import ProfitCounters
+
+
+class Command(BaseCommand):
+    help = "Compares the profit counters of the workers and customers with " \
+           "the totals of their tasks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help="rewrite the counters which differ")
+
+    def handle(self, *args, **options):
+        mismatches = ProfitCounters.check(fix=options['fix'])
+        for model_name, owner_id, currency, stored, derived in mismatches:
+            self.stdout.write(
+                f"{model_name} {owner_id} {currency}: stored {stored[0]} "
+                f"({stored[1]} tasks), derived {derived[0]} "
+                f"({derived[1]} tasks)")
+        self.stdout.write(
+            f"{len(mismatches)} mismatches" +
+            (", fixed" if options['fix'] and mismatches else ""))
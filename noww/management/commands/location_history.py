@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+
+import nowwapi.settings as settings
+from noww.Handlers.LocationStore import location_history
+
+
+class Command(BaseCommand):
+    help = "Partitions of the worker location history: creates the ones " \
+           "of this and the next month, drops the ones past the retention"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months', type=int,
+            default=settings.DISPATCH_SETTINGS['LOCATION_RETENTION_MONTHS'],
+            help="months of the history to keep")
+
+    def handle(self, *args, **options):
+        now = datetime.now(dt_timezone.utc)
+        this_month = location_history.month_start(now)
+        for month in (this_month, this_month + timedelta(days=32)):
+            name = location_history.ensure_partition(month)
+            if name:
+                self.stdout.write(f"partition {name}")
+
+        limit = this_month
+        for _ in range(options['months'] - 1):
+            limit = location_history.month_start(limit - timedelta(days=1))
+        for name in location_history.drop_before(limit):
+            self.stdout.write(f"dropped {name}")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from noww.Handlers.WorkerRating import WorkerRating
+
+
+class Command(BaseCommand):
+    help = "Recomputes the rating columns of the workers from the reviews"
+
+    def add_arguments(self, parser):
+        parser.add_argument('workers', nargs='*', type=int,
+                            help="worker ids, all the workers if empty")
+
+    def handle(self, *args, **options):
+        rated = WorkerRating.rebuild(options['workers'] or None)
+        self.stdout.write(f"rebuilt the ratings, {rated} workers with reviews")
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+import nowwapi.settings as settings
+from noww.Handlers.DispatchQueue import DispatchQueue
+from noww.Handlers.MetricsSnapshots import MetricsSnapshots
+from noww.Handlers.OfferScheduler import get_offer_scheduler
+from noww.Handlers.PushOutbox import PushOutbox
+from noww.Handlers.WorkerTaskWriter import get_worker_task_writer
+
+
+class Command(BaseCommand):
+    help = "Worker process of the dispatch queue, the offer timeouts " \
+           "and the push outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="run the pending jobs and exit")
+
+    def handle(self, *args, **options):
+        poll_interval = settings.DISPATCH_SETTINGS['QUEUE_POLL_INTERVAL']
+        batch_size = settings.DISPATCH_SETTINGS['QUEUE_BATCH_SIZE']
+        batch_window = settings.DISPATCH_SETTINGS['BATCH_WINDOW']
+        scheduler = get_offer_scheduler()
+
+        requeued = DispatchQueue.requeue_stale()
+        if requeued:
+            self.stdout.write(f"requeued {requeued} stale jobs")
+
+        while True:
+            expired = scheduler.tick()
+            if expired:
+                self.stdout.write(f"expired {expired} offers")
+            jobs = DispatchQueue.claim(batch_size)
+            if jobs and batch_window:
+                # the burst is collected for the window and assigned at once
+                time.sleep(batch_window)
+                if len(jobs) < batch_size:
+                    jobs += DispatchQueue.claim(batch_size - len(jobs))
+                DispatchQueue.run_batch(jobs)
+            else:
+                for job in jobs:
+                    DispatchQueue.run(job)
+            # the offers of the round go to firebase in one update
+            get_worker_task_writer().flush()
+            PushOutbox.drain()
+            MetricsSnapshots.publish_due()
+            if not jobs:
+                if options['once']:
+                    MetricsSnapshots.publish()
+                    return
+                time.sleep(poll_interval)
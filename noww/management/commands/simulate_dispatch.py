@@ -0,0 +1,278 @@
+import math
+import time
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+import noww.models
+import nowwapi.settings as settings
+from Common.memory_db import MemoryDatabase
+from Common.memory_fcm import MemoryPushService
+from Common.providers import providers
+from noww.Handlers import TokenHandler
+from noww.Handlers.AttemptStore import ATTEMPT_OFFERED
+from noww.Handlers.DispatchQueue import DispatchQueue
+from noww.Handlers.Metrics import metrics
+from noww.Handlers.PushSender import get_push_sender, reset_push_sender
+from noww.Handlers.ReadinessCache import (
+    get_readiness, reset_readiness_cache, database_readiness
+)
+from noww.Handlers.WorkerIndex import (
+    get_worker_index, reset_worker_index, KM_PER_DEGREE
+)
+from noww.Handlers.WorkerTaskWriter import reset_worker_task_writer
+
+SIMULATION_PHONE_PREFIX = '+999'
+
+# names of the databases the simulated rows can be written to
+SCRATCH_DATABASE_PREFIXES = ('test', 'scratch')
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return round(values[min(int(len(values) * q), len(values) - 1)], 2)
+
+
+class Command(BaseCommand):
+    help = "Offline benchmark of the dispatch: synthetic workers and tasks " \
+           "against in-memory firebase and FCM, the rows are removed at exit"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1000)
+        parser.add_argument('--tasks', type=int, default=200)
+        parser.add_argument('--burst', type=int, default=10,
+                            help="tasks created between the dispatch rounds")
+        parser.add_argument('--ready', type=float, default=.8,
+                            help="share of the ready workers")
+        parser.add_argument('--accept', type=float, default=.7,
+                            help="probability of the offer to be accepted")
+        parser.add_argument('--spread', type=float, default=10,
+                            help="km around the center for workers and tasks")
+        parser.add_argument('--center', default='50.4501,30.5234')
+        parser.add_argument('--fanout', type=int, default=None,
+                            help="DISPATCH_SETTINGS['FANOUT'] override")
+        parser.add_argument('--batch', action='store_true',
+                            help="assign the claimed jobs with run_batch")
+        parser.add_argument('--readiness', choices=('firebase', 'db'),
+                            default='firebase',
+                            help="DISPATCH_SETTINGS['READINESS_SOURCE']")
+        parser.add_argument('--push-latency', type=float, default=0,
+                            help="ms of a simulated FCM request")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--keep', action='store_true',
+                            help="keep the simulated rows")
+        parser.add_argument('--allow-live-db', action='store_true',
+                            help="run against a database that is not a "
+                                 "test or scratch one")
+
+    def handle(self, *args, **options):
+        database = connection.settings_dict['NAME'] or ''
+        if not database.startswith(SCRATCH_DATABASE_PREFIXES) and \
+                not options['allow_live_db']:
+            raise CommandError(
+                f"the simulation writes and deletes users, workers and "
+                f"tasks in '{database}', point DATABASE_URL to a database "
+                f"named {' or '.join(SCRATCH_DATABASE_PREFIXES)}* or pass "
+                f"--allow-live-db")
+        random.seed(options['seed'])
+        self.center = tuple(map(float, options['center'].split(',')))
+        self.spread = options['spread']
+
+        memory = MemoryDatabase()
+        push = MemoryPushService(options['push_latency'] / 1000)
+        overrides = {'QUEUE': 'db', 'READINESS_SOURCE': options['readiness']}
+        if options['fanout'] is not None:
+            overrides['FANOUT'] = options['fanout']
+        restore = self.install(memory, push, overrides)
+        service = noww.models.Service.objects.create(
+            name='simulation', description='dispatch simulation',
+            type='simulation')
+        try:
+            self.seed_workers(memory, options['workers'], options['ready'])
+            get_worker_index()
+            get_readiness()
+            metrics.reset()
+            result = self.replay(memory, service, options)
+        finally:
+            restore()
+            if not options['keep']:
+                self.cleanup(service)
+        result['pushes'] = len(push.sent)
+        result['push_requests'] = push.requests
+        self.report(result)
+
+    @staticmethod
+    def install(memory, push, overrides):
+        """
+        points the dispatch at the in-memory stand-ins
+        :return: callable restoring the originals
+        """
+        dispatch_settings = dict(settings.DISPATCH_SETTINGS)
+
+        providers.override('firebase', memory.reference())
+        providers.override('fcm', push)
+        settings.DISPATCH_SETTINGS.update(overrides, WORKER_INDEX=True)
+        reset_worker_index()
+        reset_readiness_cache()
+        reset_push_sender()
+        reset_worker_task_writer()
+
+        def restore():
+            reset_worker_task_writer()
+            providers.reset('firebase')
+            providers.reset('fcm')
+            settings.DISPATCH_SETTINGS.clear()
+            settings.DISPATCH_SETTINGS.update(dispatch_settings)
+            reset_worker_index()
+            reset_readiness_cache()
+            reset_push_sender()
+
+        return restore
+
+    def random_point(self):
+        """
+        uniform point in the circle of `spread` km around the center
+        """
+        distance = self.spread * math.sqrt(random.random())
+        angle = random.uniform(0, 2 * math.pi)
+        lat = self.center[0] + distance * math.cos(angle) / KM_PER_DEGREE
+        lon = self.center[1] + distance * math.sin(angle) / (
+            KM_PER_DEGREE * math.cos(math.radians(self.center[0])))
+        return round(lat, 6), round(lon, 6)
+
+    def seed_workers(self, memory, count, ready):
+        users = noww.models.User.objects.bulk_create([
+            noww.models.User(phone_number=f"{SIMULATION_PHONE_PREFIX}{i:09d}",
+                             first_name='simulation')
+            for i in range(count)
+        ])
+        noww.models.Worker.objects.bulk_create([
+            noww.models.Worker(user=user, is_verified=True,
+                               is_ready=random.random() < ready,
+                               device=f"simulation-{user.pk}")
+            for user in users
+        ])
+        workers = noww.models.Worker.objects.filter(user__in=users) \
+            .values_list('pk', 'is_ready')
+
+        now = int(time.time() * 1000)
+        for worker_id, is_ready in workers:
+            lat, lon = self.random_point()
+            memory.child('worker_locations').child(str(worker_id)).set(
+                {'g': '', 'l': [lat, lon]})
+            memory.child('worker_info').child(str(worker_id)).set(
+                {'is_ready': is_ready, 'timestamp': now})
+        return [str(worker_id) for worker_id, _ in workers]
+
+    def create_task(self, service):
+        lat, lon = self.random_point()
+        address = noww.models.Address.objects.create(
+            latitude=lat, longitude=lon, address='simulation', zip_code='',
+            city='simulation')
+        return noww.models.Task.objects.create(
+            description='simulation', service=service, task_address=address)
+
+    def replay(self, memory, service, options):
+        latencies = []
+        created = 0
+        start = time.perf_counter()
+        while created < options['tasks']:
+            for _ in range(min(options['burst'], options['tasks'] - created)):
+                self.create_task(service)
+                created += 1
+            self.dispatch_round(memory, service, options, latencies)
+        get_push_sender().flush()
+        elapsed = time.perf_counter() - start
+
+        tasks = noww.models.Task.objects.filter(service=service)
+        assigned = tasks.filter(worker__isnull=False).count()
+        latencies.sort()
+        return {
+            'tasks': created,
+            'assigned': assigned,
+            'jobs': len(latencies),
+            'elapsed': elapsed,
+            'latency': {
+                'p50': percentile(latencies, .5),
+                'p95': percentile(latencies, .95),
+                'p99': percentile(latencies, .99),
+                'max': percentile(latencies, 1),
+            },
+            'metrics': metrics.snapshot(),
+        }
+
+    @staticmethod
+    def dispatch_round(memory, service, options, latencies):
+        """
+        runs the queue until every task is accepted or out of workers,
+        the offered workers answer at once
+        """
+        batch_size = settings.DISPATCH_SETTINGS['QUEUE_BATCH_SIZE']
+        while True:
+            jobs = DispatchQueue.claim(batch_size)
+            if options['batch'] and jobs:
+                started = time.perf_counter()
+                DispatchQueue.run_batch(jobs)
+                elapsed = (time.perf_counter() - started) * 1000
+                latencies.extend([elapsed / len(jobs)] * len(jobs))
+            else:
+                for job in jobs:
+                    started = time.perf_counter()
+                    DispatchQueue.run(job)
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+            offers = list(noww.models.DispatchAttempt.objects.filter(
+                task__service=service, status=ATTEMPT_OFFERED
+            ).values_list('task_id', 'worker_id'))
+            if not jobs and not offers:
+                return
+            for task_id, worker_id in offers:
+                if random.random() >= options['accept']:
+                    TokenHandler.TaskHandler.reject(task_id, worker_id)
+                elif TokenHandler.TaskHandler.accept(task_id, worker_id):
+                    # a busy worker is not offered the next tasks
+                    memory.child('worker_info').child(str(worker_id)) \
+                        .update({'is_ready': False})
+                    database_readiness.set_ready(worker_id, False)
+
+    @staticmethod
+    def cleanup(service):
+        tasks = noww.models.Task.objects.filter(service=service)
+        addresses = list(tasks.values_list('task_address_id', flat=True))
+        tasks.delete()
+        service.delete()
+        noww.models.Address.objects.filter(pk__in=addresses).delete()
+        noww.models.User.objects.filter(
+            phone_number__startswith=SIMULATION_PHONE_PREFIX,
+            first_name='simulation').delete()
+
+    def report(self, result):
+        histograms = result['metrics']
+        elapsed = result['elapsed']
+        self.stdout.write(f"tasks: {result['tasks']}, "
+                          f"assigned: {result['assigned']}, "
+                          f"dispatch jobs: {result['jobs']}, "
+                          f"pushes: {result['pushes']} "
+                          f"in {result['push_requests']} FCM requests")
+        self.stdout.write("dispatch latency, ms: " + ", ".join(
+            f"{key} {value}" for key, value in result['latency'].items()))
+        for name in ('dispatch.candidates_scanned',
+                     'dispatch.search_radius_km',
+                     'dispatch.offers_per_assignment',
+                     'dispatch.pickup_distance_km',
+                     'dispatch.batch_size',
+                     'push.batch_latency_ms',
+                     'push.batch_size',
+                     'firebase.worker_task_batch'):
+            if name in histograms:
+                snapshot = histograms[name]
+                self.stdout.write(f"{name}: avg {snapshot['avg']}, "
+                                  f"p50 {snapshot['p50']}, "
+                                  f"p95 {snapshot['p95']}, "
+                                  f"p99 {snapshot['p99']}")
+        self.stdout.write(
+            f"throughput: {result['jobs'] / elapsed:.1f} jobs/s, "
+            f"{result['assigned'] / elapsed:.1f} assignments/s "
+            f"({elapsed:.2f} s)")
@@ -0,0 +1,33 @@
+# Generated by Django 2.1.12 on 2026-10-17 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('noww', '0004_user_avatar_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DispatchJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rejected', models.TextField(blank=True)),
+                ('status', models.CharField(default='PENDING', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dispatch_jobs', to='noww.Task')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dispatchjob',
+            index=models.Index(fields=['status', 'created_at'], name='dispatchjob_status_created_idx'),
+        ),
+    ]
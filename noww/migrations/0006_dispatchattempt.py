@@ -0,0 +1,35 @@
+# Generated by Django 2.1.12 on 2026-10-17 10:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('noww', '0005_dispatchjob'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='dispatchjob',
+            name='rejected',
+        ),
+        migrations.CreateModel(
+            name='DispatchAttempt',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt', models.IntegerField(default=1)),
+                ('status', models.CharField(default='OFFERED', max_length=20)),
+                ('offered_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('answered_at', models.DateTimeField(blank=True, null=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dispatch_attempts', to='noww.Task')),
+                ('worker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dispatch_attempts', to='noww.Worker')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='dispatchattempt',
+            unique_together={('task', 'worker')},
+        ),
+    ]
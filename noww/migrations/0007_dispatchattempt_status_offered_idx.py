@@ -0,0 +1,17 @@
+# Generated by Django 2.1.12 on 2026-10-17 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('noww', '0006_dispatchattempt'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dispatchattempt',
+            index=models.Index(fields=['status', 'offered_at'], name='attempt_status_offered_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.1.12 on 2026-10-17 13:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('noww', '0007_dispatchattempt_status_offered_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushOutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt', models.IntegerField(default=1)),
+                ('registration_id', models.CharField(blank=True, max_length=200)),
+                ('title', models.CharField(blank=True, max_length=100)),
+                ('body', models.CharField(blank=True, max_length=256)),
+                ('data', models.TextField(blank=True)),
+                ('status', models.CharField(default='PENDING', max_length=20)),
+                ('tries', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='push_messages', to='noww.Task')),
+                ('worker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='push_messages', to='noww.Worker')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='pushoutboxmessage',
+            unique_together={('task', 'worker', 'attempt')},
+        ),
+        migrations.AddIndex(
+            model_name='pushoutboxmessage',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='pushoutbox_status_next_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.1.12 on 2026-10-17 15:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('noww', '0008_pushoutboxmessage'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            # range partitioned table, the partitions by month are created
+            # by LocationHistory, rows out of them go to the default one
+            database_operations=[
+                migrations.RunSQL(
+                    sql=[
+                        """
+                        CREATE TABLE noww_workerlocation (
+                            id bigserial NOT NULL,
+                            worker_id integer NOT NULL,
+                            latitude double precision NOT NULL,
+                            longitude double precision NOT NULL,
+                            recorded_at timestamp with time zone NOT NULL,
+                            PRIMARY KEY (id, recorded_at)
+                        ) PARTITION BY RANGE (recorded_at)
+                        """,
+                        "CREATE INDEX workerlocation_worker_rec_idx "
+                        "ON noww_workerlocation (worker_id, recorded_at)",
+                        "CREATE TABLE noww_workerlocation_default "
+                        "PARTITION OF noww_workerlocation DEFAULT",
+                    ],
+                    reverse_sql=["DROP TABLE noww_workerlocation"],
+                ),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='WorkerLocation',
+                    fields=[
+                        ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                        ('latitude', models.FloatField()),
+                        ('longitude', models.FloatField()),
+                        ('recorded_at', models.DateTimeField()),
+                        ('worker', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='locations', to='noww.Worker')),
+                    ],
+                ),
+                migrations.AddIndex(
+                    model_name='workerlocation',
+                    index=models.Index(fields=['worker', 'recorded_at'], name='workerlocation_worker_rec_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.1.12 on 2026-10-17 16:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('noww', '0009_workerlocation'),
+    ]
+
+    operations = [
+        # partial index of the workers who can get an offer, Index(condition)
+        # needs Django 2.2 so it is not declared in Worker.Meta
+        migrations.RunSQL(
+            sql="CREATE INDEX worker_ready_idx ON noww_worker (id) "
+                "WHERE is_ready AND is_verified",
+            reverse_sql="DROP INDEX worker_ready_idx",
+        ),
+    ]
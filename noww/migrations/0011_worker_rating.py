@@ -0,0 +1,74 @@
+# Generated by Django 2.1.12 on 2026-10-17 17:10
+
+from django.db import migrations, models
+
+RATING_SQL = """
+UPDATE noww_worker SET
+    rating_sum = s.rating_sum,
+    rating_count = s.rating_count,
+    rating_1 = s.rating_1,
+    rating_2 = s.rating_2,
+    rating_3 = s.rating_3,
+    rating_4 = s.rating_4,
+    rating_5 = s.rating_5
+FROM (
+    SELECT cr.worker_id,
+           SUM(r.star) AS rating_sum,
+           COUNT(r.star) AS rating_count,
+           COUNT(*) FILTER (WHERE r.star = 1) AS rating_1,
+           COUNT(*) FILTER (WHERE r.star = 2) AS rating_2,
+           COUNT(*) FILTER (WHERE r.star = 3) AS rating_3,
+           COUNT(*) FILTER (WHERE r.star = 4) AS rating_4,
+           COUNT(*) FILTER (WHERE r.star = 5) AS rating_5
+    FROM noww_customerreview cr
+    JOIN noww_review r ON r.id = cr.review_id
+    GROUP BY cr.worker_id
+) s
+WHERE noww_worker.id = s.worker_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('noww', '0010_worker_ready_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='worker',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='worker',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='worker',
+            name='rating_1',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='worker',
+            name='rating_2',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='worker',
+            name='rating_3',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='worker',
+            name='rating_4',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='worker',
+            name='rating_5',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(RATING_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
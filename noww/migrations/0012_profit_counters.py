@@ -0,0 +1,57 @@
+# Generated by Django 2.1.12 on 2026-10-17 17:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# the statuses of Common.configs.TASK_STATUSES_NOT_PAID
+PROFIT_SQL = """
+INSERT INTO noww_{owner}profit ({owner}_id, currency, amount, tasks)
+SELECT {owner}_id, delivery_cost_currency, SUM(delivery_cost), COUNT(*)
+FROM noww_task
+WHERE {owner}_id IS NOT NULL AND delivery_cost IS NOT NULL
+    AND status NOT IN ('REJECTED', 'CANCELLEDBYWORKER', 'CANCELLEDBYCUSTOMER')
+GROUP BY {owner}_id, delivery_cost_currency
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('noww', '0011_worker_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerProfit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('tasks', models.IntegerField(default=0)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='profits', to='noww.Customer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WorkerProfit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('tasks', models.IntegerField(default=0)),
+                ('worker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='profits', to='noww.Worker')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='customerprofit',
+            unique_together={('customer', 'currency')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='workerprofit',
+            unique_together={('worker', 'currency')},
+        ),
+        migrations.RunSQL(
+            [PROFIT_SQL.format(owner='worker'),
+             PROFIT_SQL.format(owner='customer')],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.1.12 on 2026-10-17 18:30
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+KINDS_SQL = """
+UPDATE noww_place SET {column} = COALESCE((
+    SELECT array_agg(DISTINCT kinds.types_id ORDER BY kinds.types_id)
+    FROM noww_product_{field} kinds
+    JOIN noww_product product ON product.id = kinds.product_id
+    WHERE product.places_id = noww_place.id
+), '{{}}')
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('noww', '0012_profit_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='kind_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='sub_kind_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None),
+        ),
+        migrations.RunSQL(
+            [KINDS_SQL.format(column='kind_ids', field='kinds'),
+             KINDS_SQL.format(column='sub_kind_ids', field='sub_kinds')],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 2.1.12 on 2026-10-17 19:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def add_index_concurrently(model_name, table, name, fields, columns):
+    """
+    AddIndex without the lock blocking the writes of the table
+    """
+    return migrations.SeparateDatabaseAndState(
+        database_operations=[migrations.RunSQL(
+            sql=f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+                f"ON {table} ({columns})",
+            reverse_sql=f"DROP INDEX CONCURRENTLY IF EXISTS {name}",
+        )],
+        state_operations=[migrations.AddIndex(
+            model_name=model_name,
+            index=models.Index(fields=fields, name=name),
+        )],
+    )
+
+
+def foreign_key_indexes(schema_editor, columns):
+    with schema_editor.connection.cursor() as cursor:
+        constraints = schema_editor.connection.introspection \
+            .get_constraints(cursor, 'noww_task')
+    return [name for name, constraint in constraints.items()
+            if constraint['index'] and not constraint['unique'] and
+            not constraint['primary_key'] and constraint['columns'] in columns]
+
+
+def drop_foreign_key_indexes(apps, schema_editor):
+    for name in foreign_key_indexes(schema_editor,
+                                    (['worker_id'], ['customer_id'])):
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def create_foreign_key_indexes(apps, schema_editor):
+    for column in ('worker_id', 'customer_id'):
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS noww_task_{column} "
+            f"ON noww_task ({column})")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY does not run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('noww', '0013_place_kind_ids'),
+    ]
+
+    operations = [
+        add_index_concurrently('task', 'noww_task', 'task_status_created_idx',
+                               ['status', 'created_at'],
+                               'status, created_at'),
+        add_index_concurrently('task', 'noww_task', 'task_created_idx',
+                               ['created_at'], 'created_at'),
+        add_index_concurrently('task', 'noww_task', 'task_worker_status_idx',
+                               ['worker', 'status'], 'worker_id, status'),
+        add_index_concurrently('task', 'noww_task',
+                               'task_customer_created_idx',
+                               ['customer', 'created_at'],
+                               'customer_id, created_at'),
+        add_index_concurrently('review', 'noww_review', 'review_created_idx',
+                               ['created_at'], 'created_at'),
+        add_index_concurrently('user', 'noww_user', 'user_date_joined_idx',
+                               ['date_joined'], 'date_joined'),
+        # the composite indexes start with the foreign key columns
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(
+                drop_foreign_key_indexes, create_foreign_key_indexes)],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='task',
+                    name='worker',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='noww.Worker'),
+                ),
+                migrations.AlterField(
+                    model_name='task',
+                    name='customer',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='noww.Customer'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.1.12 on 2026-10-18 10:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('noww', '0014_task_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispatchjob',
+            name='next_run_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='dispatchjob',
+            index=models.Index(fields=['status', 'next_run_at'], name='dispatchjob_status_next_idx'),
+        ),
+    ]
@@ -1,6 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.contrib.postgres.fields import ArrayField
 from django.utils import timezone
-from django.db.models import Avg, F, Sum
 from django.core.validators import RegexValidator
 from django_countries.fields import CountryField
 from django.contrib.auth.base_user import AbstractBaseUser
@@ -11,7 +11,8 @@ from rest_framework.authtoken.models import Token
 from djmoney.models.fields import MoneyField
 
 from nowwapi.utils import GoogleBucketUrlField
-from noww.Handlers.TokenHandler import OrderRequest
+from noww.Handlers.DispatchQueue import DispatchQueue
+from noww.Handlers.PlaceKinds import PlaceKinds
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -43,6 +44,13 @@ class User(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = ('user')
         verbose_name_plural = ('users')
+        indexes = [
+            models.Index(fields=['date_joined'], name='user_date_joined_idx'),
+        ]
+
+
+RATING_FIELDS = ('rating_sum', 'rating_count', 'rating_1', 'rating_2',
+                 'rating_3', 'rating_4', 'rating_5')
 
 
 class Worker(models.Model):
@@ -52,6 +60,14 @@ class Worker(models.Model):
     device = models.CharField(('device'), max_length=200, blank=True)
     is_ready = models.BooleanField(default=False)
     status_description = models.CharField(max_length=256, blank=True)
+    # maintained by WorkerRating from the worker_reviews
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    rating_1 = models.IntegerField(default=0)
+    rating_2 = models.IntegerField(default=0)
+    rating_3 = models.IntegerField(default=0)
+    rating_4 = models.IntegerField(default=0)
+    rating_5 = models.IntegerField(default=0)
 
     __verified = None
 
@@ -64,16 +80,24 @@ class Worker(models.Model):
 
     @property
     def rate(self):
-        rate_ = self.worker_reviews.aggregate(Avg(F('review__star'))) \
-            .get("review__star__avg")
-        return rate_.__round__(2) if rate_ else None
+        if not self.rating_count or not self.rating_sum:
+            return None
+        return (self.rating_sum / self.rating_count).__round__(2)
+
+    @property
+    def rating_stars(self):
+        return {star: getattr(self, f"rating_{star}") for star in range(1, 6)}
 
     @property
     def profit(self):
-        profit_ = self.tasks.aggregate(Sum(F('delivery_cost'))). \
-            get('delivery_cost__sum')
+        profit_ = sum(counter.amount for counter in self.profits.all())
         return profit_.__round__(2) if profit_ else None
 
+    @property
+    def profit_by_currency(self):
+        return {counter.currency: counter.amount
+                for counter in self.profits.all() if counter.amount}
+
     def get_current_tasks(self):
         current_tasks = self.tasks.filter(status__in=["CREATED"])
         return current_tasks
@@ -88,6 +112,13 @@ class Worker(models.Model):
                 review_id=def_review.pk
             )
 
+        if not self._state.adding and not force_insert and \
+                kwargs.get('update_fields') is None:
+            # the rating columns are only changed by WorkerRating
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in RATING_FIELDS
+            ]
         super(Worker, self).save(force_insert, force_update, *args, **kwargs)
         self.__verified = self.is_verified
 
@@ -114,6 +145,11 @@ class Review(models.Model):
         related_name="customers_reviews"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='review_created_idx'),
+        ]
+
 
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -126,10 +162,14 @@ class Customer(models.Model):
 
     @property
     def profit(self):
-        profit_ = self.tasks.aggregate(Sum(F('delivery_cost'))). \
-            get('delivery_cost__sum')
+        profit_ = sum(counter.amount for counter in self.profits.all())
         return float(profit_).__round__(2) if profit_ else None
 
+    @property
+    def profit_by_currency(self):
+        return {counter.currency: counter.amount
+                for counter in self.profits.all() if counter.amount}
+
 
 class CustomerReview(models.Model):
     worker = models.ForeignKey(
@@ -193,20 +233,21 @@ class Place(models.Model):
     description = models.TextField(blank=True, verbose_name="description")
     addresses = models.ManyToManyField(Address)
     image_url = models.URLField(blank=True, null=True)
+    # kinds of the products of the place, kept by PlaceKinds
+    kind_ids = ArrayField(models.IntegerField(), default=list, blank=True)
+    sub_kind_ids = ArrayField(models.IntegerField(), default=list, blank=True)
 
     @property
     def kinds(self):
-        kinds_ids = self.place_to_product.values_list('kinds', flat=True) \
-            .distinct()
-        kinds = Types.objects.filter(id__in=kinds_ids)
-        return kinds
+        if not hasattr(self, '_kinds'):
+            PlaceKinds.resolve([self])
+        return self._kinds
 
     @property
     def sub_kinds(self):
-        kinds_ids = self.place_to_product.values_list('sub_kinds', flat=True) \
-            .distinct()
-        kinds = Types.objects.filter(id__in=kinds_ids)
-        return kinds
+        if not hasattr(self, '_sub_kinds'):
+            PlaceKinds.resolve([self])
+        return self._sub_kinds
 
 
 class TaskItem(models.Model):
@@ -228,9 +269,13 @@ class Task(models.Model):
     weight = models.IntegerField(null=True)
     pay_type = models.CharField(max_length=50, default='CASH')
 
-    worker = models.ForeignKey(Worker, on_delete=models.CASCADE, blank=True, null=True, related_name='tasks')
+    # indexed as the first column of task_worker_status_idx
+    worker = models.ForeignKey(Worker, on_delete=models.CASCADE, blank=True, null=True, related_name='tasks',
+                               db_index=False)
     service = models.ForeignKey(Service, on_delete=models.CASCADE)
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, blank=True, null=True, related_name='tasks')
+    # indexed as the first column of task_customer_created_idx
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, blank=True, null=True, related_name='tasks',
+                                 db_index=False)
     place = models.ForeignKey('Place', on_delete=models.CASCADE, null=True)
     task_address = models.ForeignKey(Address, on_delete=models.CASCADE, related_name='task_address', null=True)
     customer_address = models.ForeignKey(Address, on_delete=models.CASCADE, related_name='task_customer_address',
@@ -238,17 +283,143 @@ class Task(models.Model):
     items = models.ManyToManyField(Product, through=TaskItem)
     reject_code = models.CharField(max_length=50, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='task_status_created_idx'),
+            models.Index(fields=['created_at'], name='task_created_idx'),
+            models.Index(fields=['worker', 'status'], name='task_worker_status_idx'),
+            models.Index(fields=['customer', 'created_at'], name='task_customer_created_idx'),
+        ]
+
     def get_total_money(self):
         return float(self.delivery_cost.amount + self.product_cost.amount)
 
     def save(self, *args, **kwargs):
         if not self.pk:
-            super().save(*args, **kwargs)
-            OrderRequest(lat=self.task_address.latitude, lon=self.task_address.longitude, task_id=self.pk)
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                DispatchQueue.enqueue(self.pk)
         else:
             super().save(*args, **kwargs)
 
 
+class DispatchJob(models.Model):
+    """
+    queued dispatch of the task to the workers, see DispatchQueue
+    """
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='dispatch_jobs')
+    status = models.CharField(max_length=20, default='PENDING')
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    # a retried or rescheduled job is not claimed before
+    next_run_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='dispatchjob_status_created_idx'),
+            models.Index(fields=['status', 'next_run_at'], name='dispatchjob_status_next_idx'),
+        ]
+
+
+class DispatchAttempt(models.Model):
+    """
+    offer of the task to the worker and its answer, see AttemptStore
+    """
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='dispatch_attempts')
+    worker = models.ForeignKey(Worker, on_delete=models.CASCADE, related_name='dispatch_attempts')
+    attempt = models.IntegerField(default=1)
+    status = models.CharField(max_length=20, default='OFFERED')
+    offered_at = models.DateTimeField(default=timezone.now)
+    answered_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('task', 'worker')
+        indexes = [
+            models.Index(fields=['status', 'offered_at'], name='attempt_status_offered_idx'),
+        ]
+
+
+class PushOutboxMessage(models.Model):
+    """
+    push of the offer written with the offer itself, see PushOutbox
+    """
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='push_messages')
+    worker = models.ForeignKey(Worker, on_delete=models.CASCADE, related_name='push_messages')
+    attempt = models.IntegerField(default=1)
+    registration_id = models.CharField(max_length=200, blank=True)
+    title = models.CharField(max_length=100, blank=True)
+    body = models.CharField(max_length=256, blank=True)
+    data = models.TextField(blank=True)
+    status = models.CharField(max_length=20, default='PENDING')
+    tries = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('task', 'worker', 'attempt')
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='pushoutbox_status_next_idx'),
+        ]
+
+
+class WorkerProfit(models.Model):
+    """
+    delivery cost of the tasks of the worker by currency, see ProfitCounters
+    """
+    worker = models.ForeignKey(Worker, on_delete=models.CASCADE, related_name='profits')
+    currency = models.CharField(max_length=3)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tasks = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('worker', 'currency')
+
+
+class CustomerProfit(models.Model):
+    """
+    delivery cost of the tasks of the customer by currency, see ProfitCounters
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='profits')
+    currency = models.CharField(max_length=3)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tasks = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('customer', 'currency')
+
+
+class WorkerLocation(models.Model):
+    """
+    history of the worker positions. the table is partitioned by month
+    of recorded_at, see LocationHistory
+    """
+    id = models.BigAutoField(primary_key=True)
+    # not checked by the database to keep the ingest cheap
+    worker = models.ForeignKey(Worker, on_delete=models.CASCADE, related_name='locations', db_constraint=False)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    recorded_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['worker', 'recorded_at'], name='workerlocation_worker_rec_idx'),
+        ]
+
+
+class MetricsSnapshot(models.Model):
+    """
+    last dump of the metrics registry of a process, see MetricsSnapshots
+    """
+    process = models.CharField(max_length=100, unique=True)
+    data = models.TextField()
+    updated_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+
 class Dictionary(models.Model):
     name = models.CharField(max_length=50, blank=True)
     type = models.CharField(max_length=50, blank=True)
@@ -8,6 +8,9 @@ from .models import *
 from .models import (Worker, Customer, Task, Service, Place, Address, Review,
                      User as UserModel, Product, TaskItem, Types)
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db.models import Manager
+from noww.Handlers.PlaceKinds import PlaceKinds
+from noww.Handlers.WorkerRating import WorkerRating
 
 
 def get_group(name:str):
@@ -51,6 +54,59 @@ class WorkerApproveSerializer(serializers.ModelSerializer):
         fields = ('is_verified',)
 
 
+class WorkerReadySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Worker
+        fields = ('is_ready',)
+        extra_kwargs = {'is_ready': {'required': True}}
+
+
+class WorkerVerifySerializer(serializers.Serializer):
+    VERIFIED = 'verified'
+    ALREADY_VERIFIED = 'already_verified'
+    NOT_FOUND = 'not_found'
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), min_length=1,
+        max_length=1000, write_only=True
+    )
+    results = serializers.DictField(child=serializers.CharField(),
+                                    read_only=True)
+
+    @transaction.atomic
+    def create(self, validated_data):
+        """
+        the same as approve of every worker: is_verified with one update,
+        the system reviews with one insert and one update of the ratings
+        """
+        ids = list(dict.fromkeys(validated_data['ids']))
+        verified = dict(Worker.objects.select_for_update()
+                        .filter(pk__in=ids).values_list('pk', 'is_verified'))
+        to_verify = [pk for pk in ids if verified.get(pk) is False]
+
+        if to_verify:
+            Worker.objects.filter(pk__in=to_verify).update(is_verified=True)
+            def_review = Review.objects.filter(
+                star=5, description='SYSTEM ITEM').first()
+            if def_review is not None:
+                CustomerReview.objects.bulk_create([
+                    CustomerReview(worker_id=pk, review_id=def_review.pk)
+                    for pk in to_verify
+                ])
+                # bulk_create sends no signals
+                WorkerRating.add(to_verify, def_review.star)
+
+        results = {}
+        for pk in ids:
+            if pk not in verified:
+                results[pk] = self.NOT_FOUND
+            elif verified[pk]:
+                results[pk] = self.ALREADY_VERIFIED
+            else:
+                results[pk] = self.VERIFIED
+        return {'results': results}
+
+
 class AddressSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(min_value=0, required=False)
 
@@ -119,11 +175,14 @@ class WorkerSerializer(serializers.ModelSerializer):
                   "objects, then objects that are not in the list are deleted "
     )
     rate = serializers.ReadOnlyField()
+    rating_stars = serializers.ReadOnlyField()
     profit = serializers.ReadOnlyField()
+    profit_by_currency = serializers.ReadOnlyField()
 
     class Meta:
         model = WorkerModel
         fields = '__all__'
+        read_only_fields = RATING_FIELDS
         ref_name = None
 
     def create(self, validated_data):
@@ -155,6 +214,9 @@ class WorkerSerializer(serializers.ModelSerializer):
             user.save()
         instance.__dict__.update(**validated_data)
         instance.save()
+        # the system review of the verification changed the ratings in the
+        # database only
+        instance.refresh_from_db(fields=RATING_FIELDS)
 
         exist_docs = []
         for doc_data in docs_data:
@@ -181,6 +243,7 @@ class WorkerSerializer(serializers.ModelSerializer):
 class CustomerSerializer(serializers.ModelSerializer):
     user = UserSerializer(many=False)
     profit = serializers.ReadOnlyField()
+    profit_by_currency = serializers.ReadOnlyField()
     addresses = AddressSerializer(
         many=True, help_text="If you pass objects, then by default in "
                              "default_address_id there will be a created "
@@ -337,6 +400,17 @@ class StringListField(serializers.ListField):
     child = serializers.CharField()
 
 
+class PlaceKindsListSerializer(serializers.ListSerializer):
+    """
+    kinds and sub kinds of the whole page are resolved with one query
+    """
+
+    def to_representation(self, data):
+        if isinstance(data, Manager):
+            data = data.all()
+        return super().to_representation(PlaceKinds.resolve(data))
+
+
 class PlaceSerializer(serializers.ModelSerializer):
     time = serializers.ReadOnlyField(default=60)
     stars = serializers.ReadOnlyField(default=90)
@@ -375,6 +449,17 @@ class PlaceSerializer(serializers.ModelSerializer):
             'products',
             'product_ids',
         )
+        list_serializer_class = PlaceKindsListSerializer
+
+    @staticmethod
+    def set_products(instance, products):
+        # set() moves the products with a bulk update, without the signals
+        moved_from = {product.places_id for product in products}
+        instance.place_to_product.set(products)
+        PlaceKinds.refresh(moved_from | {instance.pk})
+        instance.refresh_from_db(fields=['kind_ids', 'sub_kind_ids'])
+        for _, field in PlaceKinds.columns:
+            instance.__dict__.pop(f"_{field}", None)
 
     @transaction.atomic
     def create(self, validated_data):
@@ -382,7 +467,7 @@ class PlaceSerializer(serializers.ModelSerializer):
         products = validated_data.pop('place_to_product')
         instance = Place.objects.create(**validated_data)
         instance.addresses.set(addresses)
-        instance.place_to_product.set(products)
+        self.set_products(instance, products)
         instance.save()
         return instance
 
@@ -391,7 +476,7 @@ class PlaceSerializer(serializers.ModelSerializer):
         addresses = validated_data.pop('addresses')
         instance.addresses.set(addresses)
         products = validated_data.pop('place_to_product')
-        instance.place_to_product.set(products)
+        self.set_products(instance, products)
         instance.__dict__.update(**validated_data)
         instance.save()
         return instance
@@ -701,6 +786,7 @@ class WorkerCustomerReviewSerializer(serializers.ModelSerializer):
         model = CustomerReview
         fields = ("worker", "review")
 
+    @transaction.atomic
     def create(self, validated_data):
         user = self.context['request'].user
         if hasattr(user, 'customer') and user.groups.filter(name='Customer').exists():
@@ -1,3 +1,1049 @@
-from django.test import TestCase
+import re
+import json
+import time
+import threading
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from djmoney.money import Money
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from Common.configs import TASK_STATUSES, TASK_STATUSES_PROCESS
+from Common.memory_db import MemoryDatabase
+from Common.memory_fcm import MemoryPushService
+from Common.providers import providers
+import nowwapi.settings as settings
+from noww.Handlers.AttemptStore import (
+    AttemptStore, ATTEMPT_EXPIRED, ATTEMPT_OFFERED
+)
+from noww.Handlers.DispatchQueue import (
+    DispatchQueue, JOB_DONE, JOB_FAILED, JOB_PENDING
+)
+from noww.Handlers.GeoQueryCache import GeoQueryCache
+from noww.Handlers.Metrics import MetricsRegistry, metrics
+from noww.Handlers.MetricsSnapshots import MetricsSnapshots, process_name
+from noww.Handlers.OfferScheduler import OfferScheduler
+from noww.Handlers.ProfitCounters import ProfitCounters
+from noww.Handlers.PushOutbox import (
+    PushOutbox, OUTBOX_CANCELLED, OUTBOX_FAILED, OUTBOX_PENDING, OUTBOX_SENT
+)
+from noww.Handlers.PushSender import get_push_sender, reset_push_sender
+from noww.Handlers.TokenHandler import TaskHandler
+from noww.Handlers.WorkerRating import WorkerRating
+from noww.Handlers.WorkerTaskWriter import (
+    WorkerTaskWriter, get_worker_task_writer, reset_worker_task_writer
+)
+from noww.management.commands.simulate_dispatch import (
+    Command as SimulateDispatch
+)
+from noww.models import (
+    Address, Customer, CustomerReview, DispatchAttempt, DispatchJob,
+    MetricsSnapshot, Place, Product,
+    PushOutboxMessage, Review, Service, Task, Types, User, Worker,
+    WorkerLocation, RATING_FIELDS
+)
+from noww.serializers import WorkerSerializer, WorkerVerifySerializer
+from noww.viewsets import PlaceViewSet, WorkersViewSet
+
+
+def hammer(count, target):
+    """
+    calls target(i) from count threads released at once
+    :return: list of the results by i
+    """
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(i):
+        try:
+            barrier.wait()
+            results[i] = target(i)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class GatedReference:
+    """
+    in-memory firebase reference whose updates wait for `gate` and fail
+    while `fail` is set, the updates are counted
+    """
+
+    def __init__(self, reference, state=None):
+        self.reference = reference
+        self.state = state or {'updates': 0, 'fail': False,
+                               'gate': threading.Event(),
+                               'entered': threading.Event()}
+        self.state['gate'].set()
+
+    def __getattr__(self, name):
+        return getattr(self.reference, name)
+
+    def child(self, path):
+        return GatedReference(self.reference.child(path), self.state)
+
+    def update(self, value):
+        self.state['entered'].set()
+        self.state['gate'].wait()
+        self.state['updates'] += 1
+        if self.state['fail']:
+            raise ConnectionError("firebase is down")
+        self.reference.update(value)
+
+
+class TaskTransitionTest(TransactionTestCase):
+    threads = 16
+
+    def setUp(self):
+        providers.override('firebase', MemoryDatabase().reference())
+        service = Service.objects.create(name='test', description='test',
+                                         type='test')
+        self.task = Task.objects.create(description='test', service=service)
+        self.workers = [
+            Worker.objects.create(user=User.objects.create(
+                phone_number=f"+38099{i:07d}"))
+            for i in range(self.threads)
+        ]
+
+    def tearDown(self):
+        reset_worker_task_writer()
+        providers.reset('firebase')
+
+    def test_one_worker_accepts(self):
+        results = hammer(self.threads, lambda i: TaskHandler.accept(
+            self.task.pk, self.workers[i].pk))
+
+        self.assertEqual(results.count(True), 1)
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'IN_PROGRESS')
+        self.assertEqual(self.task.worker_id,
+                         self.workers[results.index(True)].pk)
+
+    def test_one_transition_from_in_progress(self):
+        TaskHandler.accept(self.task.pk, self.workers[0].pk)
+        statuses = ['COMPLETED', 'CANCELLEDBYWORKER', 'CANCELLEDBYCUSTOMER']
+        results = hammer(self.threads, lambda i: TaskHandler.transition(
+            self.task.pk, status=statuses[i % len(statuses)]))
+
+        self.assertEqual(results.count(True), 1)
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status,
+                         statuses[results.index(True) % len(statuses)])
+
+    def test_closed_task_is_not_changed(self):
+        TaskHandler.transition(self.task.pk, status='COMPLETED')
+
+        self.assertFalse(TaskHandler.accept(self.task.pk, self.workers[0].pk))
+        self.assertFalse(TaskHandler.transition(self.task.pk,
+                                                status='IN_PROGRESS'))
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'COMPLETED')
+        self.assertIsNone(self.task.worker_id)
+
+
+class WorkerTaskWriterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.memory = MemoryDatabase()
+        self.firebase = GatedReference(self.memory.reference())
+        providers.override('firebase', self.firebase)
+        self.writer = WorkerTaskWriter(max_size=100, flush_interval=10)
+
+    def tearDown(self):
+        self.firebase.state.update(fail=False)
+        self.firebase.state['gate'].set()
+        self.writer.flush()
+        providers.reset('firebase')
+
+    def node(self, worker_id):
+        return self.memory.child('worker_task').child(str(worker_id)).get()
+
+    def test_writes_are_coalesced(self):
+        self.writer.set(1, {'id': 10})
+        self.writer.set(1, {'id': 11})
+        self.writer.set(2, {'id': 12})
+
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(self.firebase.state['updates'], 1)
+        self.assertEqual((self.node(1), self.node(2)),
+                         ({'id': 11}, {'id': 12}))
+
+    def test_full_buffer_is_flushed(self):
+        writer = WorkerTaskWriter(max_size=3, flush_interval=10)
+        for worker_id in range(3):
+            writer.set(worker_id, {'id': worker_id})
+
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(self.firebase.state['updates'], 1)
+
+    def test_buffered_write_is_cleared_locally(self):
+        self.writer.set(1, {'id': 10})
+        self.writer.clear(1, 10)
+        self.writer.flush()
+        self.assertIsNone(self.node(1))
+
+    def test_clear_waits_for_the_flush_in_flight(self):
+        self.writer.set(1, {'id': 10})
+        self.firebase.state['gate'].clear()
+        flush = threading.Thread(target=self.writer.flush)
+        flush.start()
+        self.firebase.state['entered'].wait()
+        clear = threading.Thread(target=self.writer.clear, args=(1, 10))
+        clear.start()
+        self.firebase.state['gate'].set()
+        flush.join()
+        clear.join()
+
+        self.assertIsNone(self.node(1))
+
+    def test_failed_flush_keeps_the_writes(self):
+        self.writer.set(1, {'id': 10})
+        self.writer.set(2, {'id': 12})
+        self.firebase.state['fail'] = True
+        self.assertEqual(self.writer.flush(), 0)
+        # newer than the failed one
+        self.writer.set(1, {'id': 11})
+        # given back by the failed flush, resolved locally
+        self.writer.clear(2, 12)
+
+        self.firebase.state['fail'] = False
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual((self.node(1), self.node(2)), ({'id': 11}, None))
+
+
+class GeoQueryCacheTest(SimpleTestCase):
+    threads = 8
+
+    def setUp(self):
+        metrics.reset()
+        self.cache = GeoQueryCache(ttl=60, precision=6)
+        self.calls = []
+
+    def query(self, lat, lon, radius):
+        self.calls.append((lat, lon, radius))
+        # long enough for the other threads to join the flight
+        time.sleep(.2)
+        return {'1': {'l': [lat, lon]}}
+
+    def test_concurrent_misses_share_one_query(self):
+        results = hammer(self.threads, lambda i: self.cache.get(
+            48.8566 + i * 1e-5, 2.3522, 5, self.query))
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(self.cache.stats(), {
+            'size': 1, 'hits': self.threads - 1, 'misses': 1,
+            'hit_rate': round((self.threads - 1) / self.threads, 3)})
+
+    def test_cell_and_radius_are_the_key(self):
+        self.cache.get(48.8566, 2.3522, 5, self.query)
+        self.cache.get(48.85661, 2.35221, 5, self.query)
+        self.assertEqual(len(self.calls), 1)
+        self.cache.get(48.8566, 2.3522, 10, self.query)
+        self.cache.get(45.764, 4.8357, 5, self.query)
+        self.assertEqual(len(self.calls), 3)
+        # the query reaches every point of the cell
+        self.assertGreater(self.calls[0][2], 5)
+
+    def test_failed_query_is_shared_and_not_cached(self):
+        def fail(lat, lon, radius):
+            self.calls.append((lat, lon, radius))
+            time.sleep(.2)
+            raise ConnectionError("firebase is down")
+
+        def get(i):
+            try:
+                return self.cache.get(48.8566, 2.3522, 5, fail)
+            except ConnectionError as e:
+                return e
+
+        errors = hammer(self.threads, get)
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(all(isinstance(e, ConnectionError) for e in errors))
+        self.assertEqual(len(self.cache), 0)
+        self.cache.get(48.8566, 2.3522, 5, self.query)
+        self.assertEqual(len(self.calls), 2)
+
+
+class MetricsSnapshotsTest(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+
+    def registry(self, *values):
+        registry = MetricsRegistry(log_traces=False)
+        for value in values:
+            registry.observe('dispatch.total_ms', value)
+            registry.increment('geo_cache.miss')
+        registry.gauge('geo_cache.size', len(values))
+        return registry
+
+    def snapshot(self, process, registry, age=0):
+        MetricsSnapshot.objects.create(
+            process=process, data=json.dumps(registry.dump()),
+            updated_at=timezone.now() - timedelta(seconds=age))
+
+    def test_merge(self):
+        merged = self.registry(1, 30)
+        merged.merge(self.registry(3000).dump())
+
+        snapshot = merged.snapshot()['dispatch.total_ms']
+        self.assertEqual((snapshot['count'], snapshot['sum'],
+                          snapshot['max'], snapshot['p99']),
+                         (3, 3031, 3000, 5000))
+        self.assertEqual(merged.counters(), {'geo_cache.miss': 3})
+        self.assertEqual(merged.gauges(), {'geo_cache.size': 3})
+
+    def test_collect_merges_the_fresh_processes(self):
+        max_age = settings.METRICS_SETTINGS['SNAPSHOT_MAX_AGE']
+        self.snapshot('dispatch:1', self.registry(10, 20))
+        self.snapshot('dispatch:2', self.registry(5000), age=max_age + 1)
+        # the live registry counts, not the row of this process
+        self.snapshot(process_name(), self.registry(1, 2, 3))
+        metrics.observe('dispatch.total_ms', 40)
+        metrics.increment('geo_cache.hit')
+
+        registry = MetricsSnapshots.collect()
+        self.assertEqual(registry.snapshot()['dispatch.total_ms']['count'], 3)
+        self.assertEqual(GeoQueryCache.stats(registry), {
+            'size': 2, 'hits': 1, 'misses': 2, 'hit_rate': .333})
+
+    def test_publish(self):
+        max_age = settings.METRICS_SETTINGS['SNAPSHOT_MAX_AGE']
+        self.snapshot('dispatch:2', self.registry(1), age=max_age + 1)
+        metrics.increment('locations.dropped', 2)
+        MetricsSnapshots.publish()
+        metrics.increment('locations.dropped')
+        MetricsSnapshots.publish()
+
+        rows = list(MetricsSnapshot.objects.values_list('process', 'data'))
+        self.assertEqual([process for process, _ in rows], [process_name()])
+        self.assertEqual(json.loads(rows[0][1])['counters'],
+                         {'locations.dropped': 3})
+
+
+class OfferSchedulerTest(TransactionTestCase):
+    timeout = 30
+
+    def setUp(self):
+        providers.override('firebase', MemoryDatabase().reference())
+        service = Service.objects.create(name='test', description='test',
+                                         type='test')
+        self.task = Task.objects.create(description='test', service=service)
+        self.workers = [
+            Worker.objects.create(user=User.objects.create(
+                phone_number=f"+38092{i:07d}"))
+            for i in range(2)
+        ]
+
+    def tearDown(self):
+        reset_worker_task_writer()
+        providers.reset('firebase')
+
+    def offer(self, worker, seconds_ago=0):
+        offer = AttemptStore.offer(self.task.pk, worker.pk)
+        if seconds_ago:
+            DispatchAttempt.objects.filter(pk=offer.pk).update(
+                offered_at=timezone.now() - timedelta(seconds=seconds_ago))
+        return offer
+
+    def jobs(self):
+        return DispatchJob.objects.filter(task=self.task).count()
+
+    def due(self):
+        return time.time() + self.timeout + 1
+
+    def test_restart_picks_up_outstanding_offers(self):
+        offer = self.offer(self.workers[0], seconds_ago=60)
+        jobs = self.jobs()
+        scheduler = OfferScheduler(self.timeout)
+
+        self.assertEqual(scheduler.reload(), 1)
+        self.assertEqual(scheduler.expire_due(), 1)
+        offer.refresh_from_db()
+        self.assertEqual(offer.status, ATTEMPT_EXPIRED)
+        self.assertEqual(self.jobs(), jobs + 1)
+
+    def test_reload_overlap_catches_late_commits(self):
+        scheduler = OfferScheduler(self.timeout)
+        scheduler.reload()
+        # committed after the reload with the time of its start
+        late = OfferScheduler.reload_overlap - 2
+        self.offer(self.workers[0], seconds_ago=late)
+
+        self.assertEqual(scheduler.reload(), 1)
+        self.assertEqual(scheduler.reload(), 0)
+        self.assertEqual(len(scheduler), 1)
+
+    def test_pending_offer_keeps_the_task(self):
+        self.offer(self.workers[0])
+        self.offer(self.workers[1], seconds_ago=60)
+        jobs = self.jobs()
+        scheduler = OfferScheduler(self.timeout)
+        scheduler.reload()
+
+        self.assertEqual(scheduler.expire_due(), 1)
+        self.assertEqual(self.jobs(), jobs)
+
+    def test_concurrent_schedulers_expire_once(self):
+        self.offer(self.workers[0])
+        jobs = self.jobs()
+        schedulers = [OfferScheduler(self.timeout) for _ in range(4)]
+        for scheduler in schedulers:
+            scheduler.reload()
+        due = self.due()
+
+        expired = hammer(len(schedulers),
+                         lambda i: schedulers[i].expire_due(due))
+
+        self.assertEqual(sum(expired), 1)
+        self.assertEqual(self.jobs(), jobs + 1)
+
+    def test_expiry_racing_accept(self):
+        self.offer(self.workers[0])
+        scheduler = OfferScheduler(self.timeout)
+        scheduler.reload()
+        due = self.due()
+
+        results = hammer(2, lambda i: scheduler.expire_due(due) if i == 0
+                         else TaskHandler.accept(self.task.pk,
+                                                 self.workers[0].pk))
+
+        self.assertTrue(results[1])
+        self.task.refresh_from_db()
+        self.assertEqual((self.task.status, self.task.worker_id),
+                         ('IN_PROGRESS', self.workers[0].pk))
+        # a re-dispatch queued by the expiry does not offer the task again
+        for job in DispatchQueue.claim():
+            self.assertEqual(DispatchQueue.run(job).status, JOB_DONE)
+        self.assertFalse(DispatchAttempt.objects.filter(
+            task=self.task, status=ATTEMPT_OFFERED).exists())
+
+
+class DispatchRunTest(TransactionTestCase):
+    """
+    DispatchQueue.run of a new task against the in-memory firebase and FCM
+    """
+
+    def setUp(self):
+        self.memory = MemoryDatabase()
+        self.push = MemoryPushService()
+        self.restore = SimulateDispatch.install(
+            self.memory, self.push,
+            {'QUEUE': 'db', 'READINESS_SOURCE': 'firebase', 'FANOUT': 1})
+        service = Service.objects.create(name='test', description='test',
+                                         type='test')
+        self.workers = [
+            Worker.objects.create(
+                user=User.objects.create(phone_number=f"+38096{i:07d}"),
+                is_verified=True, device=f"device-{i}")
+            for i in range(3)
+        ]
+        now = int(timezone.now().timestamp() * 1000)
+        for i, worker in enumerate(self.workers):
+            self.memory.child('worker_locations').child(str(worker.pk)).set(
+                {'g': '', 'l': [50.45 + i * .001, 30.52]})
+            self.set_ready(worker, True, now)
+        address = Address.objects.create(
+            latitude=50.45, longitude=30.52, address='test', zip_code='',
+            city='test')
+        self.task = Task.objects.create(description='test', service=service,
+                                        task_address=address)
+
+    def tearDown(self):
+        self.restore()
+
+    def set_ready(self, worker, is_ready, timestamp=None):
+        timestamp = timestamp or int(timezone.now().timestamp() * 1000)
+        self.memory.child('worker_info').child(str(worker.pk)).set(
+            {'is_ready': is_ready, 'timestamp': timestamp})
+
+    def run_jobs(self):
+        return [DispatchQueue.run(job) for job in DispatchQueue.claim()]
+
+    def test_nearest_worker_is_offered(self):
+        job, = self.run_jobs()
+
+        self.assertEqual(job.status, JOB_DONE, job.error)
+        self.assertEqual(AttemptStore.offered_workers(self.task.pk),
+                         {str(self.workers[0].pk)})
+        get_push_sender().flush()
+        self.assertEqual([push['registration_id'] for push in self.push.sent],
+                         ['device-0'])
+
+    def test_rejected_task_goes_to_next_worker(self):
+        self.run_jobs()
+        TaskHandler.reject(self.task.pk, self.workers[0].pk)
+        job, = self.run_jobs()
+
+        self.assertEqual(job.status, JOB_DONE, job.error)
+        self.assertEqual(AttemptStore.offered_workers(self.task.pk),
+                         {str(self.workers[0].pk), str(self.workers[1].pk)})
+
+    def answer(self, worker, answer):
+        return TaskHandler.post(SimpleNamespace(data={
+            'worker_id': worker.pk, 'token': f"{self.task.pk}_{answer}"}))
+
+    def worker_task(self, worker):
+        get_worker_task_writer().flush()
+        return self.memory.child('worker_task').child(str(worker.pk)).get()
+
+    def test_fan_out_losers_are_withdrawn(self):
+        settings.DISPATCH_SETTINGS['FANOUT'] = 2
+        job, = self.run_jobs()
+        self.assertEqual(job.status, JOB_DONE, job.error)
+        self.assertEqual(self.worker_task(self.workers[1])['id'],
+                         self.task.pk)
+
+        self.assertEqual(self.answer(self.workers[0], 'ACCEPTED').status_code,
+                         200)
+        self.assertIsNone(self.worker_task(self.workers[1]))
+        self.assertEqual(self.worker_task(self.workers[0])['id'],
+                         self.task.pk)
+
+    def test_late_reject_does_not_dispatch_again(self):
+        settings.DISPATCH_SETTINGS['FANOUT'] = 2
+        self.run_jobs()
+        self.answer(self.workers[0], 'ACCEPTED')
+
+        self.assertEqual(self.answer(self.workers[1], 'REJECTED').status_code,
+                         200)
+        self.assertEqual(self.run_jobs(), [])
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.worker_id, self.workers[0].pk)
+
+    def make_due(self):
+        DispatchJob.objects.filter(status=JOB_PENDING) \
+            .update(next_run_at=timezone.now())
+
+    def test_job_waits_for_a_ready_worker(self):
+        for worker in self.workers:
+            self.set_ready(worker, False)
+        job, = self.run_jobs()
+
+        self.assertEqual(job.status, JOB_PENDING)
+        self.assertIn('no ready worker', job.error)
+        self.assertGreater(job.next_run_at, timezone.now())
+        self.assertEqual(self.run_jobs(), [])
+
+        # the waits are not counted as attempts
+        for _ in range(settings.DISPATCH_SETTINGS['QUEUE_MAX_ATTEMPTS'] + 2):
+            self.make_due()
+            job, = self.run_jobs()
+            self.assertEqual((job.status, job.attempts), (JOB_PENDING, 0))
+        self.assertEqual(AttemptStore.offered_workers(self.task.pk), set())
+
+        self.set_ready(self.workers[2], True)
+        self.make_due()
+        job, = self.run_jobs()
+        self.assertEqual(job.status, JOB_DONE, job.error)
+        self.assertEqual(AttemptStore.offered_workers(self.task.pk),
+                         {str(self.workers[2].pk)})
+
+    def test_failed_job_is_retried_with_backoff(self):
+        # no address to dispatch from
+        Task.objects.filter(pk=self.task.pk).update(task_address=None)
+        statuses = []
+        for _ in range(settings.DISPATCH_SETTINGS['QUEUE_MAX_ATTEMPTS']):
+            job, = self.run_jobs()
+            statuses.append(job.status)
+            if job.status == JOB_PENDING:
+                self.assertGreater(job.next_run_at, timezone.now())
+                self.assertEqual(self.run_jobs(), [])
+                self.make_due()
+
+        self.assertEqual(statuses, [JOB_PENDING] * (len(statuses) - 1) +
+                         [JOB_FAILED])
+
+
+class PushOutboxTest(TestCase):
+
+    def setUp(self):
+        self.push = MemoryPushService()
+        providers.override('fcm', self.push)
+        reset_push_sender()
+        service = Service.objects.create(name='test', description='test',
+                                         type='test')
+        self.task = Task.objects.create(description='test', service=service)
+        self.worker = Worker.objects.create(
+            user=User.objects.create(phone_number="+380930000001"),
+            device='device')
+
+    def tearDown(self):
+        reset_push_sender()
+        providers.reset('fcm')
+
+    def add(self):
+        offer = AttemptStore.offer(self.task.pk, self.worker.pk)
+        return PushOutbox.add(self.task.pk, self.worker.pk, offer.attempt,
+                              'device', 'title', 'body', {'task': 1})
+
+    def message(self):
+        return PushOutboxMessage.objects.get()
+
+    def make_due(self):
+        PushOutboxMessage.objects.update(next_attempt_at=timezone.now())
+
+    def test_repeated_offer_is_one_message(self):
+        self.assertEqual(self.add().pk, self.add().pk)
+        self.assertEqual(PushOutboxMessage.objects.count(), 1)
+
+    def test_failed_push_backs_off(self):
+        message = self.add()
+        push_settings = settings.PUSH_NOTIFICATIONS_SETTINGS
+        delays = []
+        for tries in range(1, push_settings['OUTBOX_MAX_TRIES']):
+            started = timezone.now()
+            PushOutbox.mark(message.pk, 'Unavailable')
+            message = self.message()
+            self.assertEqual((message.status, message.tries),
+                             (OUTBOX_PENDING, tries))
+            delays.append(round(
+                (message.next_attempt_at - started).total_seconds()))
+        self.assertEqual(delays, [PushOutbox.backoff(tries) for tries in
+                                  range(1, len(delays) + 1)])
+
+        PushOutbox.mark(message.pk, 'Unavailable')
+        self.assertEqual(self.message().status, OUTBOX_FAILED)
+
+    def test_permanent_error_is_not_retried(self):
+        PushOutbox.mark(self.add().pk, 'NotRegistered')
+        self.assertEqual(self.message().status, OUTBOX_FAILED)
+
+    def test_open_offer_is_drained(self):
+        self.add()
+        self.make_due()
+        self.assertEqual(PushOutbox.drain(), 1)
+        get_push_sender().flush()
+        self.assertEqual(len(self.push.sent), 1)
+        self.assertEqual(self.message().status, OUTBOX_SENT)
+
+    def test_withdrawn_offer_is_cancelled(self):
+        self.add()
+        AttemptStore.withdraw_pending(self.task.pk)
+        self.make_due()
+        self.assertEqual(PushOutbox.drain(), 0)
+        self.assertEqual(self.push.sent, [])
+        self.assertEqual(self.message().status, OUTBOX_CANCELLED)
+
+
+class SimulateDispatchTest(TransactionTestCase):
+
+    def simulate(self, *args):
+        out = StringIO()
+        call_command('simulate_dispatch', '--workers=30', '--tasks=10',
+                     '--ready=1', '--accept=1', '--seed=1', *args,
+                     stdout=out)
+        return int(re.search(r"assigned: (\d+)", out.getvalue()).group(1))
+
+    def test_every_task_is_assigned(self):
+        self.assertEqual(self.simulate(), 10)
+
+    def test_every_task_is_assigned_in_batches(self):
+        self.assertEqual(self.simulate('--batch'), 10)
+
+
+class WorkerRatingTest(TestCase):
+    """
+    the rating columns kept by the signals match WorkerRating.rebuild
+    """
+
+    def setUp(self):
+        self.worker = Worker.objects.create(
+            user=User.objects.create(phone_number="+380950000001"))
+
+    def review(self, star):
+        return CustomerReview.objects.create(
+            worker=self.worker, review=Review.objects.create(star=star))
+
+    def assertRebuilt(self, **expected):
+        stored = Worker.objects.filter(pk=self.worker.pk) \
+            .values(*RATING_FIELDS).get()
+        WorkerRating.rebuild([self.worker.pk])
+        rebuilt = Worker.objects.filter(pk=self.worker.pk) \
+            .values(*RATING_FIELDS).get()
+        self.assertEqual(stored, rebuilt)
+        for field, value in expected.items():
+            self.assertEqual(stored[field], value, field)
+
+    def test_review_added(self):
+        self.review(5)
+        self.review(3)
+        self.assertRebuilt(rating_sum=8, rating_count=2, rating_5=1,
+                           rating_3=1)
+
+    def test_review_changed(self):
+        customer_review = self.review(5)
+        customer_review.review = Review.objects.create(star=2)
+        customer_review.save()
+        self.assertRebuilt(rating_sum=2, rating_count=1, rating_5=0,
+                           rating_2=1)
+
+    def test_review_deleted(self):
+        self.review(5)
+        self.review(4).delete()
+        self.assertRebuilt(rating_sum=5, rating_count=1, rating_4=0)
+
+    def test_review_row_deleted(self):
+        self.review(5)
+        self.review(1).review.delete()
+        self.assertRebuilt(rating_sum=5, rating_count=1, rating_1=0)
+
+    def test_star_changed(self):
+        review = self.review(5).review
+        review.star = 1
+        review.save()
+        self.assertRebuilt(rating_sum=1, rating_count=1, rating_5=0,
+                           rating_1=1)
+
+    def test_worker_save_keeps_rating(self):
+        stale = Worker.objects.get(pk=self.worker.pk)
+        self.review(4)
+        stale.status_description = 'busy'
+        stale.save()
+        self.assertRebuilt(rating_sum=4, rating_count=1)
+
+    def test_new_worker_with_pk_is_inserted(self):
+        pk = Worker.objects.order_by('-pk')[0].pk + 1
+        Worker(pk=pk, user=User.objects.create(
+            phone_number="+380950000002")).save()
+        self.assertTrue(Worker.objects.filter(pk=pk).exists())
+
+    def test_verification_serializes_the_new_rating(self):
+        Review.objects.create(star=5, description='SYSTEM ITEM')
+        serializer = WorkerSerializer(self.worker, data={'is_verified': True},
+                                      partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        self.assertEqual((serializer.data['rate'],
+                          serializer.data['rating_stars'][5]), (5, 1))
+        self.assertRebuilt(rating_sum=5, rating_count=1)
+
+
+class WorkerVerifyTest(TestCase):
+    """
+    the bulk verification does what approve does for every worker
+    """
+
+    def setUp(self):
+        Review.objects.create(star=5, description='SYSTEM ITEM')
+        self.workers = [
+            Worker.objects.create(user=User.objects.create(
+                phone_number=f"+38097{i:07d}"), is_verified=i == 2)
+            for i in range(3)
+        ]
+
+    def verify(self, ids):
+        serializer = WorkerVerifySerializer(data={'ids': ids})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        return serializer.data['results']
+
+    def test_results(self):
+        first, _, verified = self.workers
+        missing = Worker.objects.order_by('-pk')[0].pk + 1
+        results = self.verify([first.pk, verified.pk, missing, first.pk])
+
+        self.assertEqual(results, {
+            str(first.pk): WorkerVerifySerializer.VERIFIED,
+            str(verified.pk): WorkerVerifySerializer.ALREADY_VERIFIED,
+            str(missing): WorkerVerifySerializer.NOT_FOUND,
+        })
+        self.assertEqual(
+            list(Worker.objects.filter(is_verified=True)
+                 .order_by('pk').values_list('pk', flat=True)),
+            [first.pk, verified.pk])
+
+    def test_same_as_approve(self):
+        first, second, _ = self.workers
+        self.verify([first.pk])
+        second.is_verified = True
+        second.save()
+
+        for worker in (first, second):
+            self.assertEqual(list(
+                CustomerReview.objects.filter(worker=worker)
+                .values_list('review__description', 'review__star')),
+                [('SYSTEM ITEM', 5)])
+        ratings = list(Worker.objects.filter(pk__in=[first.pk, second.pk])
+                       .values(*RATING_FIELDS))
+        self.assertEqual(ratings[0], ratings[1])
+        self.assertEqual((ratings[0]['rating_sum'], ratings[0]['rating_5']),
+                         (5, 1))
+
+    def test_verified_again(self):
+        first = self.workers[0]
+        self.verify([first.pk])
+        self.assertEqual(self.verify([first.pk]), {
+            str(first.pk): WorkerVerifySerializer.ALREADY_VERIFIED})
+        self.assertEqual(
+            CustomerReview.objects.filter(worker=first).count(), 1)
+
+    def test_invalid_ids(self):
+        for ids in ([], [0], ['a']):
+            self.assertFalse(WorkerVerifySerializer(data={'ids': ids})
+                             .is_valid(), ids)
+
+
+class WorkerLocationsTest(TransactionTestCase):
+
+    def setUp(self):
+        user = User.objects.create(phone_number="+380980000001")
+        user.groups.add(Group.objects.get_or_create(name='Worker')[0])
+        self.worker = Worker.objects.create(user=user)
+
+    def post(self, points):
+        request = APIRequestFactory().post(
+            '/api/workers/locations/', {'points': points}, format='json')
+        force_authenticate(request, user=self.worker.user)
+        return WorkersViewSet.as_view({'post': 'locations'})(request)
+
+    def test_points_out_of_the_window_are_dropped(self):
+        now = time.time() * 1000
+        max_age = settings.DISPATCH_SETTINGS['LOCATION_MAX_AGE'] * 1000
+        skew = settings.DISPATCH_SETTINGS['LOCATION_MAX_SKEW'] * 1000
+        response = self.post([
+            [50.45, 30.52, now - max_age - 60000],
+            [50.45, 30.53, now - 1000],
+            [50.46, 30.53, now],
+            [50.46, 30.54, now + skew + 60000],
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['accepted'],
+                          response.data['dropped']), (2, 2))
+        self.assertEqual(sorted(WorkerLocation.objects.filter(
+            worker=self.worker).values_list('longitude', flat=True)),
+            [30.53, 30.53])
+
+    def test_batch_out_of_the_window(self):
+        response = self.post([[50.45, 30.52, 1000], [50.45, 30.52, 2000]])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['accepted'],
+                          response.data['dropped']), (0, 2))
+        self.assertFalse(WorkerLocation.objects.exists())
+
+    def test_invalid_points(self):
+        for points in (None, [], [[50.45, 30.52]], [[91, 30.52, 0]]):
+            self.assertEqual(self.post(points).status_code, 400, points)
+
+
+class ProfitCountersTest(TestCase):
+    """
+    the profit counters kept by the deltas match ProfitCounters.derive
+    """
+
+    def setUp(self):
+        self.service = Service.objects.create(name='test', description='test',
+                                              type='test')
+        self.worker = Worker.objects.create(
+            user=User.objects.create(phone_number="+380940000001"))
+        self.customer = Customer.objects.create(
+            user=User.objects.create(phone_number="+380940000002"))
+
+    def task(self, amount=10, currency='UAH', **fields):
+        return Task.objects.create(
+            description='test', service=self.service, customer=self.customer,
+            delivery_cost=Money(amount, currency), **fields)
+
+    def assertDerived(self, amount, tasks=None):
+        self.assertEqual(ProfitCounters.check(), [])
+        counters = self.customer.profits.filter(currency='UAH')
+        self.assertEqual(counters.get().amount if counters else 0, amount)
+        if tasks is not None:
+            self.assertEqual(counters.get().tasks, tasks)
+
+    def test_created(self):
+        self.task(10)
+        self.task(5)
+        self.task(7, 'USD')
+        self.assertDerived(15, 2)
+
+    def test_accepted_and_completed(self):
+        task = self.task(10)
+        self.assertTrue(TaskHandler.accept(task.pk, self.worker.pk))
+        self.assertTrue(TaskHandler.transition(task.pk, status='COMPLETED'))
+        self.assertDerived(10, 1)
+        self.assertEqual(self.worker.profits.get().amount, 10)
+
+    def test_cancelled_and_rejected_are_left_out(self):
+        cancelled = self.task(10)
+        rejected = self.task(5)
+        self.task(3)
+        TaskHandler.accept(cancelled.pk, self.worker.pk)
+        TaskHandler.transition(cancelled.pk, status='CANCELLEDBYCUSTOMER')
+        TaskHandler.transition(rejected.pk, status='REJECTED',
+                               reject_code='test')
+        self.assertDerived(3, 1)
+        self.assertEqual(self.worker.profits.get().tasks, 0)
+
+    def test_cost_changed(self):
+        task = self.task(10)
+        task.delivery_cost = Money(12, 'UAH')
+        task.save()
+        self.assertDerived(12, 1)
+
+    def test_deleted(self):
+        self.task(10)
+        self.task(5).delete()
+        self.assertDerived(10, 1)
+
+
+class PlaceKindsTest(TestCase):
+
+    def setUp(self):
+        self.place = Place.objects.create(title='test')
+        self.kind = Types.objects.create(name='kind')
+        self.product = Product.objects.create(
+            title='test', price=Money(1, 'UAH'), places=self.place)
+        self.product.kinds.add(self.kind)
+
+    def kind_ids(self):
+        self.place.refresh_from_db()
+        return self.place.kind_ids
+
+    def test_product_kinds_changed(self):
+        self.assertEqual(self.kind_ids(), [self.kind.pk])
+        self.product.kinds.clear()
+        self.assertEqual(self.kind_ids(), [])
+
+    def test_type_products_cleared(self):
+        self.kind.products_kinds.clear()
+        self.assertEqual(self.kind_ids(), [])
+
+    def test_type_products_removed(self):
+        self.kind.products_kinds.remove(self.product)
+        self.assertEqual(self.kind_ids(), [])
+
+    def test_only_the_detail_prefetches_the_kinds(self):
+        lookups = {}
+        for action in ('list', 'retrieve'):
+            view = PlaceViewSet(action=action)
+            lookups[action] = view.get_queryset()._prefetch_related_lookups
+        self.assertEqual(lookups['list'], ('addresses',))
+        self.assertIn('place_to_product__kinds__parent', lookups['retrieve'])
+
+
+class QueryPlanTest(TestCase):
+    """
+    the hot Task, Review and User filters are served by their index: the
+    plans are taken with sequential scans disabled, a filter without an
+    index still gets a Seq Scan
+    """
+    tasks = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        service = Service.objects.create(name='test', description='test',
+                                         type='test')
+        cls.workers = [
+            Worker.objects.create(user=User.objects.create(
+                phone_number=f"+38098{i:07d}"))
+            for i in range(10)
+        ]
+        cls.customers = [
+            Customer.objects.create(user=User.objects.create(
+                phone_number=f"+38097{i:07d}"))
+            for i in range(10)
+        ]
+        # bulk_create does not enqueue the dispatch of the tasks
+        Task.objects.bulk_create(
+            Task(description='test', service=service,
+                 status=TASK_STATUSES[i % len(TASK_STATUSES)],
+                 worker=cls.workers[i % len(cls.workers)],
+                 customer=cls.customers[i % len(cls.customers)])
+            for i in range(cls.tasks)
+        )
+        now = timezone.now()
+        Review.objects.bulk_create(
+            Review(star=i % 5 + 1, created_at=now - timedelta(hours=i))
+            for i in range(cls.tasks)
+        )
+        with connection.cursor() as cursor:
+            # created_at is auto_now_add
+            cursor.execute("UPDATE noww_task SET created_at = "
+                           "now() - id * interval '1 hour'")
+            cursor.execute("ANALYZE noww_task")
+            cursor.execute("ANALYZE noww_review")
+            cursor.execute("ANALYZE noww_user")
+
+    def plan(self, queryset):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        try:
+            return queryset.explain()
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = on")
+
+    def assertIndexed(self, queryset, table, *indexes):
+        """
+        :param indexes: names of the indexes expected in the plan, any of
+        """
+        plan = self.plan(queryset)
+        self.assertNotIn(f"Seq Scan on {table}", plan, plan)
+        self.assertTrue(any(index in plan for index in indexes), plan)
+
+    def test_task_filters(self):
+        date_to = timezone.now()
+        date_from = date_to - timedelta(days=7)
+        worker = self.workers[0]
+        customer = self.customers[0]
+        status_created = 'task_status_created_idx'
+        queries = {
+            'status': (Task.objects.filter(status='COMPLETED'),
+                       [status_created]),
+            'process': (Task.objects.filter(
+                status__in=TASK_STATUSES_PROCESS), [status_created]),
+            # a scan per status or one of the date range, by the estimates
+            'process_range': (Task.objects.filter(
+                status__in=TASK_STATUSES_PROCESS,
+                created_at__range=(date_from, date_to)),
+                [status_created, 'task_created_idx']),
+            'range': (Task.objects.filter(
+                created_at__range=(date_from, date_to)),
+                ['task_created_idx']),
+            'status_range': (Task.objects.filter(
+                status='COMPLETED', created_at__range=(date_from, date_to)),
+                [status_created]),
+            'worker_current': (worker.get_current_tasks(),
+                               ['task_worker_status_idx']),
+            'worker_status': (worker.tasks.filter(status='IN_PROGRESS'),
+                              ['task_worker_status_idx']),
+            'worker_tasks': (worker.tasks.all(), ['task_worker_status_idx']),
+            'customer_range': (customer.tasks.filter(
+                created_at__range=(date_from, date_to)),
+                ['task_customer_created_idx']),
+            'customer_tasks': (customer.tasks.all(),
+                               ['task_customer_created_idx']),
+        }
+        for name, (queryset, indexes) in queries.items():
+            with self.subTest(name):
+                self.assertIndexed(queryset, 'noww_task', *indexes)
+
+    def test_review_created_at(self):
+        date_from = timezone.now() - timedelta(days=7)
+        self.assertIndexed(Review.objects.filter(created_at__gte=date_from),
+                           'noww_review', 'review_created_idx')
+
+    def test_user_date_joined(self):
+        date_to = timezone.now()
+        date_from = date_to - timedelta(days=30)
+        self.assertIndexed(
+            User.objects.filter(date_joined__range=(date_from, date_to)),
+            'noww_user', 'user_date_joined_idx')
@@ -8,6 +8,12 @@ from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from .models import User, Customer, Worker
 from .serializers import GroupSerializer, UserGroupAccessSerializer
+from .access import DispatchAccessPolicy, DictionaryAccessPolicy, \
+    MetricsAccessPolicy
+from noww.Handlers.DispatchQueue import DispatchQueue
+from noww.Handlers.DictionaryCache import dictionary_cache
+from noww.Handlers.MetricsSnapshots import MetricsSnapshots
+from django.http import HttpResponse
 
 from nowwapi.utils import base_swagger_responses, upload_to_backet
 
@@ -107,3 +113,63 @@ class UserGroupAccess(APIView):
             user.groups.set(serializer.validated_data['groups'])
             return Response(serializer.data, 200)
         return Response(serializer.errors, 400)
+
+
+class DispatchQueueStats(APIView):
+    permission_classes = (DispatchAccessPolicy,)
+
+    @swagger_auto_schema(
+        tags=['dispatch'],
+        operation_description="Depth of the dispatch queue by job status "
+                              "and latency of the last dispatches in ms",
+        responses=base_swagger_responses(200, 401, 403)
+    )
+    def get(self, request):
+        return Response(DispatchQueue.stats(), 200)
+
+
+class MetricsView(APIView):
+    permission_classes = (MetricsAccessPolicy,)
+
+    @swagger_auto_schema(
+        tags=['dispatch'],
+        operation_description="Histograms of all the processes by name "
+                              "(timings of the dispatch stages in ms, batch "
+                              "sizes etc.), the `counters` (cache hits "
+                              "etc.) and the `gauges` (cache sizes). "
+                              "`?output=prometheus` for the text format",
+        responses=base_swagger_responses(200, 401, 403)
+    )
+    def get(self, request):
+        registry = MetricsSnapshots.collect()
+        if request.query_params.get('output') == 'prometheus':
+            return HttpResponse(registry.prometheus(),
+                                content_type='text/plain; version=0.0.4')
+        # the histograms stay at the top level for the existing consumers
+        return Response({**registry.snapshot(),
+                         'counters': registry.counters(),
+                         'gauges': registry.gauges()}, 200)
+
+
+class DictionaryView(APIView):
+    permission_classes = (DictionaryAccessPolicy,)
+
+    @swagger_auto_schema(
+        tags=['dictionary'],
+        operation_description="Reference data (decline codes etc.). "
+                              "Optional `type` filter, the response is "
+                              "versioned: send the version back in "
+                              "If-None-Match to get 304 while it is the same",
+        responses={**base_swagger_responses(200), 304: 'Not Modified'}
+    )
+    def get(self, request):
+        snapshot = dictionary_cache.snapshot()
+        etag = f'"{snapshot["version"]}"'
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers={'ETag': etag})
+        type_ = request.query_params.get('type')
+        items = snapshot['types'].get(type_, []) if type_ \
+            else snapshot['rows']
+        return Response({'version': snapshot['version'], 'items': items},
+                        200, headers={'ETag': etag})
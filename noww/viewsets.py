@@ -1,4 +1,7 @@
 import json
+import time
+import logging
+import numpy
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from Common import configs
@@ -14,11 +17,16 @@ from nowwapi.utils import CustomSerializerClassMixin
 from .models import *
 from .access import *
 from nowwapi.utils import base_swagger_responses, upload_to_backet, get_datetime_obj
+from noww.Handlers import LocationStore
+from noww.Handlers.Metrics import metrics
+import nowwapi.settings as settings
+
+logger = logging.getLogger()
 
 
 class WorkersViewSet(viewsets.ModelViewSet):
 
-    queryset = Worker.objects.all()
+    queryset = Worker.objects.prefetch_related('profits')
     model = Worker
     serializer_class = WorkerSerializer
     permission_classes = (WorkerAccessPolicy,)
@@ -117,10 +125,105 @@ class WorkersViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, 200)
         return Response(serializer.errors, 400)
 
+    @swagger_auto_schema(
+        tags=['Workers'],
+        operation_description="Verification of many workers at once, "
+                              "result by worker id: verified, "
+                              "already_verified or not_found",
+        request_body=WorkerVerifySerializer,
+        responses=base_swagger_responses(
+            400, 401, 403, kparams={200: WorkerVerifySerializer}
+        )
+    )
+    @action(methods=["POST"], detail=False)
+    def verify(self, request, *args, **kwargs):
+        serializer = WorkerVerifySerializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, 200)
+        return Response(serializer.errors, 400)
+
+    @swagger_auto_schema(
+        tags=['Workers'],
+        operation_description="Positions of the worker collected by the "
+                              "application, points are "
+                              "[latitude, longitude, time in ms]",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['points'],
+            properties={'points': openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(type=openapi.TYPE_ARRAY,
+                                     items=openapi.Schema(
+                                         type=openapi.TYPE_NUMBER)))}
+        ),
+        responses=base_swagger_responses(200, 400, 401, 403)
+    )
+    @action(methods=["POST"], detail=False)
+    def locations(self, request, *args, **kwargs):
+        worker = Worker.objects.filter(user=request.user).only('pk').first()
+        if worker is None:
+            return Response({"detail": "user is not a worker"}, 403)
+        limit = settings.DISPATCH_SETTINGS['LOCATION_BATCH_LIMIT']
+        try:
+            points = numpy.asarray(request.data.get('points'),
+                                   dtype=numpy.float64)
+        except (TypeError, ValueError):
+            return Response({"points": "expected [[lat, lon, time], ...]"},
+                            400)
+        if points.ndim != 2 or points.shape[1] != 3 or not len(points):
+            return Response({"points": "expected [[lat, lon, time], ...]"},
+                            400)
+        if len(points) > limit:
+            return Response({"points": f"more than {limit} points"}, 400)
+        if not numpy.isfinite(points).all() or \
+                (numpy.abs(points[:, 0]) > 90).any() or \
+                (numpy.abs(points[:, 1]) > 180).any():
+            return Response({"points": "invalid coordinates"}, 400)
+
+        points[:, 2] /= 1000
+        now = time.time()
+        # a batch can be sent again after a long offline, only its stale
+        # or too early points are dropped
+        oldest = now - settings.DISPATCH_SETTINGS['LOCATION_MAX_AGE']
+        latest = now + settings.DISPATCH_SETTINGS['LOCATION_MAX_SKEW']
+        in_window = (points[:, 2] >= oldest) & (points[:, 2] <= latest)
+        dropped = len(points) - int(in_window.sum())
+        if dropped:
+            points = points[in_window]
+            metrics.increment('locations.dropped', dropped)
+            logger.warning("dropped %s points of worker %s out of the time "
+                           "window", dropped, worker.pk)
+        moved = LocationStore.ingest(worker.pk, points.tolist()) \
+            if len(points) else 0
+        return Response({'accepted': len(points), 'dropped': dropped,
+                         'moved': moved}, 200)
+
+    @swagger_auto_schema(
+        tags=['Workers'],
+        operation_id="workers_ready_partial_update",
+        operation_description="Readiness of the worker to get offers, "
+                              "used by the dispatch with "
+                              "READINESS_SOURCE = 'db'",
+        request_body=WorkerReadySerializer,
+        responses=base_swagger_responses(200, 400, 401, 403)
+    )
+    @action(methods=["PATCH"], detail=False)
+    def ready(self, request, *args, **kwargs):
+        serializer = WorkerReadySerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, 400)
+        is_ready = serializer.validated_data['is_ready']
+        # one column, no read of the worker
+        if not Worker.objects.filter(user=request.user) \
+                .update(is_ready=is_ready):
+            return Response({"detail": "user is not a worker"}, 403)
+        return Response({'is_ready': is_ready}, 200)
+
 
 class CustomersViewSet(viewsets.ModelViewSet):
 
-    queryset = Customer.objects.all()
+    queryset = Customer.objects.prefetch_related('profits')
     serializer_class = CustomerSerializer
     # authentication_classes = (TokenAuthentication,)
     model = Customer
@@ -431,13 +534,23 @@ class ServicesViewSet(viewsets.ModelViewSet):
 
 
 class PlaceViewSet(CustomSerializerClassMixin, viewsets.ModelViewSet):
-    queryset = Place.objects.all()
+    queryset = Place.objects.prefetch_related('addresses')
     serializer_class = PlaceSerializer
     permission_classes = (PlaceAccessPolicy,)
     action_serializers = {
         'list': PlaceListSerializer
     }
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'retrieve':
+            # the products of the detail with their kinds
+            queryset = queryset.prefetch_related(
+                'place_to_product__kinds__parent',
+                'place_to_product__sub_kinds__parent'
+            )
+        return queryset
+
     @swagger_auto_schema(
         tags=['Places'],
         operation_description="Method to get a list of places",
@@ -219,10 +219,111 @@ SWAGGER_SETTINGS = {
 LOGIN_URL = 'rest_framework:login'
 LOGOUT_URL = 'rest_framework:logout'
 
+# seconds, the Dictionary cache picks up changes of the other processes
+DICTIONARY_CACHE_TTL = 300
+
 PUSH_NOTIFICATIONS_SETTINGS = {
         "FCM_API_KEY": "AAAAt_1lgzc:APA91bGJIlyBwek0_YZ5n9GYvUAJUenD1rsz_ZZbGSBTArAjKw2LvzRJomIbY639_MYAPjJtEfPf6jRwi_wRnoiMgvHZ_G2S58xzNBmRsjS5b8nMJi6whgSKGArW1wFFrpKz-psqXI4Z",
+        # pushes are sent by a background thread in batches,
+        # False - right away in the calling thread
+        "ASYNC": True,
+        "BATCH_SIZE": 500,  # messages, a multicast takes up to 1000 devices
+        "FLUSH_INTERVAL": 0.05,  # seconds to collect a batch
+        # tries of an outbox message, the delay doubles from OUTBOX_BACKOFF
+        "OUTBOX_MAX_TRIES": 5,
+        "OUTBOX_BACKOFF": 5,  # seconds
+        "OUTBOX_BACKOFF_MAX": 300,  # seconds
+        # seconds before a message handed to the sender is taken by the drainer
+        "OUTBOX_LEASE": 60,
+}
+
+DISPATCH_SETTINGS = {
+    # resident index of the worker positions instead of the GeoFire query
+    "WORKER_INDEX": True,
+    "WORKER_INDEX_CELL_SIZE": 0.05,  # degrees
+    # km, radii of the expanding ring search, the last one is the limit
+    "SEARCH_RINGS": [1, 2, 5, 10],
+    # seconds the GeoFire query result of a geohash cell is reused without
+    # the worker index, 0 - no cache. precision 6 is a cell of ~1.2x0.6 km
+    "GEO_CACHE_TTL": 3,
+    "GEO_CACHE_PRECISION": 6,
+    "CANDIDATES_LIMIT": 50,
+    # seconds without a heartbeat after which a worker is not ready
+    "READINESS_TTL": 120,
+    # 'firebase' - the worker_info tree, 'db' - Worker.is_ready set through
+    # /api/workers/ready/
+    "READINESS_SOURCE": 'firebase',
+    # 'db' - jobs are run by `manage.py run_dispatch`, 'inline' - in process
+    "QUEUE": 'db',
+    "QUEUE_POLL_INTERVAL": 0.5,  # seconds
+    "QUEUE_BATCH_SIZE": 10,
+    "QUEUE_MAX_ATTEMPTS": 3,
+    # seconds before the retry of a failed job, doubled by every attempt
+    "QUEUE_RETRY_BACKOFF": 2,
+    # max seconds between the runs of a failed job or of a task waiting for
+    # a ready worker, the wait doubles with the age of the job
+    "QUEUE_RETRY_BACKOFF_MAX": 60,
+    "QUEUE_JOB_TIMEOUT": 300,  # seconds before a running job is requeued
+    # count of the nearest ready workers offered the task at once,
+    # the first one to accept gets it
+    "FANOUT": 1,
+    # seconds to answer the offer before the task goes to the next worker
+    "OFFER_TIMEOUT": 30,
+    # seconds to collect the pending tasks for one batch assignment,
+    # 0 - every task is dispatched on its own. a batch makes one offer per
+    # task, with FANOUT > 1 the tasks are dispatched on their own
+    "BATCH_WINDOW": 0,
+    "BATCH_CANDIDATES": 5,  # nearest ready workers per task in a batch
+    # worker_task writes merged into one firebase update of up to this many
+    # workers or after the interval (seconds), 0 - every write right away
+    "WORKER_TASK_BUFFER": 100,
+    "WORKER_TASK_FLUSH_INTERVAL": 0.05,
+    # source of the worker positions of the index: 'firebase' - the GeoFire
+    # tree, 'backend' - the points posted to /api/workers/locations/
+    "LOCATION_SOURCE": 'firebase',
+    "LOCATION_POLL_INTERVAL": 1,  # seconds between the reads of new points
+    # seconds, older points are not loaded nor accepted by the endpoint
+    "LOCATION_MAX_AGE": 600,
+    "LOCATION_MAX_SKEW": 60,  # seconds a point can be ahead of the server
+    "LOCATION_BATCH_LIMIT": 1000,  # points in one request
+    "LOCATION_RETENTION_MONTHS": 3,
+}
+
+METRICS_SETTINGS = {
+    # timing spans of the dispatch stages, see noww/Handlers/Metrics.py
+    "ENABLED": True,
+    # a json line per dispatch with the task id and the stage timings
+    "LOG_TRACES": True,
+    # seconds between the writes of the registry of a process to the
+    # MetricsSnapshot table, 0 - the stats show this process only
+    "SNAPSHOT_INTERVAL": 10,
+    # rows of the processes not heard of for longer are left out and dropped
+    "SNAPSHOT_MAX_AGE": 60,
+}
+
+# the dispatch traces and info lines (noww.dispatch logger) go to stdout
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'dispatch': {
+            'class': 'logging.StreamHandler',
+            'level': 'INFO',
+        },
+    },
+    'loggers': {
+        'noww.dispatch': {
+            'handlers': ['dispatch'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
 
+# clients of firebase, FCM and the file storage, see Common/providers.py
+# 'live' - the google services, 'memory' - local stand-ins
+EXTERNAL_SERVICES_BACKEND = env.str('EXTERNAL_SERVICES_BACKEND', default='live')
+
 GOOGLE_APPLICATION_CREDENTIALS = "noww_backend/nowwapi/un-5fd42c0c3503.json"
 
 DEFAULT_FILE_STORAGE = 'storages.backends.gcloud.GoogleCloudStorage'
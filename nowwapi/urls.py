@@ -14,7 +14,7 @@ from rest_framework import routers
 from django.utils.inspect import get_func_args
 
 from noww.views import CustomAuthToken, ImageViewSet, AccessGroupView, \
-    UserGroupAccess
+    UserGroupAccess, DispatchQueueStats, DictionaryView, MetricsView
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
@@ -72,6 +72,9 @@ urlpatterns = [
 
     url(r'^api/order/task', TaskHandler.as_view()),
     url(r'^api/order/task/(?P<task_id>\d+)/$', TaskHandler.as_view(), name='task_update'),
+    path('api/dispatch/stats/', DispatchQueueStats.as_view(), name='dispatch_stats'),
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
+    path('api/dictionary/', DictionaryView.as_view(), name='dictionary'),
 
     url(r'^api/upload/', ImageViewSet.as_view(), name='upload'),
     path('api/access_group/', AccessGroupView.as_view(), name='access_group'),
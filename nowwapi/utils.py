@@ -6,7 +6,7 @@ from django.db import connection
 from django.db.models import Sum, Count, Avg
 from rest_framework.exceptions import ParseError
 import nowwapi.settings as settings
-from django.core.files.storage import default_storage
+from Common.providers import providers
 from django.core import validators
 from django.db import models
 
@@ -286,9 +286,10 @@ def upload_to_backet(file):
 
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "nowwapi/un-5fd42c0c3503.json"
     backet = settings.GS_BUCKET_NAME
+    storage = providers.get('storage')
 
-    if not default_storage.exists(file.name):
-        file_g = default_storage.open(file.name, 'w')
+    if not storage.exists(file.name):
+        file_g = storage.open(file.name, 'w')
         file_g.write(file.read())
         file_g.close()
 